@@ -27,8 +27,15 @@ import numbers
 import time
 import numpy as np
 
-import spidev
-import RPi.GPIO as GPIO
+try:
+    import spidev
+except ImportError:
+    spidev = None
+
+try:
+    import RPi.GPIO as GPIO
+except ImportError:
+    GPIO = None
 
 
 __version__ = '0.0.3'
@@ -38,6 +45,12 @@ BG_SPI_CS_FRONT = 1
 
 SPI_CLOCK_HZ = 16000000
 
+SPIDEV_BUFSIZ_FILE = "/sys/module/spidev/parameters/bufsiz"  # largest transfer the spidev driver takes
+DEFAULT_CHUNK_SIZE = 4096  # spidev's default bufsiz
+
+MERGE_WINDOWS = 16  # most changed areas flush() tries merging in every pair - see _dirty_windows()
+FRAME_MEMORY_LINES = 320  # the controller's frame memory is 240 x 320, the panel shows 240 lines of it
+
 ST7789_NOP = 0x00
 ST7789_SWRESET = 0x01
 ST7789_RDDID = 0x04
@@ -59,7 +72,9 @@ ST7789_RAMWR = 0x2C
 ST7789_RAMRD = 0x2E
 
 ST7789_PTLAR = 0x30
+ST7789_VSCRDEF = 0x33
 ST7789_MADCTL = 0x36
+ST7789_VSCSAD = 0x37
 ST7789_COLMOD = 0x3A
 
 ST7789_FRMCTR1 = 0xB1
@@ -92,13 +107,42 @@ ST7789_GMCTRN1 = 0xE1
 ST7789_PWCTR6 = 0xFC
 
 
+# One byte payloads for command and parameter bytes, made once
+_BYTE_VALUES = [bytes((value,)) for value in range(256)]
+
+
+def spidev_bufsiz(path=SPIDEV_BUFSIZ_FILE, default=DEFAULT_CHUNK_SIZE):
+    """Largest single transfer the spidev driver accepts, from its bufsiz module parameter (raise it with
+    spidev.bufsiz=<bytes> on the kernel command line), or default if it can't be read.
+    """
+    try:
+        with open(path) as f:
+            return max(1, int(f.read().strip()))
+    except (OSError, ValueError):
+        return default
+
+
+def color565(r, g, b):
+    """Pack 8-bit red, green and blue into a 16-bit 565 RGB value - works on NumPy arrays of them too."""
+    return ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+
+
+def image_to_rgb565(image):
+    """Convert a PIL image to a 2D array of 16-bit 565 RGB values."""
+    # NumPy is much faster at doing this. NumPy code provided by:
+    # Keith (https://www.blogger.com/profile/02555547344016007163)
+    pb = np.array(image.convert('RGB')).astype('uint16')
+    return color565(pb[:,:,0], pb[:,:,1], pb[:,:,2])
+
+
 class ST7789(object):
     """Representation of an ST7789 TFT LCD."""
 
     def __init__(self, port, cs, dc, backlight=None, rst=None, width=240,
                  height=240, rotation=90, invert=True, spi_speed_hz=4000000,
                  offset_left=0,
-                 offset_top=0):
+                 offset_top=0, tile_size=8, window_cost=64, spi=None, gpio=None, chunk_size=None,
+                 command_speed_hz=None, data_speed_hz=None):
         """Create an instance of the display using SPI communication.
         Must provide the GPIO pin number for the D/C pin and the SPI driver.
         Can optionally provide the GPIO pin number for the reset pin as the rst parameter.
@@ -111,15 +155,43 @@ class ST7789(object):
         :param rotation: Rotation of display connected to ST7789
         :param invert: Invert display
         :param spi_speed_hz: SPI speed (in Hz)
+        :param tile_size: Size in pixels of the tiles used to find changed areas of the framebuffer
+        :param window_cost: Overhead of sending an extra window, in pixel data bytes.  Higher values
+                            merge more changed areas into fewer, larger windows when flushing
+        :param spi: SPI device to use instead of spidev.SpiDev(port, cs) - anything with the spidev
+                    writebytes2 (or writebytes) method, such as a stand-in device for benchmarks
+        :param gpio: GPIO module to use instead of RPi.GPIO
+        :param chunk_size: Most bytes sent in one SPI transfer - the spidev driver's bufsiz if None
+        :param command_speed_hz: SPI speed for command bytes, spi_speed_hz if None
+        :param data_speed_hz: SPI speed for parameters and pixel data, spi_speed_hz if None
         """
 
-        GPIO.setwarnings(False)
-        GPIO.setmode(GPIO.BCM)
-
-        self._spi = spidev.SpiDev(port, cs)
+        if gpio is None:
+            if GPIO is None:
+                raise ImportError("RPi.GPIO is required unless a gpio module is given")
+            gpio = GPIO
+        self._gpio = gpio
+        gpio.setwarnings(False)
+        gpio.setmode(gpio.BCM)
+
+        if spi is None:
+            if spidev is None:
+                raise ImportError("spidev is required unless an spi device is given")
+            spi = spidev.SpiDev(port, cs)
+        self._spi = spi
         self._spi.mode = 0
         self._spi.lsbfirst = False
         self._spi.max_speed_hz = spi_speed_hz
+        self._speed_hz = spi_speed_hz
+        # SPI clock for each kind of transfer - changed (one ioctl) only when the kind being sent changes
+        self.spi_speeds = {
+            "command": command_speed_hz or spi_speed_hz,
+            "data": data_speed_hz or spi_speed_hz,
+        }
+        # Largest transfer the driver allows - bulk pixel data is split into chunks of this size
+        self.chunk_size = chunk_size or spidev_bufsiz()
+        # writebytes2 (spidev 3.4+) takes any buffer, older versions need a list
+        self._write = getattr(self._spi, 'writebytes2', None)
 
         self._dc = dc
         self._rst = rst
@@ -131,44 +203,97 @@ class ST7789(object):
         self._offset_left = offset_left
         self._offset_top = offset_top
 
+        # Shadow framebuffer of RGB565 values.  Callers draw into _framebuffer and flush() sends only the
+        # areas that differ from _panel, the copy of what the display currently shows.
+        self._framebuffer = np.zeros((self.height, self.width), dtype=np.uint16)
+        self._panel = np.zeros((self.height, self.width), dtype=np.uint16)
+        self._panel_valid = False  # panel contents unknown until the first full flush
+        self.tile_size = tile_size
+        self.window_cost = window_cost
+
+        # Pre-encoded RGB565 payloads for small fixed images, see blit_sprite()
+        self._sprites = {}
+
+        # Counters - total SPI bytes sent, and the bytes / windows sent by the last flush()
+        self.spi_bytes = 0
+        self.spi_transactions = 0
+        self.flush_bytes = 0
+        self.flush_windows = 0
+        self.flush_transactions = 0
+        self._frame_start = (0, 0)
+
+        # Column and row ranges last sent with CASET / RASET, so unchanged ranges aren't sent again
+        self._window_columns = None
+        self._window_rows = None
+
         # Set DC as output.
-        GPIO.setup(dc, GPIO.OUT)
+        gpio.setup(dc, gpio.OUT)
 
         # Setup backlight as output (if provided).
         self._backlight = backlight
         if backlight is not None:
-            GPIO.setup(backlight, GPIO.OUT)
-            GPIO.output(backlight, GPIO.LOW)
+            gpio.setup(backlight, gpio.OUT)
+            gpio.output(backlight, gpio.LOW)
             time.sleep(0.1)
-            GPIO.output(backlight, GPIO.HIGH)
+            gpio.output(backlight, gpio.HIGH)
 
         # Setup reset as output (if provided).
         if rst is not None:
-            GPIO.setup(rst, GPIO.OUT)
+            gpio.setup(rst, gpio.OUT)
 
         self.reset()
         self._init()
 
-    def send(self, data, is_data=True, chunk_size=4096):
+    def send(self, data, is_data=True, chunk_size=None):
         """Write a byte or array of bytes to the display. Is_data parameter
         controls if byte should be interpreted as display data (True) or command
         data (False).  Chunk_size is an optional size of bytes to write in a
-        single SPI transaction, with a default of 4096.
+        single SPI transaction, defaulting to the largest the driver allows.
+        Data can be a number, a list of byte values or any bytes-like buffer
+        (bytes, bytearray, memoryview, NumPy array) which is sent without copying.
         """
         # Set DC low for command, high for data.
-        GPIO.output(self._dc, is_data)
-        # Convert scalar argument to list so either can be passed as parameter.
+        self._gpio.output(self._dc, is_data)
+        speed = self.spi_speeds["data" if is_data else "command"]
+        if speed != self._speed_hz:
+            self._spi.max_speed_hz = speed
+            self._speed_hz = speed
+        # Convert scalar or list argument to a byte buffer so any can be passed as parameter.
         if isinstance(data, numbers.Number):
-            data = [data & 0xFF]
-        # Write data a chunk at a time.
-        for start in range(0, len(data), chunk_size):
-            end = min(start + chunk_size, len(data))
-            self._spi.xfer(data[start:end])
+            data = _BYTE_VALUES[data & 0xFF]
+        elif isinstance(data, (list, tuple)):
+            data = bytes(data)
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+        if not isinstance(data, bytes):
+            data = memoryview(data).cast('B')
+        size = len(data)
+        if not size:
+            return
+        self.spi_bytes += size
+        write = self._write
+        if size <= chunk_size:
+            # Fast path for anything that fits one transfer - commands, parameters and small sprites
+            self.spi_transactions += 1
+            if write is not None:
+                write(data)
+            else:
+                self._spi.writebytes(list(data))
+            return
+        # Write data a chunk at a time - memoryview slices share the buffer rather than copying it.
+        if isinstance(data, bytes):
+            data = memoryview(data)
+        self.spi_transactions += -(-size // chunk_size)
+        for start in range(0, size, chunk_size):
+            if write is not None:
+                write(data[start:start + chunk_size])
+            else:
+                self._spi.writebytes(data[start:start + chunk_size].tolist())
 
     def set_backlight(self, value):
         """Set the backlight on/off."""
         if self._backlight is not None:
-            GPIO.output(self._backlight, value)
+            self._gpio.output(self._backlight, value)
 
     @property
     def width(self):
@@ -186,19 +311,32 @@ class ST7789(object):
         """Write a byte or array of bytes to the display as display data."""
         self.send(data, True)
 
+    def command_params(self, command, params):
+        """Write a command followed by its parameter bytes, sent as a single data transfer."""
+        self.send(command, False)
+        self.send(bytes(params), True)
+
+    def frame_counters(self):
+        """Return the SPI bytes and transactions sent since the last call, as a dictionary."""
+        bytes_sent = self.spi_bytes - self._frame_start[0]
+        transactions = self.spi_transactions - self._frame_start[1]
+        self._frame_start = (self.spi_bytes, self.spi_transactions)
+        return {"bytes": bytes_sent, "transactions": transactions}
+
     def reset(self):
         """Reset the display, if reset pin is connected."""
         if self._rst is not None:
-            GPIO.output(self._rst, 1)
+            self._gpio.output(self._rst, 1)
             time.sleep(0.500)
-            GPIO.output(self._rst, 0)
+            self._gpio.output(self._rst, 0)
             time.sleep(0.500)
-            GPIO.output(self._rst, 1)
+            self._gpio.output(self._rst, 1)
             time.sleep(0.500)
 
     def _init(self):
         # Initialize the display.
 
+        self._window_columns = self._window_rows = None  # reset clears the address window
         self.command(ST7789_SWRESET)    # Software reset
         time.sleep(0.150)               # delay 150 ms
 
@@ -294,6 +432,8 @@ class ST7789(object):
         should define the minimum and maximum y pixel bound.  If no parameters
         are specified the default will be to update the entire display from 0,0
         to width-1,height-1.
+        CASET and RASET are each sent as one command + 4 byte parameter transfer,
+        and skipped when the column or row range is unchanged since the last call.
         """
         if x1 is None:
             x1 = self._width - 1
@@ -307,16 +447,14 @@ class ST7789(object):
         x0 += self._offset_left
         x1 += self._offset_left
 
-        self.command(ST7789_CASET)       # Column addr set
-        self.data(x0 >> 8)
-        self.data(x0 & 0xFF)             # XSTART
-        self.data(x1 >> 8)
-        self.data(x1 & 0xFF)             # XEND
-        self.command(ST7789_RASET)       # Row addr set
-        self.data(y0 >> 8)
-        self.data(y0 & 0xFF)             # YSTART
-        self.data(y1 >> 8)
-        self.data(y1 & 0xFF)             # YEND
+        if (x0, x1) != self._window_columns:
+            # Column addr set - XSTART, XEND
+            self.command_params(ST7789_CASET, (x0 >> 8, x0 & 0xFF, x1 >> 8, x1 & 0xFF))
+            self._window_columns = (x0, x1)
+        if (y0, y1) != self._window_rows:
+            # Row addr set - YSTART, YEND
+            self.command_params(ST7789_RASET, (y0 >> 8, y0 & 0xFF, y1 >> 8, y1 & 0xFF))
+            self._window_rows = (y0, y1)
         self.command(ST7789_RAMWR)       # write to RAM
 
     def display(self, image=None, x0=0, y0=0, x1=None, y1=None):
@@ -336,23 +474,241 @@ class ST7789(object):
             y1 = self.height-1
         self.set_window(x0, y0, x1, y1)
     
-        # Convert image to array of 16bit 565 RGB data bytes.
-        # Unfortunate that this copy has to occur, but the SPI byte writing
-        # function needs to take an array of bytes and PIL doesn't natively
-        # store images in 16-bit 565 RGB format.
-        pixelbytes = list(self.image_to_data(image))
+        # Convert image to 16bit 565 RGB data bytes.  PIL doesn't natively
+        # store images in 16-bit 565 RGB format, but the converted array is
+        # sent straight from its own buffer without any list copies.
+        color = self.image_to_rgb565(image)
         # Write data to hardware.
-        self.data(pixelbytes)
+        self.data(self.rgb565_to_data(color))
+
+        # Keep the shadow framebuffer in step with what was sent directly
+        if color.shape == (y1 - y0 + 1, x1 - x0 + 1):
+            self._framebuffer[y0:y1 + 1, x0:x1 + 1] = color
+            self._panel[y0:y1 + 1, x0:x1 + 1] = color
+
+    def image_to_rgb565(self, image):
+        """Convert a PIL image to a 2D array of 16-bit 565 RGB values."""
+        return image_to_rgb565(image)
 
     def image_to_data(self, image):
-        # This function was obtained to support a more flexible 'display' function
-        #"""Generator function to convert a PIL image to 16-bit 565 RGB bytes."""
-        # NumPy is much faster at doing this. NumPy code provided by:
-        # Keith (https://www.blogger.com/profile/02555547344016007163)
-        pb = np.array(image.convert('RGB')).astype('uint16')
-        color = ((pb[:,:,0] & 0xF8) << 8) | ((pb[:,:,1] & 0xFC) << 3) | (pb[:,:,2] >> 3)
-        temp = np.dstack(((color >> 8) & 0xFF, color & 0xFF)).flatten().tolist()
-        return temp
+        """Convert a PIL image to a contiguous buffer of big-endian 16-bit 565 RGB bytes."""
+        return self.rgb565_to_data(self.image_to_rgb565(image))
+
+    @staticmethod
+    def rgb565_to_data(color):
+        """Return a byte memoryview of an array of RGB565 values in the display's big-endian order.
+        A single contiguous copy is made (the byte swap) and the memoryview shares it.
+        """
+        return memoryview(np.ascontiguousarray(color, dtype='>u2')).cast('B')
+
+    def draw_image(self, image, x=0, y=0):
+        """Draw a PIL image into the shadow framebuffer with its top left corner at x, y.
+        Nothing is sent to the display until flush() is called.
+        """
+        color = self.image_to_rgb565(image)
+        self._blit(color, x, y)
+
+    def draw_rgb565(self, color, x=0, y=0):
+        """Draw a 2D array of RGB565 values (e.g. a pre-rendered screen) into the shadow framebuffer
+        with its top left corner at x, y.  Nothing is sent to the display until flush() is called.
+        """
+        self._blit(color, x, y)
+
+    def fill_rect(self, x0, y0, x1, y1, color):
+        """Fill the inclusive rectangle x0,y0 - x1,y1 of the shadow framebuffer with an (r, g, b) colour."""
+        x0, y0 = max(x0, 0), max(y0, 0)
+        self._framebuffer[y0:y1 + 1, x0:x1 + 1] = color565(*color)
+
+    def _blit(self, color, x, y):
+        # Copy an array of RGB565 values into the framebuffer, clipped to the screen
+        height, width = self._framebuffer.shape
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + color.shape[1], width), min(y + color.shape[0], height)
+        if x0 < x1 and y0 < y1:
+            self._framebuffer[y0:y1, x0:x1] = color[y0 - y:y1 - y, x0 - x:x1 - x]
+
+    def cache_sprite(self, image):
+        """Pre-encode a fixed PIL image for blit_sprite().  Images are cached by identity and size,
+        so an image must not be drawn on after it has been cached.
+        Returns the cache entry (image, RGB565 array, payload bytes).
+        """
+        key = (id(image), image.size)
+        sprite = self._sprites.get(key)
+        if sprite is None or sprite[0] is not image:
+            color = self.image_to_rgb565(image)
+            sprite = (image, color, bytes(self.rgb565_to_data(color)))
+            self._sprites[key] = sprite
+        return sprite
+
+    def blit_sprite(self, image, x, y):
+        """Send a cached sprite straight to the display with its top left corner at x, y.
+        Costs only the window setup and the pre-built payload - no conversion is done after the first use.
+        """
+        _, color, payload = self.cache_sprite(image)
+        height, width = color.shape
+        x1, y1 = x + width - 1, y + height - 1
+        if x < 0 or y < 0 or x1 >= self._framebuffer.shape[1] or y1 >= self._framebuffer.shape[0]:
+            # Partly off screen - clip through the framebuffer instead
+            self._blit(color, x, y)
+            self.flush()
+            return
+        self.set_window(x, y, x1, y1)
+        self.data(payload)
+        # Keep the shadow framebuffer in step with what was sent directly
+        self._framebuffer[y:y1 + 1, x:x1 + 1] = color
+        self._panel[y:y1 + 1, x:x1 + 1] = color
+
+    def set_scroll_area(self, top_fixed=0, bottom_fixed=0):
+        """Define the vertical scrolling area (VSCRDEF) - top_fixed and bottom_fixed frame memory lines
+        stay in place and the lines between them scroll.
+        """
+        scroll = FRAME_MEMORY_LINES - top_fixed - bottom_fixed
+        self.command_params(ST7789_VSCRDEF, (top_fixed >> 8, top_fixed & 0xFF, scroll >> 8, scroll & 0xFF,
+                                             bottom_fixed >> 8, bottom_fixed & 0xFF))
+
+    def scroll_to(self, line):
+        """Show the scrolling area from frame memory line 'line' (VSCSAD), wrapping round at its end.
+        Only the command is sent - nothing in frame memory is rewritten.
+        """
+        self.command_params(ST7789_VSCSAD, (line >> 8, line & 0xFF))
+
+    def reset_scroll(self):
+        """Put the scrolling back to normal, and resend the whole framebuffer on the next flush()."""
+        self.set_scroll_area()
+        self.scroll_to(0)
+        self.invalidate()
+
+    def write_memory(self, color, x, line, payload=None):
+        """Send an array of RGB565 values straight to frame memory with its top left corner at column x,
+        memory line 'line', wrapping round from the last of the 320 lines to the first.  Used while scrolling,
+        when the frame memory holds more than the screen - the shadow framebuffer isn't kept in step, so
+        call reset_scroll() or invalidate() before going back to flush().
+        :param payload: color already as display bytes (e.g. a cached sprite's), used when it doesn't wrap
+        """
+        height, width = color.shape
+        line %= FRAME_MEMORY_LINES
+        if line + height <= FRAME_MEMORY_LINES:
+            self.set_window(x, line, x + width - 1, line + height - 1)
+            self.data(payload if payload is not None else self.rgb565_to_data(color))
+            return
+        split = FRAME_MEMORY_LINES - line
+        self.set_window(x, line, x + width - 1, FRAME_MEMORY_LINES - 1)
+        self.data(self.rgb565_to_data(color[:split]))
+        self.set_window(x, 0, x + width - 1, height - split - 1)
+        self.data(self.rgb565_to_data(color[split:]))
+
+    def invalidate(self):
+        """Forget what the display is showing so the next flush() resends the whole framebuffer."""
+        self._panel_valid = False
+
+    def flush(self):
+        """Send the changed areas of the shadow framebuffer to the display.
+        Returns the number of SPI bytes sent, also kept in flush_bytes.
+        """
+        start_bytes = self.spi_bytes
+        start_transactions = self.spi_transactions
+        if self._panel_valid:
+            windows = self._dirty_windows()
+        else:
+            height, width = self._framebuffer.shape
+            windows = [(0, 0, width - 1, height - 1)]
+        for x0, y0, x1, y1 in windows:
+            block = self._framebuffer[y0:y1 + 1, x0:x1 + 1]
+            self.set_window(x0, y0, x1, y1)
+            self.data(self.rgb565_to_data(block))
+            self._panel[y0:y1 + 1, x0:x1 + 1] = block
+        self._panel_valid = True
+        self.flush_windows = len(windows)
+        self.flush_bytes = self.spi_bytes - start_bytes
+        self.flush_transactions = self.spi_transactions - start_transactions
+        return self.flush_bytes
+
+    def _window_cost(self, x0, y0, x1, y1):
+        # Cost of sending a window, in bytes - 2 bytes per pixel plus the fixed per-window overhead
+        return (x1 - x0 + 1) * (y1 - y0 + 1) * 2 + self.window_cost
+
+    def _dirty_windows(self):
+        # Find the changed areas of the framebuffer as a list of inclusive (x0, y0, x1, y1) windows
+        changed = self._framebuffer != self._panel
+        if not changed.any():
+            return []
+
+        # Reduce the changed pixels to a grid of changed tiles
+        tile = max(1, self.tile_size)
+        height, width = changed.shape
+        rows, cols = -(-height // tile), -(-width // tile)
+        padded = np.zeros((rows * tile, cols * tile), dtype=bool)
+        padded[:height, :width] = changed
+        tiles = padded.reshape(rows, tile, cols, tile).any(axis=(1, 3))
+
+        # Runs of changed tiles along each tile row, extended downwards while the run below matches
+        windows = []
+        open_runs = {}
+        for ty in range(rows):
+            runs = {}
+            edges = np.flatnonzero(np.diff(np.concatenate(([0], tiles[ty].view(np.int8), [0]))))
+            for tx0, tx1 in zip(edges[0::2], edges[1::2]):
+                window = open_runs.pop((tx0, tx1), None)
+                if window is None:
+                    window = [tx0, ty, tx1 - 1, ty]
+                    windows.append(window)
+                window[3] = ty
+                runs[(tx0, tx1)] = window
+            open_runs = runs
+
+        # Convert to pixels and shrink each window to the changed pixels it holds
+        rects = []
+        for tx0, ty0, tx1, ty1 in windows:
+            x0, y0 = tx0 * tile, ty0 * tile
+            area = changed[y0:(ty1 + 1) * tile, x0:(tx1 + 1) * tile]
+            ys = np.flatnonzero(area.any(axis=1))
+            xs = np.flatnonzero(area.any(axis=0))
+            rects.append((x0 + xs[0], y0 + ys[0], x0 + xs[-1], y0 + ys[-1]))
+
+        # Merging every pair costs the square of the number of windows per pass, so with many changed areas
+        # first merge each into the one before it in a single pass down the screen, and if that still leaves
+        # too many send their bounding box when that costs no more than sending them all
+        if len(rects) > MERGE_WINDOWS:
+            rects = self._merge_in_order(rects)
+        if len(rects) > MERGE_WINDOWS:
+            bounds = (min(r[0] for r in rects), min(r[1] for r in rects),
+                      max(r[2] for r in rects), max(r[3] for r in rects))
+            if self._window_cost(*bounds) <= sum(self._window_cost(*r) for r in rects):
+                rects = [bounds]
+            return [tuple(int(v) for v in rect) for rect in rects]
+
+        # Merge windows while sending the combined window costs no more than sending both separately
+        merged = True
+        while merged and len(rects) > 1:
+            merged = False
+            best = None
+            for i in range(len(rects)):
+                for j in range(i + 1, len(rects)):
+                    a, b = rects[i], rects[j]
+                    union = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    saving = self._window_cost(*a) + self._window_cost(*b) - self._window_cost(*union)
+                    if saving >= 0 and (best is None or saving > best[0]):
+                        best = (saving, i, j, union)
+            if best is not None:
+                _, i, j, union = best
+                rects[i] = union
+                del rects[j]
+                merged = True
+        return [tuple(int(v) for v in rect) for rect in rects]
+
+    def _merge_in_order(self, rects):
+        # One pass over the windows from the top of the screen down, merging each into the last window kept
+        # when sending the combined window costs no more than sending both
+        kept = []
+        for rect in sorted(rects, key=lambda r: (r[1], r[0])):
+            if kept:
+                last = kept[-1]
+                union = (min(last[0], rect[0]), min(last[1], rect[1]), max(last[2], rect[2]), max(last[3], rect[3]))
+                if self._window_cost(*union) <= self._window_cost(*last) + self._window_cost(*rect):
+                    kept[-1] = union
+                    continue
+            kept.append(rect)
+        return kept
 
 # Original library routine did not support part screen updated.
 #    def display(self, image):
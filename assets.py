@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : assets.py
+# Description : Asset cache for the Marble Maze.
+#               Fonts and resized images are loaded from the SD card once and kept.  The static parts
+#               of whole screens (menu, maze completed) are kept as RGB565 arrays ready to copy into the
+#               display's framebuffer, and saved to a cache file so the next start doesn't have to decode
+#               the PNGs and draw them again.  A saved screen is only used while the files it was drawn
+#               from are unchanged (same modification time and size).
+############################################################################
+
+import json
+import os
+import time
+
+import numpy as np
+from PIL import Image, ImageFont
+
+from ST7789 import image_to_rgb565
+
+FONT_FILE = '/usr/share/fonts/truetype/freefont/FreeSans.ttf'
+CACHE_FILE = "assets_cache.npz"
+
+
+def load_font(font_file, size):
+    # Load a font at a size, falling back to PIL's built in font where the font file isn't installed
+    if os.path.isfile(font_file):
+        return ImageFont.truetype(font_file, size)
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:  # Pillow before 10.1 has a single fixed size default font
+        return ImageFont.load_default()
+
+
+def _image_bytes(image):
+    return image.size[0] * image.size[1] * len(image.getbands())
+
+
+def _source_key(paths):
+    # Identifies the versions of the files a screen was drawn from - a missing file is part of the key too
+    key = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            key.append([path, stat.st_mtime_ns, stat.st_size])
+        except OSError:
+            key.append([path, None, None])
+    return json.dumps(key)
+
+
+class AssetCache(object):
+    """Fonts, resized images and pre-rendered RGB565 screens, each loaded or drawn only once."""
+
+    def __init__(self, cache_file=CACHE_FILE, font_file=FONT_FILE):
+        """Create the cache, reading any screens saved by an earlier run.
+        :param cache_file: File the pre-rendered screens are saved in, None to keep them in memory only
+        :param font_file: TrueType font used by font()
+        """
+        self.cache_file = cache_file
+        self.font_file = font_file
+        self._fonts = {}
+        self._images = {}
+        self._screens = {}      # name -> (source key, RGB565 array)
+        self._saved = {}        # name -> (source key, RGB565 array) read from the cache file
+        self._changed = False
+        self._stats = {}        # asset -> {"load_ms", "bytes", "from"}
+        self._read_cache()
+
+    def font(self, size):
+        """The font at a point size."""
+        font = self._fonts.get(size)
+        if font is None:
+            start = time.perf_counter()
+            font = load_font(self.font_file, size)
+            self._fonts[size] = font
+            size_bytes = os.path.getsize(self.font_file) if os.path.isfile(self.font_file) else 0
+            self._record("font {}".format(size), start, size_bytes, "file")
+        return font
+
+    def image(self, path, size=None):
+        """The image from a file, resized to size (width, height) if given.
+        The same image object is returned each time, so it must not be drawn on.
+        """
+        key = (path, size)
+        image = self._images.get(key)
+        if image is None:
+            start = time.perf_counter()
+            image = Image.open(path)
+            image = image.resize(size) if size is not None else image.copy()  # loads it and closes the file
+            self._images[key] = image
+            self._record("image {} {}x{}".format(path, *image.size), start, _image_bytes(image), "file")
+        return image
+
+    def screen(self, name, sources, render):
+        """The RGB565 array for a screen.
+        :param name: Name the screen is cached under
+        :param sources: Files the screen is drawn from - it is drawn again when any of them changes
+        :param render: Function returning the screen as a PIL image, only called when not cached
+        """
+        key = _source_key(sources)
+        cached = self._screens.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        start = time.perf_counter()
+        saved = self._saved.get(name)
+        if saved is not None and saved[0] == key:
+            color = saved[1]
+            source = "cache"
+        else:
+            color = image_to_rgb565(render())
+            color.setflags(write=False)
+            self._changed = True
+            source = "render"
+        self._screens[name] = (key, color)
+        self._record("screen " + name, start, color.nbytes, source)
+        return color
+
+    def save(self):
+        """Write the screens to the cache file if any were drawn since it was read."""
+        if self.cache_file is None or not self._changed:
+            return
+        arrays = {}
+        keys = {}
+        for name, (key, color) in self._screens.items():
+            arrays["screen_" + name] = color
+            keys[name] = key
+        temp = self.cache_file + ".tmp"
+        try:
+            with open(temp, "wb") as f:
+                np.savez(f, keys=np.array(json.dumps(keys)), **arrays)
+            os.replace(temp, self.cache_file)   # never leave a half written cache
+            self._changed = False
+        except OSError:
+            pass  # caching is only an optimisation
+
+    def stats(self):
+        """Load time in ms, memory held in bytes and where it came from ('file', 'cache' or 'render') per asset."""
+        return {name: dict(entry) for name, entry in self._stats.items()}
+
+    def memory(self):
+        """Total bytes held by the cached images and screens."""
+        return (sum(_image_bytes(image) for image in self._images.values()) +
+                sum(color.nbytes for _, color in self._screens.values()))
+
+    def _record(self, name, start, size_bytes, source):
+        self._stats[name] = {
+            "load_ms": (time.perf_counter() - start) * 1000,
+            "bytes": size_bytes,
+            "from": source,
+        }
+
+    def _read_cache(self):
+        if self.cache_file is None:
+            return
+        try:
+            with np.load(self.cache_file) as cache:
+                keys = json.loads(str(cache["keys"]))
+                for name, key in keys.items():
+                    color = cache["screen_" + name]
+                    color.setflags(write=False)
+                    self._saved[name] = (key, color)
+        except (OSError, KeyError, ValueError):
+            self._saved = {}  # no cache yet, or unreadable - screens are drawn again
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : backends.py
+# Description : Pluggable hardware for the Marble Maze.
+#               'hardware' uses the real I2C gyro (smbus), ST7789 display (spidev + RPi.GPIO) and gpiozero
+#               buttons.  'headless' uses in-memory stand-ins so the real game loop can run and be measured
+#               on any Linux box:
+#                 ScriptedBus   - MPU6050 registers + FIFO replaying a scripted tilt sequence
+#                 VirtualSpi    - decodes CASET / RASET / RAMWR / VSCSAD into a virtual framebuffer
+#                 VirtualGpio   - RPi.GPIO stand-in remembering pin levels (the display's D/C pin)
+#                 VirtualButton - gpiozero Button stand-in, press() injects a button event
+#               Select with the MARBLE_MAZE_BACKEND environment variable (default 'hardware').
+############################################################################
+
+import os
+import struct
+import time
+
+import numpy as np
+from PIL import Image
+
+import mpu6050
+from ST7789 import ST7789, ST7789_CASET, ST7789_RASET, ST7789_RAMWR, ST7789_VSCSAD
+
+BACKEND_ENV = "MARBLE_MAZE_BACKEND"
+
+# Pins used on the Pirate Audio board (BCM numbering)
+DC_PIN = 9
+BACKLIGHT_PIN = 13
+BUTTON_PINS = (5, 6, 16, 24)
+
+SPI_SPEED_MHZ = 80
+
+
+class ScriptedBus(object):
+    """SMBus stand-in emulating the MPU6050 registers and FIFO, replaying a tilt script.
+    The script is a list of (duration in seconds, ax, ay) segments in g, repeated if loop is True.
+    """
+
+    def __init__(self, script=((1.0, 0.0, 0.0),), loop=True, clock=time.monotonic):
+        self.script = list(script)
+        self.loop = loop
+        self._clock = clock
+        self._registers = {}
+        self._start = clock()
+        self._fifo_start = self._start
+        self._fifo_read = 0
+        self.reads = 0     # I2C read transactions
+        self.writes = 0    # I2C write transactions
+
+    def set_script(self, script, loop=True):
+        """Replace the tilt script, restarting it from now."""
+        self.script = list(script)
+        self.loop = loop
+        self._start = self._clock()
+
+    def tilt(self, now):
+        """Scripted (ax, ay) tilt in g at time 'now'."""
+        total = sum(segment[0] for segment in self.script)
+        elapsed = now - self._start
+        if total <= 0:
+            return 0.0, 0.0
+        if self.loop:
+            elapsed %= total
+        for duration, ax, ay in self.script:
+            if elapsed < duration:
+                return ax, ay
+            elapsed -= duration
+        return self.script[-1][1], self.script[-1][2]
+
+    def _sample_rate(self):
+        return 8000.0 / (1 + self._registers.get(mpu6050.SMPLRT_DIV, 0))
+
+    def _raw_accel(self, when):
+        ax, ay = self.tilt(when)
+        return [int(max(-32768, min(32767, round(v * mpu6050.ACCEL_SCALE)))) for v in (ax, ay, 1.0)]
+
+    def _fifo_samples(self):
+        # Samples put in the FIFO since it was reset that haven't been read yet
+        if not self._registers.get(mpu6050.USER_CTRL, 0) & mpu6050.USER_FIFO_EN:
+            return 0
+        produced = int((self._clock() - self._fifo_start) * self._sample_rate())
+        return produced - self._fifo_read
+
+    def write_byte_data(self, address, register, value):
+        self.writes += 1
+        self._registers[register] = value
+        if register == mpu6050.USER_CTRL and value & mpu6050.USER_FIFO_RESET:
+            self._fifo_start = self._clock()
+            self._fifo_read = 0
+
+    def read_byte_data(self, address, register):
+        self.reads += 1
+        if register == mpu6050.INT_STATUS:
+            overflow = self._fifo_samples() * mpu6050.SAMPLE_BYTES > mpu6050.FIFO_SIZE
+            return mpu6050.FIFO_OFLOW_INT if overflow else 0
+        return self._registers.get(register, 0)
+
+    def read_i2c_block_data(self, address, register, length):
+        self.reads += 1
+        if register == mpu6050.FIFO_COUNTH:
+            count = min(self._fifo_samples() * mpu6050.SAMPLE_BYTES, mpu6050.FIFO_SIZE)
+            return [count >> 8, count & 0xFF][:length]
+        if register == mpu6050.FIFO_R_W:
+            data = []
+            period = 1.0 / self._sample_rate()
+            for _ in range(length // mpu6050.SAMPLE_BYTES):
+                when = self._fifo_start + self._fifo_read * period
+                data.extend(struct.pack('>hhh', *self._raw_accel(when)))
+                self._fifo_read += 1
+            return data
+        # Plain register block read - accelerometer, temperature and gyro from ACCEL_XOUT_H
+        data = list(struct.pack('>hhh', *self._raw_accel(self._clock()))) + [0] * 8
+        offset = register - mpu6050.ACCEL_XOUT_H
+        return data[offset:offset + length] if 0 <= offset < len(data) else [0] * length
+
+
+class VirtualGpio(object):
+    """RPi.GPIO stand-in that remembers the level of each output pin."""
+    BCM = 11
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+
+    def __init__(self):
+        self.levels = {}
+
+    def setwarnings(self, flag):
+        pass
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, direction):
+        self.levels.setdefault(pin, self.LOW)
+
+    def output(self, pin, value):
+        self.levels[pin] = int(bool(value))
+
+    def input(self, pin):
+        return self.levels.get(pin, self.LOW)
+
+
+class VirtualSpi(object):
+    """spidev stand-in decoding ST7789 commands into a virtual framebuffer of RGB565 values.
+    The D/C pin level on the VirtualGpio says whether each transfer is a command or data.
+    """
+
+    def __init__(self, gpio, dc=DC_PIN, width=240, height=320):
+        self.max_speed_hz = 0
+        self.mode = 0
+        self.lsbfirst = False
+        self._gpio = gpio
+        self._dc = dc
+        # ST7789 frame memory is 240 x 320 - the panel shows 240 rows of it
+        self.framebuffer = np.zeros((height, width), dtype=np.uint16)
+        self._command = None
+        self._params = []
+        self._columns = (0, width - 1)
+        self._rows = (0, height - 1)
+        self._pointer = None
+        self._pending = b''
+        self.scroll = 0  # frame memory line shown at the top of the panel (VSCSAD)
+        # Stats
+        self.bytes = 0
+        self.transactions = 0
+        self.commands = 0
+        self.pixels = 0
+
+    def writebytes2(self, data):
+        data = bytes(data)
+        self.bytes += len(data)
+        self.transactions += 1
+        if not self._gpio.input(self._dc):
+            for command in data:
+                self._start_command(command)
+        elif self._command == ST7789_RAMWR:
+            self._write_pixels(data)
+        else:
+            self._params.extend(data)
+            if len(self._params) >= 4 and self._command in (ST7789_CASET, ST7789_RASET):
+                start = (self._params[0] << 8) | self._params[1]
+                end = (self._params[2] << 8) | self._params[3]
+                if self._command == ST7789_CASET:
+                    self._columns = (start, end)
+                else:
+                    self._rows = (start, end)
+            elif len(self._params) >= 2 and self._command == ST7789_VSCSAD:
+                self.scroll = (self._params[0] << 8) | self._params[1]
+
+    def writebytes(self, data):
+        self.writebytes2(data)
+
+    def xfer(self, data, *args):
+        self.writebytes2(data)
+        return [0] * len(data)
+
+    def _start_command(self, command):
+        self.commands += 1
+        self._command = command
+        self._params = []
+        if command == ST7789_RAMWR:
+            # Writes start at the top left of the address window
+            self._pointer = [self._columns[0], self._rows[0]]
+            self._pending = b''
+
+    def _write_pixels(self, data):
+        data = self._pending + data
+        usable = len(data) // 2 * 2
+        self._pending = data[usable:]
+        values = np.frombuffer(data[:usable], dtype='>u2')
+        x0, x1 = self._columns
+        y0, y1 = self._rows
+        x, y = self._pointer
+        height, width = self.framebuffer.shape
+        for value in self._runs(values, x, x0, x1):
+            # Each run fills the rest of one row of the window
+            if 0 <= y < height:
+                end = min(x + len(value), width)
+                if x < end:
+                    self.framebuffer[y, x:end] = value[:end - x]
+            x += len(value)
+            if x > x1:
+                x = x0
+                y += 1
+                if y > y1:
+                    y = y0
+        self._pointer = [x, y]
+        self.pixels += len(values)
+
+    @staticmethod
+    def _runs(values, x, x0, x1):
+        # Split the pixel values into pieces that each end at the right hand edge of the window
+        start = 0
+        row_left = x1 - x + 1
+        while start < len(values):
+            yield values[start:start + row_left]
+            start += row_left
+            row_left = x1 - x0 + 1
+
+    def image(self, width=240, height=240):
+        """The visible part of the framebuffer as an RGB PIL image, starting at the scrolled to line."""
+        lines = (self.scroll + np.arange(height)) % len(self.framebuffer)
+        color = self.framebuffer[lines, :width].astype(np.uint32)
+        rgb = np.dstack(((color >> 8) & 0xF8, (color >> 3) & 0xFC, (color << 3) & 0xF8)).astype(np.uint8)
+        return Image.fromarray(rgb, "RGB")
+
+
+class VirtualButton(object):
+    """gpiozero Button stand-in - press() calls when_pressed like a real button press would."""
+
+    def __init__(self, pin):
+        self.pin = pin
+        self.when_pressed = None
+        self.presses = 0
+
+    def press(self):
+        self.presses += 1
+        if self.when_pressed is not None:
+            self.when_pressed()
+
+
+class HardwareBackend(object):
+    """The real Pirate Audio board and MPU6050."""
+    name = "hardware"
+
+    def __init__(self):
+        import smbus                      # import SMBus module of I2C
+        from gpiozero import Button
+
+        self.bus = smbus.SMBus(1) 	# or bus = smbus.SMBus(0) for older version boards
+        self.display = ST7789(
+            rotation=90,  # Needed to display the right way up on Pirate Audio
+            port=0,       # SPI port
+            cs=1,         # SPI port Chip-select channel
+            dc=DC_PIN,    # BCM pin used for data/command
+            backlight=BACKLIGHT_PIN,
+            spi_speed_hz=SPI_SPEED_MHZ * 1000 * 1000
+        )
+        # Button numbering is using BCM numbering
+        self.buttons = [Button(pin) for pin in BUTTON_PINS]
+
+
+class HeadlessBackend(object):
+    """In-memory stand-ins for all the hardware."""
+    name = "headless"
+
+    def __init__(self, script=((1.0, 0.0, 0.0),)):
+        self.bus = ScriptedBus(script)
+        self.gpio = VirtualGpio()
+        self.spi = VirtualSpi(self.gpio)
+        self.display = ST7789(
+            rotation=90,
+            port=0,
+            cs=1,
+            dc=DC_PIN,
+            backlight=BACKLIGHT_PIN,
+            spi_speed_hz=SPI_SPEED_MHZ * 1000 * 1000,
+            spi=self.spi,
+            gpio=self.gpio
+        )
+        self.buttons = [VirtualButton(pin) for pin in BUTTON_PINS]
+
+    def press(self, index):
+        """Inject a press of button 0-3 (A, B, X, Y)."""
+        self.buttons[index].press()
+
+
+BACKENDS = {
+    HardwareBackend.name: HardwareBackend,
+    HeadlessBackend.name: HeadlessBackend,
+}
+
+
+def create_backend(name=None):
+    """Create the named backend, or the one given by the MARBLE_MAZE_BACKEND environment variable."""
+    if name is None:
+        name = os.environ.get(BACKEND_ENV, HardwareBackend.name)
+    try:
+        backend = BACKENDS[name]
+    except KeyError:
+        raise ValueError("Unknown backend '{}', expected one of {}".format(name, ", ".join(sorted(BACKENDS))))
+    return backend()
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : benchmark.py
+# Description : Standalone benchmark suite for the Marble Maze hot paths.
+#               Run on the Pi (or a desktop for comparison) with:  python3 benchmark.py
+#               Each case reports the best time of several repeats so the numbers are stable
+#               enough to compare between commits:
+#                 python3 benchmark.py --output before.json
+#                 ... change something ...
+#                 python3 benchmark.py --compare before.json --threshold 1.25
+#               --compare exits with status 1 if any case is slower than threshold x the saved time.
+#               The game cases run the real game code on the headless backend, in a scratch folder.
+############################################################################
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+import maze_algorithms
+import maze_file
+import maze_solver
+import tdf_maze_generator
+from backends import VirtualGpio
+from ST7789 import ST7789
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def best_time(func, repeats=5, number=1):
+    # Best of 'repeats' runs of 'number' calls, in seconds per call - use number > 1 for very quick calls
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = (time.perf_counter() - start) / number
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+class StandInSpi(object):
+    # Stand-in for spidev.SpiDev that accepts the data and just counts it.  It also adds up the time the
+    # transfers would take on the bus - a fixed cost per call (the ioctl and driver setup) plus the bits at
+    # the clock speed - so chunk sizes can be compared without the hardware.
+    def __init__(self, call_overhead=50e-6):
+        self.max_speed_hz = 0
+        self.mode = 0
+        self.lsbfirst = False
+        self.call_overhead = call_overhead
+        self.bytes = 0
+        self.calls = 0
+        self.speed_changes = 0
+        self.bus_time = 0.0
+
+    def __setattr__(self, name, value):
+        if name == "max_speed_hz" and getattr(self, "max_speed_hz", value) != value:
+            self.__dict__["speed_changes"] = self.speed_changes + 1
+        object.__setattr__(self, name, value)
+
+    def writebytes2(self, data):
+        size = len(data)
+        self.bytes += size
+        self.calls += 1
+        self.bus_time += self.call_overhead + size * 8.0 / (self.max_speed_hz or 1)
+
+
+def stand_in_display(**kwargs):
+    return ST7789(port=0, cs=1, dc=9, spi=StandInSpi(), gpio=VirtualGpio(), spi_speed_hz=80000000, **kwargs)
+
+
+class ScratchFolder(object):
+    # Run in a temporary folder holding copies of the game's image files, so generated files don't
+    # overwrite the real maze
+    def __enter__(self):
+        self._cwd = os.getcwd()
+        self.path = tempfile.mkdtemp(prefix="marble-bench-")
+        for name in ("marble_pic.png", "success.png", "generated_maze.maze"):
+            if os.path.isfile(os.path.join(HERE, name)):
+                shutil.copy(os.path.join(HERE, name), self.path)
+        os.chdir(self.path)
+        return self
+
+    def __exit__(self, *exc):
+        os.chdir(self._cwd)
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def bench_generation(repeats):
+    # The maze generation engine (without the file writes) and the full generate_new_maze for every difficulty level
+    results = {}
+    saved = tdf_maze_generator.get_difficulty()
+    with ScratchFolder():
+        for level, thickness in enumerate(tdf_maze_generator.difficulty):
+            maze_size = int(240 / thickness) - 1
+            results["carve_maze level {}".format(level)] = best_time(
+                lambda: tdf_maze_generator.carve_maze(maze_size, maze_size, level), repeats)
+            tdf_maze_generator.set_difficulty(level)
+            results["generate_new_maze level {}".format(level)] = best_time(tdf_maze_generator.generate_new_maze, repeats)
+    tdf_maze_generator.set_difficulty(saved)
+    return results
+
+
+def bench_scaling(repeats):
+    # Scaling the cell grid up to the collision data and screen image, and saving the maze file
+    results = {}
+    with ScratchFolder():
+        for level, thickness in enumerate(tdf_maze_generator.difficulty):
+            maze_size = int(240 / thickness) - 1
+            maze = tdf_maze_generator.carve_maze(maze_size, maze_size, level)
+            walls = tdf_maze_generator.maze_walls(maze)
+            results["expand + wall_image level {}".format(level)] = best_time(
+                lambda: maze_file.wall_image(maze_file.expand(walls, thickness), 240), repeats)
+            tdf_maze_generator.maze = maze
+            tdf_maze_generator.height = tdf_maze_generator.width = maze_size
+            tdf_maze_generator.wall_corridor_thickness = thickness
+            results["transcribemazefordisplay level {}".format(level)] = best_time(
+                lambda: tdf_maze_generator.transcribemazefordisplay(maze), repeats)
+    return results
+
+
+def load_legacy_pair(basename):
+    # How draw_maze used to load a maze - the full size .bmp image and the one byte per pixel .dat file
+    image = Image.new("RGB", (240, 240), (0, 0, 0))
+    image.paste(Image.open(basename + ".bmp"))
+    data = np.fromfile(basename + ".dat", dtype=np.uint8)
+    side = int(np.sqrt(len(data)))
+    return image, data.reshape(side, side)
+
+
+def bench_maze_file(repeats):
+    # File size and load time of the .maze file against the old .bmp/.dat pair, for the hardest level
+    results = {}
+    thickness = tdf_maze_generator.difficulty[-1]
+    maze_size = int(240 / thickness) - 1
+    walls = tdf_maze_generator.maze_walls(tdf_maze_generator.carve_maze(maze_size, maze_size, 0))
+    with ScratchFolder():
+        pixels = maze_file.expand(walls, thickness)
+        maze_file.wall_image(pixels).save("legacy.bmp")
+        pixels.tofile("legacy.dat")
+        maze_file.write_maze("current.maze", walls, thickness)
+
+        def load(cache_expansion):
+            maze = maze_file.load_maze("current.maze", cache_expansion)
+            return maze.rgb565(240), maze.pixels
+
+        results["load .bmp + .dat"] = best_time(lambda: load_legacy_pair("legacy"), repeats, 20)
+        results["load .maze"] = best_time(lambda: load(False), repeats, 20)
+        load(True)
+        results["load .maze, cached expansion"] = best_time(lambda: load(True), repeats, 20)
+        print("{:36s} {:10d} bytes".format(".bmp + .dat size", os.path.getsize("legacy.bmp") + os.path.getsize("legacy.dat")))
+        print("{:36s} {:10d} bytes".format(".maze size", os.path.getsize("current.maze")))
+    return results
+
+
+def bench_solver(repeats):
+    # Solving each difficulty level - the distance field alone and the full solution with the path.
+    # (tests/test_maze_solver.py checks every generated maze can be solved)
+    results = {}
+    for level, thickness in enumerate(tdf_maze_generator.difficulty):
+        walls = tdf_maze_generator.maze_walls(tdf_maze_generator.generate_maze(level, 0)[0])
+        header, _ = maze_file.decode_maze(maze_file.encode_maze(walls, thickness, solve=False))
+        results["distance_field level {}".format(level)] = best_time(
+            lambda: maze_solver.distance_field(walls, header.exit), repeats)
+        results["solve level {}".format(level)] = best_time(
+            lambda: maze_solver.solve(walls, header.entrance, header.exit), repeats)
+    return results
+
+
+def bench_algorithms(repeats, tall_rows=2001):
+    # Each generation algorithm at every difficulty level, and Eller's streaming a tall maze row by row
+    # (that the mazes are perfect is checked by tests/test_maze_algorithms.py)
+    results = {}
+    for name in sorted(maze_algorithms.ALGORITHMS):
+        for level, thickness in enumerate(tdf_maze_generator.difficulty):
+            maze_size = int(240 / thickness) - 1
+            results["{} level {}".format(name, level)] = best_time(
+                lambda: maze_algorithms.carve(name, maze_size, maze_size, level), repeats)
+
+    def stream():
+        for _ in maze_algorithms.eller_rows(tall_rows, 79, 0):
+            pass
+
+    results["eller stream {}x79".format(tall_rows)] = best_time(stream, repeats)
+    return results
+
+
+def bench_display(repeats):
+    # RGB565 conversion and SPI transfer for a full frame and a 3x3 marble window
+    display = stand_in_display()
+    frame = Image.new("RGB", (240, 240), (255, 0, 0))
+    marble = Image.new("RGB", (3, 3), (0, 255, 0))
+    results = {
+        "image_to_data full frame": best_time(lambda: display.image_to_data(frame), repeats),
+        "display full frame": best_time(lambda: display.display(frame), repeats),
+        "image_to_data 3x3": best_time(lambda: display.image_to_data(marble), repeats, 200),
+        "display 3x3": best_time(lambda: display.display(marble, 10, 10, 12, 12), repeats, 200),
+        "blit_sprite 3x3": best_time(lambda: display.blit_sprite(marble, 10, 10), repeats, 200),
+    }
+    # A pixel changed in each of 225 tiles spread over the screen - the worst case for finding the windows
+    ys, xs = np.meshgrid(np.arange(3, 240, 16), np.arange(3, 240, 16))
+
+    def flush_scattered():
+        display._framebuffer[ys, xs] ^= 0xFFFF
+        display.flush()
+
+    display.flush()
+    results["flush 225 scattered pixels"] = best_time(flush_scattered, repeats)
+    return results
+
+
+def bench_scrolling(repeats, screens=10):
+    # Large-maze mode - generating a tall maze, and scrolling the view from its top to its bottom a pixel row
+    # at a time (each scroll sends the VSCSAD command, plus a band of rows whenever the view nears their end)
+    from maze_scroll import MazeViewport, generate_tall_maze
+    display = stand_in_display()
+    level = len(tdf_maze_generator.difficulty) - 1
+    maze, _ = generate_tall_maze(screens, level, seed=0)
+
+    def scroll():
+        viewport = MazeViewport(display, maze)
+        viewport.start()
+        for y in range(maze.bounds[1]):
+            viewport.follow(y)
+
+    return {
+        "generate_tall_maze {} screens".format(screens): best_time(lambda: generate_tall_maze(screens, level, seed=0), repeats),
+        "scroll {} screens per row".format(screens): best_time(scroll, repeats) / maze.bounds[1],
+    }
+
+
+def bench_spi(repeats, chunk_sizes=(256, 1024, 4096, 16384, 65536)):
+    # Sending a full frame split into chunks of each size.  The time is the Python cost of the send plus the
+    # stand-in bus time (per call overhead + bits at 80MHz), so fewer, larger transfers show up as faster.
+    results = {}
+    frame = np.full((240, 240), 0xF800, dtype=np.uint16)
+    for chunk_size in chunk_sizes:
+        display = stand_in_display(chunk_size=chunk_size)
+        spi = display._spi
+
+        def send_frame():
+            start = spi.bus_time
+            begin = time.perf_counter()
+            display.set_window()
+            display.data(display.rgb565_to_data(frame))
+            return time.perf_counter() - begin + spi.bus_time - start
+
+        results["full frame chunk {}".format(chunk_size)] = min(send_frame() for _ in range(repeats))
+    # A marble step through the small payload fast path
+    display = stand_in_display()
+    marble = Image.new("RGB", (3, 3), (0, 255, 0))
+    display.blit_sprite(marble, 10, 10)
+    results["blit_sprite 3x3 python"] = best_time(lambda: display.blit_sprite(marble, 10, 10), repeats, 200)
+    return results
+
+
+def marble_step_counters():
+    # SPI bytes and transactions for one marble step (erase + draw), moving diagonally then straight down
+    display = stand_in_display()
+    marble = Image.new("RGB", (3, 3), (0, 255, 0))
+    black = Image.new("RGB", (3, 3), (0, 0, 0))
+    counters = {}
+    for name, (dx, dy) in (("diagonal", (1, 1)), ("vertical", (0, 1))):
+        display.blit_sprite(marble, 50, 50)
+        display.frame_counters()
+        display.blit_sprite(black, 50, 50)
+        display.blit_sprite(marble, 50 + dx, 50 + dy)
+        counters["marble step " + name] = display.frame_counters()
+    return counters
+
+
+class OneSamplePerCall(object):
+    # Sensor sampler stand-in giving move_marble exactly one new tilt sample per call, 5ms apart
+    def __init__(self, tilt):
+        self.tilt = tilt
+        self.now = time.monotonic()
+
+    def drain(self):
+        self.now += 0.005
+        return [(self.now, self.tilt[0], self.tilt[1], 1.0)]
+
+
+def bench_assets(repeats):
+    # Loading the fonts, images and static screens cold (decoding the files) and warm (from the cache file)
+    import marble_maze
+    from assets import AssetCache
+    results = {}
+    with ScratchFolder():
+        def load(cache_file):
+            marble_maze.assets = AssetCache(cache_file)
+            marble_maze.assets.screen("menu", marble_maze.MENU_SOURCES, marble_maze.render_menu)
+            marble_maze.assets.screen("completed", marble_maze.COMPLETED_SOURCES, marble_maze.render_completed)
+            marble_maze.assets.save()
+
+        results["assets cold start"] = best_time(lambda: load(None), repeats)
+        load("assets_cache.npz")
+        results["assets warm start"] = best_time(lambda: load("assets_cache.npz"), repeats)
+    return results
+
+
+def bench_game(repeats, steps=2000):
+    # draw_maze load time and move_marble steps per second, running the real game code headless
+    import marble_maze
+    results = {}
+    with ScratchFolder():
+        marble_maze.setup("headless")
+        marble_maze.maze_pool.stop()         # no background generation skewing the timings
+        marble_maze.sensor_sampler.stop()
+        results["draw_maze"] = best_time(marble_maze.draw_maze, repeats)
+
+        def run_steps():
+            marble_maze.sensor_sampler = OneSamplePerCall((-0.4, 0.2))
+            x, y = marble_maze.draw_maze()
+            start = time.perf_counter()
+            for _ in range(steps):
+                x, y = marble_maze.move_marble(x, y)
+            return time.perf_counter() - start
+
+        results["move_marble step"] = min(run_steps() for _ in range(repeats)) / steps
+    return results
+
+
+def bench_pipeline(repeats, seconds=1.0):
+    # Tilt sampled to marble pixels sent through the sensor / simulation / display pipeline, running the real
+    # game headless with the marble rolling round the maze.  Reports the median and 95th percentile latency,
+    # and how late the 95th percentile simulation tick ran.
+    import marble_maze
+    with ScratchFolder():
+        marble_maze.setup("headless")
+        marble_maze.maze_pool.stop()
+        marble_maze.backend.bus.set_script(((0.4, -0.5, 0.0), (0.4, 0.0, -0.5), (0.4, 0.5, 0.0), (0.4, 0.0, 0.5)))
+        marble_maze.use_pipeline = True
+        marble_maze.start_game()
+        time.sleep(seconds)
+        marble_maze.stop_pipeline()
+        marble_maze.sensor_sampler.stop()
+        stats = marble_maze.marble_pipeline.stats()
+    if not stats["frames"]:
+        raise RuntimeError("the pipeline drew no frames")
+    results = {}
+    for stage in ("display", "total"):
+        results["pipeline {} latency p50".format(stage)] = stats[stage]["p50"] / 1000.0
+        results["pipeline {} latency p95".format(stage)] = stats[stage]["p95"] / 1000.0
+    results["pipeline tick jitter p95"] = stats["ticks"]["jitter_p95"] / 1000.0
+    return results
+
+
+CASES = (
+    ("generation", bench_generation),
+    ("scaling", bench_scaling),
+    ("maze_file", bench_maze_file),
+    ("solver", bench_solver),
+    ("algorithms", bench_algorithms),
+    ("display", bench_display),
+    ("spi", bench_spi),
+    ("scrolling", bench_scrolling),
+    ("assets", bench_assets),
+    ("game", bench_game),
+    ("pipeline", bench_pipeline),
+)
+
+
+def run(selected=None, repeats=5):
+    """Run the benchmark cases (all, or the groups named in 'selected') and return {case: seconds}."""
+    results = {}
+    for group, case in CASES:
+        if selected and group not in selected:
+            continue
+        for name, elapsed in case(repeats).items():
+            results[name] = elapsed
+            print("{:36s} {:10.3f} ms  {:12.1f} /s".format(name, elapsed * 1000, 1.0 / elapsed if elapsed else 0.0))
+            sys.stdout.flush()
+    if not selected or "display" in selected:
+        for name, counters in marble_step_counters().items():
+            print("{:36s} {:4d} bytes {:3d} transactions".format(name, counters["bytes"], counters["transactions"]))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the change for each case against a saved baseline and return the cases slower than threshold x."""
+    regressions = []
+    for name, elapsed in sorted(results.items()):
+        before = baseline.get(name)
+        if not before:
+            continue
+        ratio = elapsed / before
+        flag = ""
+        if ratio > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print("{:36s} {:10.3f} ms -> {:10.3f} ms  x{:.2f}{}".format(name, before * 1000, elapsed * 1000, ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Marble Maze benchmark suite")
+    parser.add_argument("groups", nargs="*", help="case groups to run: " + ", ".join(group for group, _ in CASES))
+    parser.add_argument("--repeats", type=int, default=5, help="runs per case, the best is kept")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results file to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="fail if a case takes more than this multiple of its --compare time")
+    args = parser.parse_args(argv)
+
+    results = run(args.groups, args.repeats)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "meta": {
+                    "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "numpy": np.__version__,
+                    "repeats": args.repeats,
+                },
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("{} case(s) slower than x{}: {}".format(len(regressions), args.threshold, ", ".join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
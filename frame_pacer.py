@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : frame_pacer.py
+# Description : Fixed rate ticks on a monotonic clock, so the game runs at the same speed on a Pi Zero and
+#               a Pi 4 rather than as fast as the CPU allows.
+#               Each deadline is the last one plus the period - not the time the last tick actually ran plus
+#               the period - so late wake ups don't add up to drift.  A tick that runs a whole period or more
+#               late is an overrun: the missed ticks are skipped rather than run back to back.
+#               How late each tick ran (the jitter) is kept for percentiles, along with the achieved rate.
+############################################################################
+
+import time
+from collections import deque
+
+import numpy as np
+
+
+class FramePacer(object):
+    """Ticks at a fixed rate, with drift correction and timing stats."""
+
+    def __init__(self, rate, history=1000, clock=time.monotonic):
+        """Create the pacer.
+        :param rate: Target ticks per second
+        :param history: Tick timings kept for the jitter percentiles
+        :param clock: Monotonic clock, in seconds
+        """
+        if rate <= 0:
+            raise ValueError("tick rate must be positive, not {}".format(rate))
+        self.rate = rate
+        self.period = 1.0 / rate
+        self._clock = clock
+        self._jitter = deque(maxlen=history)
+        self._next = None
+        self._started = None
+        self._stopped = None
+
+        # Stats
+        self.ticks = 0
+        self.overruns = 0   # ticks that ran a whole period or more late
+        self.skipped = 0    # ticks left out after overruns
+
+    def start(self, now=None):
+        """Start ticking - the first tick is due one period from now.  Clears the stats."""
+        if now is None:
+            now = self._clock()
+        self._next = now + self.period
+        self._started = now
+        self._stopped = None
+        self._jitter.clear()
+        self.ticks = self.overruns = self.skipped = 0
+
+    def remaining(self):
+        """Seconds until the next tick is due, 0 if it is due now."""
+        if self._next is None:
+            self.start()
+        return max(0.0, self._next - self._clock())
+
+    def due(self):
+        """True if the next tick is due."""
+        return self.remaining() <= 0.0
+
+    def tick(self, now=None):
+        """Record a tick run at 'now' and schedule the next.  Returns how late the tick ran, in seconds."""
+        if now is None:
+            now = self._clock()
+        if self._next is None:
+            self.start(now - self.period)
+        late = now - self._next
+        self._jitter.append(late)
+        self.ticks += 1
+        self._next += self.period
+        if now >= self._next:
+            # A whole period or more behind - skip the missed ticks instead of running them all at once
+            missed = int((now - self._next) / self.period) + 1
+            self._next += missed * self.period
+            self.overruns += 1
+            self.skipped += missed
+        return late
+
+    def wait(self, stop=None):
+        """Sleep until the next tick is due, then tick.  With a threading.Event as stop the sleep ends early
+        when it is set, and False is returned without ticking.
+        """
+        # Sleeps can end a little early, so sleep again for whatever is left - ticks are never ahead of time
+        delay = self.remaining()
+        while delay > 0:
+            if stop is not None:
+                if stop.wait(delay):
+                    return False
+            else:
+                time.sleep(delay)
+            delay = self.remaining()
+        if stop is not None and stop.is_set():
+            return False
+        self.tick()
+        return True
+
+    def stop(self, now=None):
+        """Stop ticking - stats() keeps the achieved rate over the time from start() to now."""
+        if self._started is not None and self._stopped is None:
+            self._stopped = now if now is not None else self._clock()
+
+    def stats(self):
+        """Return the target and achieved tick rates, jitter percentiles (ms late) and overruns as a dictionary."""
+        end = self._stopped if self._stopped is not None else self._clock()
+        elapsed = end - self._started if self._started is not None else 0.0
+        stats = {
+            "target_rate": self.rate,
+            "rate": self.ticks / elapsed if elapsed > 0 else 0.0,
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+        }
+        jitter = np.array(self._jitter) * 1000.0
+        for percentile in (50, 95, 99):
+            stats["jitter_p{}".format(percentile)] = float(np.percentile(jitter, percentile)) if len(jitter) else 0.0
+        stats["jitter_max"] = float(jitter.max()) if len(jitter) else 0.0
+        return stats
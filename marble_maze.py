@@ -13,35 +13,37 @@
 # modification: 04-08-2021
 ############################################################################
 
-import smbus			#import SMBus module of I2C
+import os
+import queue
+import sys
 import time
-import math
-import numpy as np
 from pathlib import Path
-from tdf_maze_generator import generate_new_maze, get_difficulty, set_difficulty
-
-from gpiozero import Button
+from tdf_maze_generator import difficulty, get_difficulty, set_difficulty
+from maze_pool import MazePool
+from maze_cache import MazeCache
+from maze_pack import MazePack, INDEX_FILE
+from marble_physics import MarblePhysics
+from marble_pipeline import MarblePipeline
+from frame_pacer import FramePacer
+from perf import Profiler, PerfOverlay, PerfReporter
+from maze_collision import load_free_space
+from maze_file import load_maze, migrate_legacy_pair
+from maze_scroll import MazeViewport, TallMaze, TallMazeMaker
+from mpu6050 import MPU6050, SensorSampler
+from backends import create_backend
+from assets import AssetCache, FONT_FILE
 
 from colorsys import hsv_to_rgb
-from PIL import Image, ImageDraw, ImageFont
-from ST7789 import ST7789
+from PIL import Image, ImageDraw
 
 # Definitions for gyro
-#some MPU6050 Registers and their Address
-PWR_MGMT_1   = 0x6B
-SMPLRT_DIV   = 0x19
-CONFIG       = 0x1A
-GYRO_CONFIG  = 0x1B
-INT_ENABLE   = 0x38
-ACCEL_XOUT_H = 0x3B
-ACCEL_YOUT_H = 0x3D
-ACCEL_ZOUT_H = 0x3F
-GYRO_XOUT_H  = 0x43
-GYRO_YOUT_H  = 0x45
-GYRO_ZOUT_H  = 0x47
+Device_Address = 0x68   # MPU6050 device address
+SENSOR_SAMPLE_RATE_DIV = 39  # SMPLRT_DIV - 8kHz / (1 + 39) = 200 accelerometer samples per second
 
 # Definitions for the screen
 SCREEN_SIZE = 240 # 240x240 square
+MENU_SOURCES = (FONT_FILE, "marble_pic.png")  # files the static screens are drawn from
+COMPLETED_SOURCES = (FONT_FILE, "success.png")
 MAX_SCREEN_INDEX = 239 # 0 to 239
 MIN_SCREEN_INDEX = 0
 
@@ -52,16 +54,30 @@ MARBLE_CORNER_OFFSET = 1  # Offset to calculate marble corners from centre x,y -
 MARBLE_MAX_SCREEN_INDEX = MAX_SCREEN_INDEX - MARBLE_CORNER_OFFSET
 MARBLE_MIN_SCREEN_INDEX = MIN_SCREEN_INDEX + MARBLE_CORNER_OFFSET
 
+# The current maze
+MAZE_BASENAME = "generated_maze"
+MAZE_FILE = MAZE_BASENAME + ".maze"
+MARBLE_START_Y = 5  # nominal 5 pixels in from the top
+MAZE_EDGE_X = 10    # column the bottom edge of the maze is found along
+SEED_ENV = "MARBLE_MAZE_SEED"  # environment variable to start with the maze for a seed
+MAZE_PACK_DIR = "maze_pack"    # curated maze pack, if there is one
+SCREENS_ENV = "MARBLE_MAZE_SCREENS"  # environment variable for large-maze mode - maze height in screens
+PIPELINE_ENV = "MARBLE_MAZE_PIPELINE"  # environment variable - 0 runs the marble updates on the main loop
+TICK_RATE_ENV = "MARBLE_MAZE_TICK_RATE"  # environment variable - marble updates per second while playing
+PERF_ENV = "MARBLE_MAZE_PERF"            # environment variable - 'overlay' and / or 'dump' turn the profiler on
+PERF_FILE_ENV = "MARBLE_MAZE_PERF_FILE"  # environment variable - file for the stats dump, stdout if not set
+PERF_DUMP_INTERVAL = 10.0  # seconds between stats dumps
+maze = None
+tall_screens = 0   # large-maze mode when more than 0 - the maze is this many screens tall and scrolls
+viewport = None    # MazeViewport scrolling the display while a large maze is played
+tall_mazes = None  # TallMazeMaker generating the next large maze in the background
+
 # Set exit limit to determine completed - initial value, will change depending on maze size
 exit_index_y = MAX_SCREEN_INDEX-3 
 
-# Global image variables
-pixels = 0
-image = 0
-image2 = 0
+# Marble position
 marble_x = 0
 marble_y = 0
-draw = 0
 
 green_ball_image = Image.new("RGB", (3, 3), (0, 255, 0)) # green
 black_ball_image = Image.new("RGB", (3, 3), (0, 0, 0)) # black
@@ -74,94 +90,51 @@ FINISHED = 4
 GENERATE = 5
 mode = MENU  # default to menu at start
 
-# Incitialise global array ready for use
-numpy_maze_data = []
-
-
-def MPU_Init():
-    #write to sample rate register
-    bus.write_byte_data(Device_Address, SMPLRT_DIV, 7)
-
-    #Write to power management register
-    bus.write_byte_data(Device_Address, PWR_MGMT_1, 1)
-
-    #Write to Configuration register
-    bus.write_byte_data(Device_Address, CONFIG, 0)
-
-    #Write to Gyro configuration register
-    bus.write_byte_data(Device_Address, GYRO_CONFIG, 24)
-
-    #Write to interrupt enable register
-    bus.write_byte_data(Device_Address, INT_ENABLE, 1)
+# Events for the main loop.  Button handlers run on gpiozero's threads and the maze pool worker on its own
+# thread, so they only ever put events on the queue - all state changes happen on the main loop.
+BUTTON = 1       # (BUTTON, button number 1-4)
+MAZE_READY = 2   # (MAZE_READY, difficulty level) - a background generated maze is ready
+TICK = 3         # (TICK, None) - time for the next marble update while playing
+MARBLE_EXIT = 4  # (MARBLE_EXIT, None) - the marble pipeline saw the marble leave the maze
+events = queue.Queue()
+TICK_RATE = 200    # default marble updates per second while playing
+tick_rate = TICK_RATE
+pacer = None       # FramePacer timing the marble updates of the current (or last) game
+
+# Profiling, off unless MARBLE_MAZE_PERF is set
+profiler = None
+perf_overlay = None
+perf_reporter = None
+
+# Loop iterations run, screens drawn and CPU time used, for measuring the loop
+loop_iterations = 0
+event_count = 0
+tick_count = 0
+redraws = {"menu": 0, "maze": 0, "completed": 0}
+stats_start = (time.monotonic(), time.process_time())
 
+# Incitialise global array ready for use
+free_space = []
+marble_physics = None
+use_pipeline = True     # run the marble on the sensor / simulation / display pipeline while playing
+marble_pipeline = None  # the pipeline of the current (or last) game
 
-def read_raw_data(addr):
-    # Accelero and Gyro value are 16-bit
-    high = bus.read_byte_data(Device_Address, addr)
-    low = bus.read_byte_data(Device_Address, addr+1)
-    
-    #concatenate higher and lower value
-    value = ((high << 8) | low)
-    
-    #to get signed value from mpu6050
-    if(value > 32768):
-        value = value - 65536
-    return value
 
 def read_gyro_data():
     #Useful general routine NOT used in the game
-    #Read Accelerometer raw value
-    acc_x = read_raw_data(ACCEL_XOUT_H)
-    acc_y = read_raw_data(ACCEL_YOUT_H)
-    acc_z = read_raw_data(ACCEL_ZOUT_H)
-
-    #Read Gyroscope raw value
-    gyro_x = read_raw_data(GYRO_XOUT_H)
-    gyro_y = read_raw_data(GYRO_YOUT_H)
-    gyro_z = read_raw_data(GYRO_ZOUT_H)
-
-    #Full scale range +/- 250 degree/C as per sensitivity scale factor
-    Ax = acc_x/16384.0
-    Ay = acc_y/16384.0
-    Az = acc_z/16384.0
-
-    Gx = gyro_x/131.0
-    Gy = gyro_y/131.0
-    Gz = gyro_z/131.0
+    #Read Accelerometer, temperature and Gyroscope values in one block read
+    (Ax, Ay, Az), _, (Gx, Gy, Gz) = mpu.read_all()
 
     print ("Gx=%.2f" %Gx, u'\u00b0'+ "/s", "\tGy=%.2f" %Gy, u'\u00b0'+ "/s", "\tGz=%.2f" %Gz, u'\u00b0'+ "/s", "\tAx=%.2f g" %Ax, "\tAy=%.2f g" %Ay, "\tAz=%.2f g" %Az) 	
 
-def read_gyro_xy():
-    # Cut down routine to just read the x and y accelerometer values used in the game.  Return integers for direct x & y use
-    #Read Accelerometer raw value
-    acc_x = read_raw_data(ACCEL_XOUT_H)
-    acc_y = read_raw_data(ACCEL_YOUT_H)
-
-    #Full scale range +/- 250 degree/C as per sensitivity scale factor
-    Ax = acc_x/16384.0      
-    Ay = acc_y/16384.0
-
-    if Ax >= 0:
-        Dx = 1
-    else:
-        Dx = -1
-    
-    if Ay >= 0:
-        Dy = 1
-    else:
-        Dy = -1
-    
-    #print (Ax, Ay, int(Dx), int(Dy))
-    return int(Dx), int(Dy)  # return integer steps
-
-def draw_menu():
-    global image, draw
+def render_menu():
+    # The parts of the menu screen that never change - drawn once and kept by the asset cache
     image = Image.new("RGB", (SCREEN_SIZE, SCREEN_SIZE), (255, 255, 255)) # Make initial board white
     draw = ImageDraw.Draw(image) # Setup so can draw on the screen for menu etc.
 
         # Now to add some text for the buttons.....
-    font = ImageFont.truetype('/usr/share/fonts/truetype/freefont/FreeSans.ttf', 16) # Create our font, passing in the font file and font size
-    font2 = ImageFont.truetype('/usr/share/fonts/truetype/freefont/FreeSans.ttf', 24) # Create our font, passing in the font file and font size
+    font = assets.font(16) # Create our font, passing in the font file and font size
+    font2 = assets.font(24) # Create our font, passing in the font file and font size
 
     # Rectangle for title
     draw.rectangle((40, 18, 200, 50), outline = ("black"))
@@ -169,240 +142,479 @@ def draw_menu():
 
     txt_colour = (0,0,0) # black
     draw.text((5, 60), "Play", font = font, fill = txt_colour) # A button
-    draw.text((5, 180), "Generate", font = font, fill = txt_colour) # B button
     draw.text((170, 60), "Tricky", font = font, fill = txt_colour)
     draw.text((170, 180), "Easy", font = font, fill = txt_colour)
 
-    draw.text((190, 120), str(get_difficulty()+1), font = font2, fill = (0,255,0))
     draw.line((195, 80, 195, 120), width=4, fill=(255, 0, 0))
     draw.line((195, 150, 195, 180), width=4, fill=(255, 0, 0))
 
-    image2 = Image.open("marble_pic.png")
-    image2 = image2.resize((80,80)) 
-    image.paste(image2, (60,80)) # onto menu screen
-
-    # draw menu
-    st7789.display(image)
+    image.paste(assets.image("marble_pic.png", (80, 80)), (60,80)) # onto menu screen
+    return image
 
 
-def draw_completed(duration):
-    global image, draw
+def render_completed():
+    # The parts of the maze completed screen that never change
     image = Image.new("RGB", (SCREEN_SIZE, SCREEN_SIZE), ("#99ccff")) # Make initial board bluish..
     draw = ImageDraw.Draw(image) # Setup so can draw on the screen for menu etc.
 
     # Success image
-    image2 = Image.open("success.png")
-    image2 = image2.resize((100,100)) 
-    image.paste(image2, (70,10)) # onto screen
+    image.paste(assets.image("success.png", (100, 100)), (70,10)) # onto screen
 
     # Now to add some text as well.....
-    font = ImageFont.truetype('/usr/share/fonts/truetype/freefont/FreeSans.ttf', 24) # Create our font, passing in the font file and font size
-    draw.text((20, 115), "Maze Completed", font = font, fill = ("red"))
+    draw.text((20, 115), "Maze Completed", font = assets.font(24), fill = ("red"))
+    return image
+
+
+def draw_label(box, position, text, font, fill, background):
+    # Draw text that changes (difficulty, time taken) into the framebuffer - only the box around it is drawn,
+    # on top of the pre-rendered screen.  box is (x0, y0, x1, y1) and position is where the text goes on screen.
+    x0, y0, x1, y1 = box
+    label = Image.new("RGB", (x1 - x0, y1 - y0), background)
+    ImageDraw.Draw(label).text((position[0] - x0, position[1] - y0), text, font = font, fill = fill)
+    st7789.draw_image(label, x0, y0)
+
+
+def draw_menu(generating=False):
+    # Copy the pre-rendered menu and add the parts that change
+    stop_scrolling()
+    st7789.draw_rgb565(assets.screen("menu", MENU_SOURCES, render_menu))
+
+    txt_colour = (0,0,0) # black
+    draw_label((0, 178, 120, 205), (5, 180), "Generate", assets.font(16),
+               "red" if generating else txt_colour, (255, 255, 255)) # B button - red while generating
+    # Difficulty, between the red lines
+    draw_label((175, 122, 220, 150), (190, 120), str(get_difficulty()+1), assets.font(24), (0,255,0), (255, 255, 255))
+
+    # draw menu - only the areas that changed since the last flush are sent
+    st7789.flush()
+    redraws["menu"] += 1
+
+
+def draw_completed(duration):
+    # Copy the pre-rendered screen and add the time taken
+    stop_scrolling()
+    st7789.draw_rgb565(assets.screen("completed", COMPLETED_SOURCES, render_completed))
 
     txt = "Time Taken: \n{:.2f}, seconds".format(duration)
-    draw.text((20, 150), txt, font = font, fill = ("red"))
+    draw_label((0, 145, SCREEN_SIZE, SCREEN_SIZE), (20, 150), txt, assets.font(24), ("red"), ("#99ccff"))
 
     # draw menu
-    st7789.display(image)
+    st7789.flush()
+    redraws["completed"] += 1
 
 
 
 def draw_maze():
-    global image, image2, pixels, draw, exit_index_y, numpy_maze_data
-    image = Image.new("RGB", (SCREEN_SIZE, SCREEN_SIZE), (0, 0, 0)) # Make initial board black
-    pixels = image.load()  # Load image into memory for pixes access - check for collisions etc.
-    image2 = Image.open("generated_maze.bmp") # Used bmp images to avoid jpeg compression artefacts
-    image.paste(image2) # Paste generated maze onto screen
-    draw = ImageDraw.Draw(image) # Setup so can draw marble on the screen
-
-    # Read in maze datafile for the loaded bmp - Used in move_marble function
-    numpy_temp = np.fromfile("generated_maze.dat",dtype=np.uint8)
-    i = int(math.sqrt(len(numpy_temp)))  # calculate index size - always a square shape
-    numpy_maze_data = numpy_temp.reshape(i, i)  # reset the maze to the correct 2D dimensions
+    global maze, exit_index_y, free_space, marble_physics
+    # Load the maze - the start position, bottom edge and collision data (1 for wall, 0 for corridor per
+    # pixel) are all worked out by the loader from the small cell grid in the maze file
+    maze = load_maze(MAZE_FILE, start_y=MARBLE_START_Y, edge_x=MAZE_EDGE_X)
+    # Where the marble fits without touching a wall - worked out once per maze and cached beside the maze file
+    free_space = load_free_space(MAZE_FILE, maze.pixels, MARBLE_SIZE)
 
     # Start marble in entrance in top row
-    entrance_found = False
-    for i in range(1,MAX_SCREEN_INDEX):
-        if pixels[i,5] == (0,0,0):
-            # Found entrance
-            entrance_start_index_x = i
-            entrance_found = True
-            break
-
-    for i in range(entrance_start_index_x, MAX_SCREEN_INDEX):
-        if pixels[i,5] != (0,0,0):
-            entrance_end_index_x = i
-            break
-
-    if not entrance_found:
-        print ("Maze error")
-        exit()
-    
-    initial_x = int((entrance_start_index_x + entrance_end_index_x)/2)
-    initial_y = 5 # nominal 5 pixels in
-    
-    # Find highest y value - needed since the maze can vary in size depending on the resolution. Needed to work out when exit maze in main loop
-    maze_found = False
-    for i in range(MAX_SCREEN_INDEX,1,-1):
-        if pixels[10,i] != (0,0,0):
-            # Found the bottom edge of the maze
-            exit_index_y = i-3  # need to allow for marble next position
-            maze_found = True
-            break
-
-    if not maze_found:
-        print ("Maze error")
-        exit()
-
-    # draw marble at initial location
-    draw.rectangle((initial_x-MARBLE_CORNER_OFFSET, initial_y-MARBLE_CORNER_OFFSET, initial_x+MARBLE_CORNER_OFFSET, initial_y+MARBLE_CORNER_OFFSET), (0, 255, 0)) #  green pixels
-    
-    # draw playing area
-    st7789.display(image)
+    initial_x, initial_y = maze.start
+
+    # Bottom edge of the maze - needed since the maze can vary in size depending on the resolution. Needed to work out when exit maze in main loop
+    exit_index_y = maze.bottom_edge-3  # need to allow for marble next position
+
+    # draw playing area with the marble at its initial location
+    st7789.draw_rgb565(maze.rgb565(SCREEN_SIZE))
+    st7789.fill_rect(initial_x-MARBLE_CORNER_OFFSET, initial_y-MARBLE_CORNER_OFFSET, initial_x+MARBLE_CORNER_OFFSET, initial_y+MARBLE_CORNER_OFFSET, (0, 255, 0)) #  green pixels
+    st7789.flush()
+    redraws["maze"] += 1
+
+    # Start the marble physics at rest at the initial location, ignoring any tilt samples from before now
+    sensor_sampler.drain()
+    marble_physics = MarblePhysics(initial_x, initial_y, marble_fits)
 
     # return initial marble position in new maze
     return initial_x, initial_y
 
 
+def draw_tall_maze(tall_maze):
+    global maze, exit_index_y, marble_physics, viewport
+    # Large-maze mode - a maze tall_screens screens tall, kept as its packed cell grid.  Only the top of it
+    # is sent to the display, the rest follows in bands as the view scrolls after the marble.
+    maze = tall_maze
+    initial_x, initial_y = maze.start
+    exit_index_y = maze.bottom_edge-3  # in maze pixel rows, like the marble position
+
+    viewport = MazeViewport(st7789, maze, SCREEN_SIZE)
+    viewport.start()
+    viewport.blit_sprite(green_ball_image, initial_x-MARBLE_CORNER_OFFSET, initial_y-MARBLE_CORNER_OFFSET)
+    redraws["maze"] += 1
+
+    # Collisions are checked against the cell grid, so there is no free space map to grow with the maze
+    sensor_sampler.drain()
+    marble_physics = MarblePhysics(initial_x, initial_y, maze.fits)
+    return initial_x, initial_y
+
+
+def stop_scrolling():
+    # Leave large-maze mode - put the display's scrolling back before drawing a normal screen
+    global viewport
+    if viewport is not None:
+        viewport.close()
+        viewport = None
+
+
+def marble_fits(x, y):
+    # Check if the marble can be centred on pixel x, y - used by the marble physics for collisions
+    # The free space map already allows for the marble size and the maze walls so this is a single lookup
+    # NOTE - maze has contiguous external walls so marble can only escapte via the entry or exit routes.
+    # !!! NOTE HAD TO USE Y,X INSTEAD OF X,Y TO INDEX THE NUMPY ARRAY SINCE NUMPY USES ROW(Y), COL(X) INDEXING !!!!
+    rows, cols = free_space.shape
+    return 0 <= y < rows and 0 <= x < cols and free_space[y, x]
+
+
+def marble_tilt(sample):
+    # Tilt pushing the marble, in g, for an accelerometer sample (time, ax, ay, az)
+    _, tilt_y, tilt_x, _ = sample  # Note x & y swapped here due to orientation of sensor in the pi Zero case.
+    return -tilt_x, -tilt_y
+
+
+def draw_marble_move(initial_mx, initial_my, next_mx, next_my):
+    # In large-maze mode the marble is drawn in maze coordinates through the viewport
+    screen = viewport if viewport is not None else st7789
+    # Delete existing marble - write a black block to the screen (not the full screen refresh to speed things up)
+    # The marble images are pre-encoded sprites so this is just the window setup plus a cached byte string
+    screen.blit_sprite(black_ball_image, initial_mx-MARBLE_CORNER_OFFSET, initial_my-MARBLE_CORNER_OFFSET)
+    if viewport is not None:
+        viewport.follow(next_my)  # scroll before drawing, so rows sent in don't cover the marble
+    # draw marble at new location (not the full screen refresh to speed things up)
+    screen.blit_sprite(green_ball_image, next_mx-MARBLE_CORNER_OFFSET, next_my-MARBLE_CORNER_OFFSET)
+    if perf_overlay is not None and viewport is None:
+        perf_overlay.update()  # drawn here, on whichever thread is drawing the marble
+
+
 def move_marble(initial_mx,initial_my): # parameters are marblex and marbley
-    global pixels, draw
-    # Get latest change in position - in integer steps
-    step_y, step_x = read_gyro_xy() # Note x & y swapped here due to orientation of sensor in the pi Zero case.
-
-    # Use step details for new position
-    next_mx = initial_mx - step_x
-    next_my = initial_my - step_y
-
-    # NOTE - maze has contiguous external walls so marble can only escapte via the entry or exit routes.  
-    # check going back out the entry
-    if next_my < MARBLE_MIN_SCREEN_INDEX:
-        next_my = MARBLE_MIN_SCREEN_INDEX
-    # check exit too otherwise collision checks may fail
-    i, _ = numpy_maze_data.shape
-    if next_my > i:
-        next_my = i
-
-        # Check for collision with any 'non black' areas  # !!! NOTE HAD TO USE Y,X INSTEAD OF X,Y TO INDEX THE NUMPY ARRAY SINCE NUMPY USES ROW(Y), COL(X) INDEXING !!!!
-    if (numpy_maze_data[next_my-MARBLE_CORNER_OFFSET, next_mx-MARBLE_CORNER_OFFSET] != 0 or numpy_maze_data[next_my+MARBLE_CORNER_OFFSET, next_mx-MARBLE_CORNER_OFFSET] != 0 or
-        numpy_maze_data[next_my-MARBLE_CORNER_OFFSET, next_mx+MARBLE_CORNER_OFFSET] != 0 or numpy_maze_data[next_my+MARBLE_CORNER_OFFSET, next_mx+MARBLE_CORNER_OFFSET] != 0 ):
-        # set back to last location
-        next_mx = initial_mx
-        next_my = initial_my
-        # No need to update the display !!
-
-    else: # Move normally....
-        # First check if actually moved, if not then nothing more to do...
-        if not (next_mx == initial_mx and next_my == initial_my):
-            # Check screen bounds for marble size accordingly
-            if (next_mx < MARBLE_MAX_SCREEN_INDEX) and (next_mx > MARBLE_MIN_SCREEN_INDEX) and next_my < MARBLE_MAX_SCREEN_INDEX and next_my > MARBLE_MIN_SCREEN_INDEX:
-                # Delete existing marble - write a black block to the screen (not the full screen refresh to speed things up)
-                st7789.display(black_ball_image,initial_mx-MARBLE_CORNER_OFFSET, initial_my-MARBLE_CORNER_OFFSET, initial_mx+MARBLE_CORNER_OFFSET, initial_my+MARBLE_CORNER_OFFSET)
-                # draw marble at new location (not the full screen refresh to speed things up)
-                st7789.display(green_ball_image,next_mx-MARBLE_CORNER_OFFSET, next_my-MARBLE_CORNER_OFFSET, next_mx+MARBLE_CORNER_OFFSET, next_my+MARBLE_CORNER_OFFSET)
-            else: # Put back to last location 
-                next_mx = initial_mx
-                next_my = initial_my
-                # No need to updaate the display !!
-    
+    # Feed every accelerometer sample taken since the last call into the marble physics, at the time it was
+    # taken.  The sampler runs on its own thread so this never waits on the I2C bus.
+    # The physics runs on a fixed timestep so the marble speed depends on the tilt and time, not on how fast this loop runs
+    # This is the single threaded update, used when the marble pipeline is turned off.
+    next_mx, next_my = initial_mx, initial_my
+    for sample in sensor_sampler.drain():
+        ax, ay = marble_tilt(sample)
+        next_mx, next_my = marble_physics.update(ax, ay, sample[0])
+
+    # Only update the display when the marble has moved to a different whole pixel
+    if not (next_mx == initial_mx and next_my == initial_my):
+        draw_marble_move(initial_mx, initial_my, next_mx, next_my)
+
     return next_mx, next_my
 
+# Button handlers - called on gpiozero's threads, so just queue the press for the main loop
 def btn1handler():
-    global mode
-    # If playing a maze or finished a game, any button press will go back to the menu
-    if mode == PLAYING or mode == FINISHED:
-        mode = MENU
-    else: # Menu option for button A is to play a maze
-        mode = MAZE
+    events.put((BUTTON, 1))
 
 def btn2handler():
-    global mode
-    # If playing a maze or finished a game, any button press will go back to the menu
-    if mode == PLAYING or mode == FINISHED:
-        mode = MENU
-    else: # Menu option for button B is to generate a new maze
-        mode = GENERATE
+    events.put((BUTTON, 2))
 
 def btn3handler():
-    global mode
-    # If playing a maze or finished a game, any button press will go back to the menu
-    if mode == PLAYING or mode == FINISHED:
-        mode = MENU
-    else: # Menu option for button X is to increase maze wall/corridor widths
-        x = get_difficulty() + 1
-        set_difficulty(x)
-
+    events.put((BUTTON, 3))
 
 def btn4handler():
+    events.put((BUTTON, 4))
+
+def maze_ready_handler(level):
+    # Called on the maze pool's thread when a background generated maze is ready
+    events.put((MAZE_READY, level))
+
+def marble_exit_handler():
+    # Called on the marble pipeline's simulation thread when the marble leaves the maze
+    events.put((MARBLE_EXIT, None))
+
+
+def show_menu(generating=False):
     global mode
-    # If playing a maze or finished a game, any button press will go back to the menu
-    if mode == PLAYING or mode == FINISHED:
-        mode = MENU
-    else: # Menu option for button X is to increase maze wall/corridor widths
-        x = get_difficulty() - 1
-        set_difficulty(x)
-
-# Setup gyro object
-bus = smbus.SMBus(1) 	# or bus = smbus.SMBus(0) for older version boards
-Device_Address = 0x68   # MPU6050 device address
-MPU_Init()
-
-# Setup screen object
-SPI_SPEED_MHZ = 80
-
-st7789 = ST7789(
-    rotation=90,  # Needed to display the right way up on Pirate Audio
-    port=0,       # SPI port
-    cs=1,         # SPI port Chip-select channel
-    dc=9,         # BCM pin used for data/command
-    backlight=13,
-    spi_speed_hz=SPI_SPEED_MHZ * 1000 * 1000
-)
-# Button numbering is using BCM numbering
-btn1 = Button(5)      # assign each button to a variable
-btn2 = Button(6)      # by passing in the pin number
-btn3 = Button(16)     # associated with the button
-btn4 = Button(24)     # 
-
-# tell the button what to do when pressed
-btn1.when_pressed = btn1handler
-btn2.when_pressed = btn2handler
-btn3.when_pressed = btn3handler
-btn4.when_pressed = btn4handler
-
-mazefile = Path("generated_maze.dat")
-if not mazefile.is_file():
-# File does not exist so create initial maze otherwise will continue to use previous maze until a new one is generated manually.
-    generate_new_maze()
-
-while True:
-
-    # Update marble position only if playing
-    if mode == PLAYING:
+    stop_pipeline()
+    mode = GENERATE if generating else MENU
+    draw_menu(generating)
+
+
+def start_game():
+    global mode, marble_x, marble_y, game_start, pacer
+    if tall_screens:
+        # Large mazes are generated in the background - if the next isn't ready yet wait for it like
+        # 'Generate' does, rather than generating it here and freezing the buttons and display
+        tall_maze = tall_mazes.take(get_difficulty())
+        if tall_maze is None:
+            show_menu(generating=True)
+            return
+    sensor_sampler.start()  # only sampled while playing
+    marble_x, marble_y = draw_tall_maze(tall_maze) if tall_screens else draw_maze()  # Initialise and draw maze
+    mode = PLAYING
+    game_start = time.time()
+    # Marble updates at a fixed rate, the same on any Pi
+    pacer = FramePacer(tick_rate)
+    pacer.start()
+    if use_pipeline:
+        start_pipeline()
+
+
+def start_pipeline():
+    # Move the marble on the sensor / simulation / display threads - the main loop just waits for buttons
+    # and for the pipeline to report the marble has left the maze
+    global marble_pipeline
+    marble_pipeline = MarblePipeline(sensor_sampler, marble_physics, marble_tilt, draw_marble_move,
+                                     (marble_x, marble_y), exit_y=exit_index_y, on_exit=marble_exit_handler,
+                                     pacer=pacer)
+    marble_pipeline.start()
+
+
+def stop_pipeline():
+    # Stop the pipeline's threads (if running) before anything else draws on the display, and the sensor
+    # sampling - nothing runs in the background on the menu and completed screens except maze generation
+    global marble_x, marble_y
+    if marble_pipeline is not None and marble_pipeline.running:
+        marble_pipeline.stop()
+        marble_x, marble_y = marble_pipeline.position
+    if pacer is not None:
+        pacer.stop()
+    sensor_sampler.stop()
+
+
+def generate_maze(retry=False):
+    # Swap in the next ready maze - if none is ready yet show 'Generate' in red and wait for MAZE_READY (then
+    # called again with retry).  If the pool's worker isn't running (stopped, or failed) the maze is generated
+    # in line instead.  In large-maze mode it is the next large maze that is waited for.
+    if tall_screens:
+        ready = tall_mazes.prepare(get_difficulty())
+    else:
+        ready = maze_pool.take(get_difficulty(), block=False, retry=retry)
+    if ready:
+        show_menu()
+    elif mode != GENERATE:
+        show_menu(generating=True)
+
+
+def handle_event(event):
+    # The game state machine - screens are only redrawn when the state they show changes
+    global marble_x, marble_y
+    kind, value = event
+
+    if kind == BUTTON:
+        # If playing a maze, finished a game or waiting for a maze to be generated, any button press will go
+        # back to the menu
+        if mode == PLAYING or mode == FINISHED or mode == GENERATE:
+            show_menu()
+        elif mode == MENU:
+            if value == 1:    # Menu option for button A is to play a maze
+                start_game()
+            elif value == 2:  # Menu option for button B is to generate a new maze
+                generate_maze()
+            elif value == 3 or value == 4:  # Menu options for buttons X and Y change maze wall/corridor widths
+                level = get_difficulty()
+                set_difficulty(level + 1 if value == 3 else level - 1)
+                if get_difficulty() != level:
+                    show_menu()
+
+    elif kind == MAZE_READY:
+        if mode == GENERATE and value == get_difficulty():
+            generate_maze(retry=True)
+
+    elif kind == TICK and mode == PLAYING:
+        # Update marble position only if playing
         marble_x, marble_y = move_marble(marble_x, marble_y)
-
-    elif mode == MENU:
-        draw_menu()
-
-    elif mode == MAZE:
-        marble_x, marble_y = draw_maze()  # Initialise and draw maze
-        mode = PLAYING
-        game_start = time.time()
-
-    elif mode == GENERATE:
-        font = ImageFont.truetype('/usr/share/fonts/truetype/freefont/FreeSans.ttf', 16) # Create our font, passing in the font file and font size
-        draw.text((5, 180), "Generate", font = font, fill = "red") # B button
-        # redraw menu
-        st7789.display(image)
-        generate_new_maze()
-        mode = MENU
-    
-    if mode != FINISHED and marble_y >= exit_index_y:
-        game_end = time.time()
-        duration = game_end - game_start
-        draw_completed(duration)
-        mode = FINISHED
-        # Make sure marble position setup for next run
-        marble_x = 0
-        marble_y = 0  
-
-    #time.sleep(0.05)
\ No newline at end of file
+        if marble_y >= exit_index_y:
+            stop_pipeline()
+            finish_game()
+
+    elif kind == MARBLE_EXIT and mode == PLAYING:
+        stop_pipeline()
+        finish_game()
+
+
+def finish_game():
+    # The marble has left the maze - show the time taken
+    global mode, marble_x, marble_y
+    game_end = time.time()
+    duration = game_end - game_start
+    draw_completed(duration)
+    mode = FINISHED
+    # Make sure marble position setup for next run
+    marble_x = 0
+    marble_y = 0
+
+
+def setup(backend_name=None):
+    # Create the hardware objects - the real board by default, or in-memory stand-ins when the
+    # MARBLE_MAZE_BACKEND environment variable (or backend_name) is 'headless'
+    global backend, bus, mpu, sensor_sampler, st7789, btn1, btn2, btn3, btn4, maze_pool, maze_cache, assets
+    global tall_screens, tall_mazes, use_pipeline, tick_rate
+    backend = create_backend(backend_name)
+    # Large-maze mode - MARBLE_MAZE_SCREENS=<n> plays new mazes n screens tall
+    tall_screens = int(os.environ.get(SCREENS_ENV) or 0)
+    # MARBLE_MAZE_PIPELINE=0 moves the marble on the main loop instead of the pipeline threads
+    use_pipeline = os.environ.get(PIPELINE_ENV, "1") != "0"
+    # MARBLE_MAZE_TICK_RATE=<n> runs the marble updates n times a second
+    tick_rate = float(os.environ.get(TICK_RATE_ENV) or TICK_RATE)
+
+    # Fonts, images and the static screens - loaded once, the screens from the cache file if still current
+    assets = AssetCache(font_file=FONT_FILE)
+    assets.screen("menu", MENU_SOURCES, render_menu)
+    assets.screen("completed", COMPLETED_SOURCES, render_completed)
+    assets.save()
+
+    # Setup gyro object
+    bus = backend.bus
+    mpu = MPU6050(bus, Device_Address, sample_rate_div=SENSOR_SAMPLE_RATE_DIV)
+    # Sample the accelerometer in the background so the game loop never waits on I2C - started when a game
+    # starts, and stopped on the other screens
+    sensor_sampler = SensorSampler(mpu)
+
+    # Setup screen object
+    st7789 = backend.display
+
+    # assign each button to a variable
+    btn1, btn2, btn3, btn4 = backend.buttons
+
+    # tell the button what to do when pressed
+    btn1.when_pressed = btn1handler
+    btn2.when_pressed = btn2handler
+    btn3.when_pressed = btn3handler
+    btn4.when_pressed = btn4handler
+
+    perf_modes = [mode for mode in os.environ.get(PERF_ENV, "").split(",") if mode]
+    if perf_modes:
+        setup_perf(perf_modes)
+
+    # Every maze generated is kept by its seed, so a known maze can be played again without generating it
+    maze_cache = MazeCache()
+    generate = maze_cache.generate
+    if os.path.isfile(os.path.join(MAZE_PACK_DIR, INDEX_FILE)):
+        # Play the curated mazes from a pack (made with maze_pack.py) before generating new ones
+        generate = MazePack(MAZE_PACK_DIR, fallback=maze_cache.generate).generate
+    # Keep a few ready mazes per difficulty level generated in the background so 'Generate' doesn't block
+    maze_pool = MazePool(generate=generate, on_ready=maze_ready_handler)
+    maze_pool.start()
+    if tall_screens:
+        # Large-maze mode - the next large maze is made in the background too, starting with this level's
+        tall_mazes = TallMazeMaker(tall_screens, on_ready=maze_ready_handler, size=SCREEN_SIZE,
+                                   start_y=MARBLE_START_Y, edge_x=MAZE_EDGE_X, marble_size=MARBLE_SIZE)
+        tall_mazes.start()
+
+    if os.environ.get(SEED_ENV):
+        # Play a known maze - MARBLE_MAZE_SEED=<seed> at the current difficulty
+        replay_maze(int(os.environ[SEED_ENV]))
+        return
+
+    mazefile = Path(MAZE_FILE)
+    if not mazefile.is_file():
+        if Path(MAZE_BASENAME + ".dat").is_file() or Path(MAZE_BASENAME + ".bmp").is_file():
+            # Maze saved by an older version - convert it to the maze file
+            migrate_legacy_pair(MAZE_BASENAME, difficulty)
+        else:
+            # File does not exist so create initial maze otherwise will continue to use previous maze until a new one is generated manually.
+            maze_pool.take(get_difficulty(), MAZE_BASENAME)
+
+
+def setup_perf(modes):
+    # Time the hot paths and show the stats - 'overlay' in the top right corner while playing, 'dump' as a
+    # JSON line every PERF_DUMP_INTERVAL seconds (to MARBLE_MAZE_PERF_FILE, or stdout)
+    global profiler, perf_overlay, perf_reporter
+    profiler = Profiler()
+    profiler.instrument(mpu, "read_fifo", "i2c")
+    profiler.instrument(mpu, "read_accel", "i2c")
+    profiler.instrument(sys.modules[__name__], "marble_fits", "collision")  # the physics is given it per maze
+    profiler.instrument(TallMaze, "fits", "collision")
+    profiler.instrument(st7789, "image_to_rgb565", "image_to_data")
+    profiler.instrument(st7789, "send", "spi")
+    profiler.counter("spi_bytes", lambda: st7789.spi_bytes)
+    profiler.counter("spi_transactions", lambda: st7789.spi_transactions)
+    profiler.counter("loop_iterations", lambda: loop_iterations)
+    profiler.counter("marble_ticks", lambda: pacer.ticks if pacer is not None else 0)
+    profiler.enable()
+
+    if "overlay" in modes:
+        perf_overlay = PerfOverlay(profiler, st7789, assets.font(10), perf_overlay_lines)
+    if "dump" in modes:
+        perf_reporter = PerfReporter(profiler, PERF_DUMP_INTERVAL, os.environ.get(PERF_FILE_ENV), perf_extra_stats)
+        perf_reporter.start()
+
+
+def perf_overlay_lines(stats):
+    # The overlay text - marble update rate, SPI throughput, and the mean I2C and collision check times
+    counters, stages = stats["counters"], stats["stages"]
+    return [
+        "tick {:.0f}/s loop {:.0f}/s".format(counters["marble_ticks"]["per_second"],
+                                             counters["loop_iterations"]["per_second"]),
+        "spi {:.1f}KB/s {:.0f}tx/s".format(counters["spi_bytes"]["per_second"] / 1024,
+                                           counters["spi_transactions"]["per_second"]),
+        "i2c {:.0f}us col {:.1f}us".format(stages["i2c"]["mean_us"], stages["collision"]["mean_us"]),
+    ]
+
+
+def perf_extra_stats():
+    # More stats for each dump line - the sensor, marble ticks, pipeline and large maze generation
+    return {
+        "sampler": sensor_sampler.stats(),
+        "pacer": pacer.stats() if pacer is not None else None,
+        "pipeline": marble_pipeline.stats() if marble_pipeline is not None else None,
+        "tall_mazes": tall_mazes.stats() if tall_mazes is not None else None,
+    }
+
+
+def replay_maze(seed, level=None):
+    # Make the maze for a seed (at the current difficulty if level is None) the current maze - loaded from
+    # the maze cache if it has been generated before
+    if level is None:
+        level = get_difficulty()
+    maze_cache.generate(level, MAZE_BASENAME, seed)
+
+
+def game_step(timeout=None):
+    # One pass of the main game loop - wait for the next event and handle it.  While playing without the
+    # marble pipeline the wait ends in time for the next marble update tick, otherwise the loop sleeps until a
+    # button press, a maze is ready or the marble leaves the maze (or 'timeout' seconds, if given).
+    global loop_iterations, event_count, tick_count
+    loop_iterations += 1
+
+    ticking = mode == PLAYING and not (marble_pipeline is not None and marble_pipeline.running)
+    if ticking:
+        timeout = pacer.remaining()
+    try:
+        event = events.get(timeout=timeout)
+        event_count += 1
+    except queue.Empty:
+        if not ticking:
+            return
+        if not pacer.due():
+            return  # woken a little early
+        event = (TICK, None)
+        tick_count += 1
+        # Schedule the next tick - ticks that can't be kept up with are skipped rather than caught up
+        pacer.tick()
+
+    handle_event(event)
+
+
+def loop_stats():
+    # Loop counters and CPU use since the last call, as a dictionary
+    global stats_start
+    wall, cpu = time.monotonic(), time.process_time()
+    elapsed = wall - stats_start[0]
+    stats = {
+        "iterations": loop_iterations,
+        "events": event_count,
+        "ticks": tick_count,
+        "redraws": dict(redraws),
+        "cpu_percent": 100.0 * (cpu - stats_start[1]) / elapsed if elapsed > 0 else 0.0,
+        "assets": {"bytes": assets.memory(), "loaded": assets.stats()},
+        "pipeline": marble_pipeline.stats() if marble_pipeline is not None else None,
+        "pacer": pacer.stats() if pacer is not None else None,
+    }
+    stats_start = (wall, cpu)
+    return stats
+
+
+def main():
+    setup()
+    show_menu()
+    while True:
+        game_step()
+
+
+if __name__ == "__main__":
+    main()
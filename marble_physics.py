@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : marble_physics.py
+# Description : Fixed-timestep physics for the marble.
+#               The accelerometer tilt (in g) is integrated into a velocity and a sub-pixel position at a
+#               fixed rate, independent of how fast the game loop or the display runs.  Walls stop the
+#               marble on the axis that hits them (with an optional bounce) while it keeps sliding on the
+#               other axis.  Only whole pixel changes of position need to be drawn.
+############################################################################
+
+import math
+
+
+class MarblePhysics(object):
+    """Marble position and velocity, advanced in fixed timesteps."""
+
+    def __init__(self, x, y, is_free, timestep=0.005, gain=300.0, friction=1.5, bounce=0.3,
+                 max_speed=150.0, dead_zone=0.02, max_steps=20):
+        """Create the simulation with the marble centred on pixel x, y.
+        :param is_free: Function (x, y) returning True if the marble can be centred on that pixel
+        :param timestep: Fixed simulation step in seconds
+        :param gain: Acceleration in pixels/s/s for 1 g of tilt
+        :param friction: Fraction of the velocity lost per second
+        :param bounce: Fraction of the velocity kept (reversed) after hitting a wall, 0 to just stop
+        :param max_speed: Speed limit in pixels/s
+        :param dead_zone: Tilt in g below which the marble isn't pushed - stops it creeping on a level board
+        :param max_steps: Most steps run by one update(), so a long stall doesn't freeze the game catching up
+        """
+        self.is_free = is_free
+        self.timestep = timestep
+        self.gain = gain
+        self.friction = friction
+        self.bounce = bounce
+        self.max_speed = max_speed
+        self.dead_zone = dead_zone
+        self.max_steps = max_steps
+        self.reset(x, y)
+
+    def reset(self, x, y, now=None):
+        """Put the marble at rest, centred on pixel x, y."""
+        # Positions are held as the pixel plus the fraction across it, so start in the middle of the pixel
+        self.x = x + 0.5
+        self.y = y + 0.5
+        self.vx = 0.0
+        self.vy = 0.0
+        self._last_time = now
+        self._remainder = 0.0
+        self.steps = 0
+
+    @property
+    def pixel(self):
+        """Whole pixel the marble is centred on, as (x, y)."""
+        return int(math.floor(self.x)), int(math.floor(self.y))
+
+    def update(self, ax, ay, now):
+        """Advance the simulation to time 'now' (seconds, monotonic) with a tilt of ax, ay in g.
+        Runs as many fixed timesteps as have elapsed and returns the new pixel position.
+        """
+        if self._last_time is None:
+            self._last_time = now
+        self._remainder += now - self._last_time
+        self._last_time = now
+
+        steps = int(self._remainder / self.timestep)
+        self._remainder -= steps * self.timestep
+        for _ in range(min(steps, self.max_steps)):
+            self.step(ax, ay)
+        return self.pixel
+
+    def step(self, ax, ay):
+        """Run one fixed timestep with a tilt of ax, ay in g."""
+        dt = self.timestep
+        if abs(ax) < self.dead_zone:
+            ax = 0.0
+        if abs(ay) < self.dead_zone:
+            ay = 0.0
+
+        damping = max(0.0, 1.0 - self.friction * dt)
+        self.vx = (self.vx + ax * self.gain * dt) * damping
+        self.vy = (self.vy + ay * self.gain * dt) * damping
+
+        speed = math.hypot(self.vx, self.vy)
+        if speed > self.max_speed:
+            self.vx *= self.max_speed / speed
+            self.vy *= self.max_speed / speed
+
+        # Move each axis separately so hitting a wall on one axis still lets the marble slide along it
+        self.x, self.vx = self._move(self.x, self.vx * dt, self.vx, lambda px: self.is_free(px, int(math.floor(self.y))))
+        self.y, self.vy = self._move(self.y, self.vy * dt, self.vy, lambda py: self.is_free(int(math.floor(self.x)), py))
+        self.steps += 1
+
+    def _move(self, position, distance, velocity, is_free):
+        # Move along one axis a pixel at a time, stopping at the edge of the last free pixel if a wall is hit
+        target = position + distance
+        pixel = int(math.floor(position))
+        target_pixel = int(math.floor(target))
+        direction = 1 if target_pixel > pixel else -1
+        while pixel != target_pixel:
+            if not is_free(pixel + direction):
+                # Stay just inside the current pixel and bounce back off the wall
+                edge = pixel + (0.999 if direction > 0 else 0.0)
+                return edge, -velocity * self.bounce
+            pixel += direction
+        return target, velocity
+
+
+def run_tilt_sequence(physics, samples):
+    """Drive the simulation from a recorded sequence of (time, ax, ay) samples.
+    Returns the list of pixel positions after each sample - the same sequence always gives the same result.
+    """
+    positions = []
+    for now, ax, ay in samples:
+        positions.append(physics.update(ax, ay, now))
+    return positions
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : marble_pipeline.py
+# Description : Pipelined marble updates while playing, so a slow SPI transfer never holds up the physics.
+#               Three stages, each on its own thread:
+#                 sensor     - the SensorSampler, filling its ring buffer from the MPU6050 FIFO
+#                 simulation - at a fixed tick rate (see frame_pacer.py), feeds the new tilt samples into the
+#                              marble physics and publishes the marble position whenever it moves to a new pixel
+#                 display    - draws the newest published position (erasing the last one it drew)
+#               Positions pass from the simulation to the display through LatestValue, a double-buffered
+#               hand-off - a position the display hasn't got to before the next is published is dropped
+#               rather than queued, so the display always draws the newest state.
+#               Latency from the tilt being sampled to the marble's pixels being sent is measured per stage.
+############################################################################
+
+import threading
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+from frame_pacer import FramePacer
+
+# A marble position published by the simulation, with the times it passed through each stage
+MarbleState = namedtuple("MarbleState", "x y sampled simulated published")
+
+STAGES = ("sensor", "simulation", "handoff", "display", "total")
+
+
+class LatestValue(object):
+    """Double-buffered hand-off of the newest value from one thread to another.
+    The writer fills the back slot and swaps it to the front, the reader takes the front.  A value that
+    hasn't been taken when the next is published is dropped, never queued.
+    """
+
+    def __init__(self):
+        self._slots = [None, None]
+        self._front = 0
+        self._fresh = False
+        self._condition = threading.Condition()
+
+        # Stats
+        self.published = 0
+        self.taken = 0
+        self.dropped = 0
+
+    def publish(self, value):
+        """Make value the newest - called by the one writer thread."""
+        back = 1 - self._front
+        self._slots[back] = value   # filled without the lock - the reader only ever uses the front slot
+        with self._condition:
+            self._front = back
+            if self._fresh:
+                self.dropped += 1
+            self._fresh = True
+            self.published += 1
+            self._condition.notify()
+
+    def take(self, timeout=None):
+        """Return the newest value not taken yet, waiting up to timeout seconds for one (None if none came)."""
+        with self._condition:
+            if not self._fresh:
+                self._condition.wait(timeout)
+                if not self._fresh:
+                    return None
+            self._fresh = False
+            self.taken += 1
+            return self._slots[self._front]
+
+    def wake(self):
+        """Wake a waiting reader, e.g. so it can see the pipeline is stopping."""
+        with self._condition:
+            self._condition.notify_all()
+
+
+class MarblePipeline(object):
+    """Simulation and display threads for the marble, fed by a SensorSampler's thread."""
+
+    def __init__(self, sampler, physics, tilt, draw, start, exit_y=None, on_exit=None, pacer=None,
+                 history=1000, clock=time.monotonic):
+        """Create the pipeline.
+        :param sampler: SensorSampler giving timestamped accelerometer samples
+        :param physics: MarblePhysics moved by the samples
+        :param tilt: Function (sample) returning the (ax, ay) tilt in g pushing the marble for a sample
+        :param draw: Function (old_x, old_y, new_x, new_y) moving the marble on the display
+        :param start: (x, y) pixel the marble is drawn at when the pipeline starts
+        :param exit_y: Pixel row the marble has left the maze at, or None
+        :param on_exit: Function called (once, on the simulation thread) when the marble reaches exit_y
+        :param pacer: FramePacer setting the simulation's tick rate, one tick per physics timestep if None
+        :param history: Latency measurements kept per stage, for the percentiles in stats()
+        :param clock: Monotonic clock - the same one the sampler timestamps with
+        """
+        self._sampler = sampler
+        self._physics = physics
+        self._tilt = tilt
+        self._draw = draw
+        self._start = tuple(start)
+        self._exit_y = exit_y
+        self._on_exit = on_exit
+        self.pacer = pacer if pacer is not None else FramePacer(1.0 / physics.timestep, clock=clock)
+        self._clock = clock
+        self._handoff = LatestValue()
+        self._stop = threading.Event()
+        self._threads = []
+        self.position = self._start     # last position drawn
+
+        # Stats - latency in seconds through each stage, newest last
+        self._latency = dict((stage, deque(maxlen=history)) for stage in STAGES)
+        self.frames = 0     # positions drawn
+        self.samples = 0    # tilt samples fed to the physics
+
+    @property
+    def running(self):
+        return bool(self._threads)
+
+    def start(self):
+        """Start the simulation and display threads."""
+        if self._threads:
+            return
+        self._stop.clear()
+        self.pacer.start()
+        for name, target in (("marble-simulation", self._simulate), ("marble-display", self._display)):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Stop both threads, waiting for them - the display is free to use once this returns."""
+        self._stop.set()
+        self._handoff.wake()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self.pacer.stop()
+
+    def stats(self):
+        """Return frame counts and the latency percentiles (in ms) of each stage as a dictionary."""
+        stats = {
+            "frames": self.frames,
+            "samples": self.samples,
+            "published": self._handoff.published,
+            "dropped": self._handoff.dropped,
+            "ticks": self.pacer.stats(),
+        }
+        for stage in STAGES:
+            times = np.array(self._latency[stage]) * 1000.0
+            if len(times):
+                stats[stage] = {"p50": float(np.percentile(times, 50)), "p95": float(np.percentile(times, 95)),
+                                "max": float(times.max())}
+            else:
+                stats[stage] = None
+        return stats
+
+    def _simulate(self):
+        x, y = self._start
+        exited = False
+        while self.pacer.wait(self._stop):
+            samples = self._sampler.drain()
+            if samples:
+                simulated = self._clock()
+                for sample in samples:
+                    ax, ay = self._tilt(sample)
+                    new_x, new_y = self._physics.update(ax, ay, sample[0])
+                self.samples += len(samples)
+                # Only positions on a new pixel need drawing
+                if (new_x, new_y) != (x, y):
+                    x, y = new_x, new_y
+                    self._handoff.publish(MarbleState(x, y, samples[-1][0], simulated, self._clock()))
+                    if not exited and self._exit_y is not None and y >= self._exit_y:
+                        exited = True
+                        if self._on_exit is not None:
+                            self._on_exit()
+
+    def _display(self):
+        x, y = self._start
+        while not self._stop.is_set():
+            state = self._handoff.take(timeout=0.1)
+            if state is None:
+                continue
+            taken = self._clock()
+            self._draw(x, y, state.x, state.y)
+            done = self._clock()    # the marble's pixels have been sent
+            x, y = state.x, state.y
+            self.position = (x, y)
+            self.frames += 1
+            latency = self._latency
+            latency["sensor"].append(state.simulated - state.sampled)
+            latency["simulation"].append(state.published - state.simulated)
+            latency["handoff"].append(taken - state.published)
+            latency["display"].append(done - taken)
+            latency["total"].append(done - state.sampled)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : maze_algorithms.py
+# Description : Maze generation algorithms behind one interface - (height, width, seed) -> int8 cell grid
+#               of tdf_maze_generator.CELL / WALL blocks with the entrance and exit opened:
+#                 prim        - the original randomized Prim (tdf_maze_generator.carve_maze)
+#                 backtracker - recursive backtracker, with an explicit stack
+#                 kruskal     - randomized Kruskal with union-find
+#                 eller       - Eller's algorithm, one row at a time (eller_rows streams the rows)
+#               Apart from Prim, which carves wall blocks directly, the cells sit on the odd rows and
+#               columns with walls between.  When a side is even the spare row / column next to the border
+#               stays wall, and the exit is opened down through it.
+#               is_perfect() checks a grid is a perfect maze - every corridor block reachable by one path.
+############################################################################
+
+import random
+
+import numpy as np
+
+import maze_solver
+import tdf_maze_generator
+from tdf_maze_generator import CELL, WALL, open_doors
+
+
+def _lattice(height, width):
+    # Number of cell rows and columns that fit on the odd rows and columns inside the border
+    return (height - 1) // 2, (width - 1) // 2
+
+
+def carve_prim(height, width, seed):
+    """Randomized Prim on wall blocks - the game's original generator."""
+    return tdf_maze_generator.carve_maze(height, width, seed)
+
+
+def carve_backtracker(height, width, seed):
+    """Recursive backtracker (depth first search) with an explicit stack - long winding corridors."""
+    rand = random.Random(seed)
+    rows, cols = _lattice(height, width)
+    maze = np.full((height, width), WALL, dtype=np.int8)
+    visited = bytearray(rows * cols)
+    stack = [(rand.randrange(rows), rand.randrange(cols))]
+    visited[stack[0][0] * cols + stack[0][1]] = 1
+    maze[2 * stack[0][0] + 1, 2 * stack[0][1] + 1] = CELL
+    while stack:
+        r, c = stack[-1]
+        choices = [(r + dr, c + dc) for dr, dc in ((-1, 0), (0, 1), (1, 0), (0, -1))
+                   if 0 <= r + dr < rows and 0 <= c + dc < cols and not visited[(r + dr) * cols + c + dc]]
+        if not choices:
+            stack.pop()
+            continue
+        nr, nc = choices[int(rand.random() * len(choices))]
+        visited[nr * cols + nc] = 1
+        maze[2 * nr + 1, 2 * nc + 1] = CELL
+        maze[r + nr + 1, c + nc + 1] = CELL  # the wall between the two cells
+        stack.append((nr, nc))
+    return open_doors(maze)
+
+
+def carve_kruskal(height, width, seed):
+    """Randomized Kruskal - knock down walls in random order when they join two separate sets of cells."""
+    rand = random.Random(seed)
+    rows, cols = _lattice(height, width)
+    maze = np.full((height, width), WALL, dtype=np.int8)
+    maze[1:2 * rows:2, 1:2 * cols:2] = CELL
+    parent = list(range(rows * cols))
+
+    def find(cell):
+        # Union-find root, halving the path on the way
+        while parent[cell] != cell:
+            parent[cell] = parent[parent[cell]]
+            cell = parent[cell]
+        return cell
+
+    edges = [(i, i + 1) for i in range(rows * cols) if (i % cols) + 1 < cols]
+    edges += [(i, i + cols) for i in range(rows * cols - cols)]
+    rand.shuffle(edges)
+    for a, b in edges:
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[root_a] = root_b
+            maze[(a // cols) + (b // cols) + 1, (a % cols) + (b % cols) + 1] = CELL
+    return open_doors(maze)
+
+
+def eller_rows(height, width, seed):
+    """Generate a maze with Eller's algorithm, yielding it one int8 row at a time.  Only the set labels of
+    the current row of cells are kept, so the memory used doesn't grow with the height.
+    """
+    rand = random.Random(seed)
+    rows, cols = _lattice(height, width)
+    wall_row = np.full(width, WALL, dtype=np.int8)
+
+    # Top border with the entrance above the first cell (the first cell in row 1 is always at column 1)
+    row = wall_row.copy()
+    row[1] = CELL
+    yield row
+
+    sets = list(range(cols))
+    next_set = cols
+    for r in range(rows):
+        last = r == rows - 1
+        cells = wall_row.copy()
+        cells[1:2 * cols:2] = CELL
+        # Join neighbouring cells in different sets - at random, or always on the last row so it all connects
+        for c in range(cols - 1):
+            if sets[c] != sets[c + 1] and (last or rand.random() < 0.5):
+                cells[2 * c + 2] = CELL
+                old = sets[c + 1]
+                sets = [sets[c] if s == old else s for s in sets]
+        yield cells
+        if last:
+            break
+
+        # Carry each set down at least once, at random columns
+        below = wall_row.copy()
+        members = {}
+        for c, s in enumerate(sets):
+            members.setdefault(s, []).append(c)
+        carried = [False] * cols
+        for s, columns in members.items():
+            rand.shuffle(columns)
+            count = 1 + int(rand.random() * len(columns))
+            for c in columns[:count]:
+                carried[c] = True
+                below[2 * c + 1] = CELL
+        yield below
+        # Cells not carried down start new sets on the next row
+        for c in range(cols):
+            if not carried[c]:
+                sets[c] = next_set
+                next_set += 1
+
+    # Walls below the last row of cells (two rows when the height is even), with the exit below its last cell
+    for _ in range(height - 2 * rows):
+        row = wall_row.copy()
+        row[2 * cols - 1] = CELL
+        yield row
+
+
+def carve_eller(height, width, seed):
+    """Eller's algorithm, collected into a grid."""
+    return np.array(list(eller_rows(height, width, seed)), dtype=np.int8)
+
+
+ALGORITHMS = {
+    "prim": carve_prim,
+    "backtracker": carve_backtracker,
+    "kruskal": carve_kruskal,
+    "eller": carve_eller,
+}
+
+
+def carve(algorithm, height, width, seed):
+    """Generate a maze grid with the named algorithm."""
+    try:
+        generate = ALGORITHMS[algorithm]
+    except KeyError:
+        raise ValueError("Unknown maze algorithm '{}', expected one of {}".format(algorithm, ", ".join(sorted(ALGORITHMS))))
+    return generate(height, width, seed)
+
+
+def is_perfect(maze):
+    """True if the corridor blocks of a grid form a perfect maze - all connected, with no loops (so exactly
+    one path between any two of them).  Passages are between side by side blocks.
+    """
+    corridor = np.asarray(maze) == CELL
+    blocks = int(np.count_nonzero(corridor))
+    if blocks == 0:
+        return False
+    links = (int(np.count_nonzero(corridor[1:, :] & corridor[:-1, :])) +
+             int(np.count_nonzero(corridor[:, 1:] & corridor[:, :-1])))
+    if links != blocks - 1:
+        return False
+    # A graph with one fewer link than blocks is a tree exactly when it is connected
+    start = tuple(int(v) for v in np.argwhere(corridor)[0])
+    return bool(((maze_solver.distance_field(~corridor, start) >= 0) == corridor).all())
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : maze_cache.py
+# Description : On-disk cache of generated mazes keyed by (seed, difficulty level).
+#               Generation is deterministic for a seed, so a maze file is named by a hash of everything
+#               that decides its contents (generator, seed, grid size, thickness).  Replaying a known seed
+#               copies the cached file instead of generating it again.  The folder is kept under a size
+#               limit by removing the least recently used mazes - each use refreshes a file's modification
+#               time, which is what the eviction goes by.
+############################################################################
+
+import hashlib
+import os
+import shutil
+import threading
+
+import tdf_maze_generator
+
+GENERATOR_VERSION = 1   # changes whenever the same seed would carve a different maze
+
+
+def maze_key(seed, level, algorithm=None):
+    """Cache key for the maze generated from a seed at a difficulty level by an algorithm (the generator's
+    current_algorithm if None).
+    """
+    thickness = tdf_maze_generator.difficulty[level]
+    maze_size = int(240 / thickness) - 1
+    text = "{}-{}:{}:{}x{}:{}".format(algorithm or tdf_maze_generator.current_algorithm, GENERATOR_VERSION,
+                                      seed, maze_size, maze_size, thickness)
+    return hashlib.sha1(text.encode("ascii")).hexdigest()
+
+
+class MazeCache(object):
+    """Folder of generated maze files keyed by (seed, level), evicting the least recently used over max_bytes."""
+
+    def __init__(self, directory="maze_cache", max_bytes=1024 * 1024, generate=tdf_maze_generator.generate_maze_file):
+        """Create the cache.
+        :param directory: Folder holding the cached mazes
+        :param max_bytes: Most bytes of maze files kept - the least recently used are removed beyond this
+        :param generate: Function (level, basename, seed) writing <basename>.maze and returning the seed
+        """
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._generate = generate
+        self._lock = threading.Lock()   # the maze pool generates through the cache on its own thread
+
+        # Stats
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, seed, level):
+        """Path of the cached maze file for a seed and level (which may not exist)."""
+        return os.path.join(self._directory, maze_key(seed, level) + ".maze")
+
+    def get(self, seed, level, basename="generated_maze"):
+        """Copy the cached maze for a seed and level to <basename>.maze.  Returns False if it isn't cached."""
+        path = self.path(seed, level)
+        with self._lock:
+            try:
+                _copy(path, basename + ".maze")
+                os.utime(path)  # most recently used
+            except OSError:
+                self.misses += 1
+                return False
+            self.hits += 1
+            return True
+
+    def put(self, filename, seed, level):
+        """Add a maze file generated from a seed at a level, then evict down to the size limit."""
+        with self._lock:
+            _copy(filename, self.path(seed, level))
+            self._evict()
+
+    def generate(self, level, basename="generated_maze", seed=None):
+        """Write the maze for a level and seed (a new seed if None) to <basename>.maze, from the cache if it
+        is there, otherwise generating and caching it.  Returns the seed.
+        """
+        if seed is not None and self.get(seed, level, basename):
+            return seed
+        seed = self._generate(level, basename, seed)
+        self.put(basename + ".maze", seed, level)
+        return seed
+
+    def stats(self):
+        """Return cache statistics as a dictionary."""
+        with self._lock:
+            files = self._files()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "mazes": len(files),
+                "bytes": sum(size for _, size, _ in files),
+                "max_bytes": self._max_bytes,
+            }
+
+    def _files(self):
+        # (last used, size, path) for each cached maze
+        files = []
+        for filename in os.listdir(self._directory):
+            if not filename.endswith(".maze"):
+                continue
+            path = os.path.join(self._directory, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime_ns, stat.st_size, path))
+        return files
+
+    def _evict(self):
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self._max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+
+
+def _copy(source, target):
+    # Copy beside the target then rename, so a reader never sees the file part written
+    temp = target + ".tmp"
+    shutil.copyfile(source, temp)
+    os.replace(temp, target)
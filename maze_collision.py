@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : maze_collision.py
+# Description : Free-space map for marble collisions.
+#               The walkable area of the maze data is shrunk by the marble's footprint once per maze, so
+#               checking whether the marble fits at a position is a single boolean lookup for any marble
+#               size, and never misses a wall thinner than the marble.  The map is cached next to the
+#               maze data file, keyed on a checksum of the file's contents (as load_maze keys its cached
+#               expansion), so it is only worked out once for each maze.
+############################################################################
+
+import os
+import zlib
+
+import numpy as np
+
+
+def free_space_mask(maze_data, marble_size):
+    """Return a boolean array, True where a marble_size x marble_size marble centred on that pixel
+    touches no wall.  maze_data is the 2D collision data, 0 for corridors and non zero for walls.
+    """
+    walls = np.asarray(maze_data) != 0
+    height, width = walls.shape
+    before = marble_size // 2           # footprint pixels before the centre
+    after = marble_size - 1 - before    # and after it (differs for even sizes)
+
+    # Summed-area table of walls, so the wall count under any footprint is four lookups
+    table = np.zeros((height + 1, width + 1), dtype=np.int32)
+    table[1:, 1:] = walls.cumsum(axis=0).cumsum(axis=1)
+
+    free = np.zeros((height, width), dtype=bool)
+    if height < marble_size or width < marble_size:
+        return free
+    top = table[:height - marble_size + 1, :width - marble_size + 1]
+    right = table[:height - marble_size + 1, marble_size:]
+    bottom = table[marble_size:, :width - marble_size + 1]
+    corner = table[marble_size:, marble_size:]
+    free[before:height - after, before:width - after] = (corner - right - bottom + top) == 0
+    return free
+
+
+def _file_key(path):
+    # Identifies a particular version of the data file by its contents - a file rewritten within the
+    # timestamp resolution, at the same size, still gets a new key
+    with open(path, "rb") as f:
+        return np.array([zlib.crc32(f.read())], dtype=np.int64)
+
+
+def load_free_space(data_path, maze_data, marble_size):
+    """Return the free-space mask for maze_data, re-using the cache beside data_path when it is
+    still for the same data file and marble size, otherwise working it out and saving it.
+    """
+    cache_path = "{}.free{}.npz".format(os.path.splitext(data_path)[0], marble_size)
+    key = _file_key(data_path)
+    shape = np.asarray(maze_data).shape
+    try:
+        with np.load(cache_path) as cache:
+            if np.array_equal(cache["key"], key) and tuple(cache["shape"]) == shape:
+                return np.unpackbits(cache["free"], count=shape[0] * shape[1]).reshape(shape).astype(bool)
+    except (OSError, KeyError, ValueError):
+        pass
+
+    free = free_space_mask(maze_data, marble_size)
+    try:
+        np.savez(cache_path, key=key, shape=np.array(shape), free=np.packbits(free))
+    except OSError:
+        pass  # caching is only an optimisation
+    return free
+
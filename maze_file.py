@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : maze_file.py
+# Description : Compact maze file format (.maze), replacing the full resolution .bmp + .dat pair.
+#               The file holds a small header and the logical cell grid packed 8 cells to a byte:
+#                 magic 'MAZE', version, flags, grid height and width, wall_corridor_thickness,
+#                 entrance and exit cells (row, col), generator seed
+#               followed (from version 2) by the shortest path from entrance to exit, as a 16 bit move count
+#               and 2 bit moves packed 4 to a byte (see maze_solver.py).
+#               The screen image and collision data are worked out from the grid when the maze is loaded,
+#               or memory-mapped from an optional cached expansion (<base>.<crc>.npy) beside the file.
+#               Existing .bmp/.dat pairs are read for migration.
+#               load_maze() returns a Maze with everything play needs (start position, bottom edge, collision
+#               data, screen image) worked out once from the header and the small cell grid.
+############################################################################
+
+import glob
+import math
+import os
+import struct
+import zlib
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+from maze_solver import Solution, path_from_moves
+from ST7789 import color565
+
+MAGIC = b'MAZE'
+VERSION = 2
+HEADER = struct.Struct('<4sBBHHHhhhhQ')
+SOLUTION = struct.Struct('<H')
+FLAG_SEED = 0x01          # header holds the seed the maze was generated from
+FLAG_SOLUTION = 0x02      # the shortest path follows the cell grid
+
+WALL_COLOUR = (255, 0, 0)  # red walls, black corridors
+WALL_RGB565 = color565(*WALL_COLOUR)
+
+MazeHeader = namedtuple("MazeHeader", "version height width thickness entrance exit seed moves")
+
+
+class MazeFileError(ValueError):
+    """The file isn't a maze file this version can read."""
+
+
+def _door(walls, row):
+    # First open cell in a row, as (row, col), or (-1, -1) if the row is solid wall
+    cells = np.flatnonzero(~walls[row])
+    return (row, int(cells[0])) if len(cells) else (-1, -1)
+
+
+def _pack_moves(moves):
+    # 2 bit moves, 4 to a byte, first move in the top bits
+    padded = np.zeros((len(moves) + 3) // 4 * 4, dtype=np.uint8)
+    padded[:len(moves)] = moves
+    return ((padded[0::4] << 6) | (padded[1::4] << 4) | (padded[2::4] << 2) | padded[3::4]).tobytes()
+
+
+def _unpack_moves(packed, count):
+    packed = np.asarray(packed, dtype=np.uint8)
+    return np.stack(((packed >> 6) & 3, (packed >> 4) & 3, (packed >> 2) & 3, packed & 3), axis=1).ravel()[:count]
+
+
+def encode_maze(walls, thickness, seed=None, solve=True):
+    """Return the .maze file contents for a grid of wall cells (True / non zero for a wall).
+    With solve the shortest path from entrance to exit is worked out and stored too.
+    """
+    walls = np.asarray(walls, dtype=bool)
+    height, width = walls.shape
+    entrance = _door(walls, 0)
+    exit = _door(walls, height - 1)
+    flags = FLAG_SEED if seed is not None else 0
+    solution = b''
+    if solve and entrance[0] >= 0 and exit[0] >= 0:
+        found = Solution(walls, entrance, exit)
+        if found.solvable and found.length <= 0xFFFF:
+            flags |= FLAG_SOLUTION
+            solution = SOLUTION.pack(found.length) + _pack_moves(found.moves())
+    header = HEADER.pack(MAGIC, VERSION, flags, height, width, thickness,
+                         entrance[0], entrance[1], exit[0], exit[1], seed or 0)
+    return header + np.packbits(walls).tobytes() + solution
+
+
+def decode_maze(data):
+    """Return (MazeHeader, wall grid) from .maze file contents."""
+    if len(data) < HEADER.size:
+        raise MazeFileError("maze file too short")
+    magic, version, flags, height, width, thickness, er, ec, xr, xc, seed = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise MazeFileError("not a maze file")
+    if version > VERSION:
+        raise MazeFileError("maze file version {} is newer than {}".format(version, VERSION))
+    grid_bytes = (height * width + 7) // 8
+    packed = np.frombuffer(data, dtype=np.uint8, count=min(grid_bytes, len(data) - HEADER.size), offset=HEADER.size)
+    if len(packed) < grid_bytes:
+        raise MazeFileError("maze file truncated")
+    walls = np.unpackbits(packed, count=height * width).reshape(height, width).astype(bool)
+    moves = None
+    if flags & FLAG_SOLUTION:
+        offset = HEADER.size + grid_bytes
+        if len(data) < offset + SOLUTION.size:
+            raise MazeFileError("maze file truncated")
+        count, = SOLUTION.unpack_from(data, offset)
+        offset += SOLUTION.size
+        if len(data) < offset + (count + 3) // 4:
+            raise MazeFileError("maze file truncated")
+        moves = _unpack_moves(np.frombuffer(data, dtype=np.uint8, count=(count + 3) // 4, offset=offset), count)
+    header = MazeHeader(version, height, width, thickness, (er, ec), (xr, xc), seed if flags & FLAG_SEED else None,
+                        moves)
+    return header, walls
+
+
+def write_maze(path, walls, thickness, seed=None, solve=True):
+    """Write a maze file, with its shortest path if solve.  The file is written beside the target and
+    renamed over it, so a reader never sees it part written.
+    """
+    temp = path + ".tmp"
+    with open(temp, "wb") as f:
+        f.write(encode_maze(walls, thickness, seed, solve))
+    os.replace(temp, path)
+
+
+def read_maze(path):
+    """Read a maze file, returning (MazeHeader, wall grid)."""
+    with open(path, "rb") as f:
+        return decode_maze(f.read())
+
+
+def expand(walls, thickness):
+    """Scale a wall grid up to screen pixels - 1 for wall, 0 for corridor, thickness x thickness per cell.
+    This is the collision data that used to be saved as the .dat file.
+    """
+    return np.asarray(walls, dtype=np.uint8).repeat(thickness, axis=0).repeat(thickness, axis=1)
+
+
+def wall_image(wall_pixels, size=None):
+    """PIL RGB image of expanded wall pixels, red walls on black, on a black size x size board if given."""
+    height, width = wall_pixels.shape
+    if size is None:
+        size = (width, height)
+    else:
+        size = (size, size)
+    rgb = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+    h, w = min(height, size[1]), min(width, size[0])
+    walls = (wall_pixels[:h, :w] != 0).view(np.uint8)
+    # One multiply per colour channel - much quicker than a masked assignment of the colour tuple
+    for channel, value in enumerate(WALL_COLOUR):
+        if value:
+            rgb[:h, :w, channel] = walls * value
+    return Image.fromarray(rgb, "RGB")
+
+
+class Maze(object):
+    """A loaded maze, with the values play needs worked out from the header and cell grid when it is made."""
+
+    def __init__(self, header, walls, pixels=None, start_y=5, edge_x=10):
+        """Create the maze.
+        :param header: MazeHeader from the file
+        :param walls: Cell grid, True for a wall
+        :param pixels: Collision data (1 for wall, 0 for corridor per pixel), scaled up from walls if None
+        :param start_y: Pixel row the marble starts on
+        :param edge_x: Pixel column the bottom edge of the maze is measured along
+        """
+        self.header = header
+        self.walls = walls
+        self.thickness = header.thickness
+        self.pixels = pixels if pixels is not None else expand(walls, header.thickness)
+        # Width and height of the maze in pixels
+        self.bounds = (header.width * header.thickness, header.height * header.thickness)
+        self.entrance_span = self._entrance_span(start_y)
+        self.start = ((self.entrance_span[0] + self.entrance_span[1]) // 2, start_y)
+        self.bottom_edge = self._bottom_edge(edge_x)
+        self._solution = None
+
+    @property
+    def solution(self):
+        """The maze's Solution (distance field and shortest path), worked out the first time it is used.
+        The path comes from the file when it was stored there.
+        """
+        if self._solution is None:
+            header = self.header
+            path = path_from_moves(header.entrance, header.moves) if header.moves is not None else None
+            self._solution = Solution(self.walls, header.entrance, header.exit, path)
+        return self._solution
+
+    def _entrance_span(self, y):
+        # Pixel columns x0 <= x < x1 of the opening at pixel row y that the entrance leads into - the corridor
+        # runs on from the entrance cell until the next wall along the cell row
+        t = self.thickness
+        row = self.walls[min(y // t, self.header.height - 1)]
+        col = self.header.entrance[1]
+        if col < 0 or row[col]:
+            col = int(np.flatnonzero(~row)[0]) if (~row).any() else -1
+        if col < 0:
+            raise MazeFileError("maze has no entrance")
+        closed = np.flatnonzero(row[col:])
+        end = col + int(closed[0]) if len(closed) else self.header.width
+        return col * t, end * t
+
+    def _bottom_edge(self, x):
+        # Lowest wall pixel row in pixel column x - the bottom edge of the maze
+        t = self.thickness
+        column = np.flatnonzero(self.walls[:, min(x // t, self.header.width - 1)])
+        if not len(column):
+            raise MazeFileError("maze has no bottom edge")
+        return (int(column[-1]) + 1) * t - 1
+
+    def rgb565(self, size):
+        """The maze as a size x size array of RGB565 values, red walls on black, ready for the display."""
+        screen = np.zeros((size, size), dtype=np.uint16)
+        h, w = min(self.bounds[1], size), min(self.bounds[0], size)
+        screen[:h, :w] = (self.pixels[:h, :w] != 0) * np.uint16(WALL_RGB565)
+        return screen
+
+    def image(self, size=None):
+        """PIL RGB image of the maze, on a black size x size board if given."""
+        return wall_image(self.pixels, size)
+
+
+def load_maze(path, cache_expansion=False, **kwargs):
+    """Read a maze file and return a Maze (extra keyword arguments are passed on to Maze).
+    With cache_expansion the expanded pixels are saved beside the file, named by a checksum of its contents,
+    and memory-mapped (read only) on later loads of the same maze.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    header, walls = decode_maze(data)
+    if not cache_expansion:
+        return Maze(header, walls, **kwargs)
+
+    base = os.path.splitext(path)[0]
+    cache_path = "{}.{:08x}.npy".format(base, zlib.crc32(data))
+    shape = (header.height * header.thickness, header.width * header.thickness)
+    try:
+        pixels = np.load(cache_path, mmap_mode='r')
+        if pixels.shape == shape and pixels.dtype == np.uint8:
+            return Maze(header, walls, pixels, **kwargs)
+    except (OSError, ValueError):
+        pass
+
+    pixels = expand(walls, header.thickness)
+    try:
+        # Only the expansion of the current maze is kept
+        for stale in glob.glob(glob.escape(base) + ".*.npy"):
+            os.remove(stale)
+        np.save(cache_path + ".tmp.npy", pixels)
+        os.replace(cache_path + ".tmp.npy", cache_path)
+    except OSError:
+        pass  # caching is only an optimisation
+    return Maze(header, walls, pixels, **kwargs)
+
+
+def read_legacy_pair(basename, thicknesses):
+    """Read an old <basename>.dat (or, without it, <basename>.bmp) maze and return its wall grid and thickness.
+    The old files don't record the thickness, so each of 'thicknesses' is tried and the one that scales the
+    sampled grid back up to exactly the same pixels is used.
+    """
+    if os.path.isfile(basename + ".dat"):
+        data = np.fromfile(basename + ".dat", dtype=np.uint8)
+        side = int(math.sqrt(len(data)))  # always a square shape
+        pixels = data[:side * side].reshape(side, side) != 0
+    else:
+        pixels = np.array(Image.open(basename + ".bmp").convert("RGB"))[:, :, 0] != 0
+    for thickness in sorted(thicknesses, reverse=True):
+        if pixels.shape[0] % thickness or pixels.shape[1] % thickness:
+            continue
+        walls = pixels[::thickness, ::thickness]
+        if np.array_equal(expand(walls, thickness) != 0, pixels):
+            return walls, thickness
+    raise MazeFileError("{} doesn't match any wall thickness".format(basename))
+
+
+def migrate_legacy_pair(basename, thicknesses, remove=True):
+    """Convert <basename>.bmp/.dat to <basename>.maze (seed unknown), removing the old pair if asked.
+    Returns the path of the new file.
+    """
+    walls, thickness = read_legacy_pair(basename, thicknesses)
+    path = basename + ".maze"
+    write_maze(path, walls, thickness)
+    if remove:
+        for ext in (".bmp", ".dat"):
+            try:
+                os.remove(basename + ext)
+            except OSError:
+                pass
+    return path
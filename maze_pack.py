@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : maze_pack.py
+# Description : Batch generation of curated maze packs, and reading them on the device.
+#               Run on a desktop to generate N mazes per difficulty level across all cores, score each
+#               one and keep the best for a pack:
+#                 python3 maze_pack.py --per-level 200 --keep 20 --output maze_pack
+#               Each maze is scored on its solution length, dead ends and branching (see maze_metrics).
+#               The pack is a folder of .maze files per level with an index.json of the seeds and scores.
+#               Copy it next to marble_maze.py and the game plays the pack's mazes before generating any.
+############################################################################
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import maze_algorithms
+import maze_file
+import tdf_maze_generator
+
+PACK_VERSION = 1
+INDEX_FILE = "index.json"
+CURSOR_FILE = "cursor.json"
+SCORES = ("solution_length", "dead_ends", "branching")
+
+
+def maze_metrics(walls, solution):
+    """Quality scores for a maze: solution length in moves, dead ends (open cells with one way out, not
+    counting the entrance and exit doors in the first and last rows) and branching (average number of ways on
+    from a junction, a cell with 3 or more ways out).
+    """
+    walls = np.asarray(walls, dtype=bool)
+    open_cells = np.pad(~walls, 1).astype(np.int8)
+    # Open neighbours of each cell, counted with four shifted views of the padded grid
+    ways = open_cells[:-2, 1:-1] + open_cells[2:, 1:-1] + open_cells[1:-1, :-2] + open_cells[1:-1, 2:]
+    ways = np.where(~walls, ways, 0)
+    junctions = ways >= 3
+    # The doors always have one way out - they are the ends of the solution, not dead ends
+    inside = ~walls
+    inside[[0, -1]] = False
+    return {
+        "solution_length": solution.length,
+        "dead_ends": int(np.count_nonzero(inside & (ways == 1))),
+        "junctions": int(np.count_nonzero(junctions)),
+        "branching": float((ways[junctions] - 1).mean()) if junctions.any() else 0.0,
+    }
+
+
+def generate_scored(job):
+    """Generate and score the maze for a (level, seed, algorithm) job - returns (level, seed, file contents, metrics).
+    Runs in the worker processes, so everything it needs comes in the job and goes back in the result.
+    """
+    level, seed, algorithm = job
+    maze, seed = tdf_maze_generator.generate_maze(level, seed, algorithm)
+    walls = tdf_maze_generator.maze_walls(maze)
+    data = maze_file.encode_maze(walls, tdf_maze_generator.difficulty[level], seed)
+    header, walls = maze_file.decode_maze(data)
+    solution = maze_file.Maze(header, walls).solution
+    return level, seed, data, maze_metrics(walls, solution)
+
+
+def generate_batch(levels, per_level, workers=None, first_seed=None, algorithm=None):
+    """Generate per_level mazes for each level on a pool of worker processes (all cores if workers is None),
+    with one of the maze_algorithms (the generator's current_algorithm if None).
+    Returns the list of generate_scored results and the elapsed seconds.
+    """
+    if first_seed is None:
+        first_seed = tdf_maze_generator.new_seed()
+    algorithm = algorithm or tdf_maze_generator.current_algorithm
+    jobs = [(level, (first_seed + level * per_level + i) & 0xFFFFFFFF, algorithm)
+            for level in levels for i in range(per_level)]
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    if workers == 1:
+        results = [generate_scored(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Hand out jobs in chunks so the per-job messaging cost doesn't swamp the small mazes
+            chunksize = max(1, len(jobs) // (4 * workers))
+            results = list(executor.map(generate_scored, jobs, chunksize=chunksize))
+    return results, time.perf_counter() - start
+
+
+def curate(results, keep, score="solution_length"):
+    """Pick the 'keep' best mazes per level by a score (highest first), as {level: [result, ...]}."""
+    by_level = {}
+    for result in results:
+        by_level.setdefault(result[0], []).append(result)
+    return dict((level, sorted(found, key=lambda r: r[3][score], reverse=True)[:keep])
+                for level, found in by_level.items())
+
+
+def write_pack(directory, curated, score, algorithm=None):
+    """Write a pack folder - level<n>/<seed>.maze files and index.json listing them with their scores."""
+    temp = directory + ".tmp"
+    shutil.rmtree(temp, ignore_errors=True)
+    index = {"version": PACK_VERSION, "created": time.strftime("%Y-%m-%d %H:%M:%S"), "score": score,
+             "algorithm": algorithm or tdf_maze_generator.current_algorithm, "levels": {}}
+    for level, chosen in sorted(curated.items()):
+        os.makedirs(os.path.join(temp, "level{}".format(level)))
+        entries = []
+        for _, seed, data, metrics in chosen:
+            name = os.path.join("level{}".format(level), "{}.maze".format(seed))
+            with open(os.path.join(temp, name), "wb") as f:
+                f.write(data)
+            entry = {"file": name, "seed": seed}
+            entry.update(metrics)
+            entries.append(entry)
+        index["levels"][str(level)] = entries
+    with open(os.path.join(temp, INDEX_FILE), "w") as f:
+        json.dump(index, f, indent=1)
+    # Swap the finished pack in, so the game never sees a part written one
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(temp, directory)
+
+
+class MazePack(object):
+    """A maze pack on the device - hands out each level's mazes in turn, then falls back to generating."""
+
+    def __init__(self, directory="maze_pack", fallback=tdf_maze_generator.generate_maze_file):
+        """Open a pack.
+        :param directory: Pack folder written by write_pack()
+        :param fallback: Function (level, basename, seed) used once a level's mazes have all been played
+        """
+        self._directory = directory
+        self._fallback = fallback
+        self._lock = threading.Lock()   # used from the maze pool's thread
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            index = json.load(f)
+        self.levels = dict((int(level), entries) for level, entries in index["levels"].items())
+        self._cursor = {}
+        try:
+            with open(os.path.join(directory, CURSOR_FILE)) as f:
+                self._cursor = dict((int(level), position) for level, position in json.load(f).items())
+        except (OSError, ValueError):
+            pass
+
+        # Stats
+        self.served = 0     # mazes handed out from the pack
+        self.fallbacks = 0  # mazes generated because the pack had none left for the level
+
+    def remaining(self, level):
+        """Number of the level's pack mazes not handed out yet."""
+        with self._lock:
+            return len(self.levels.get(level, ())) - self._cursor.get(level, 0)
+
+    def generate(self, level, basename="generated_maze", seed=None):
+        """Write the level's next pack maze to <basename>.maze, or generate one once they are used up (or a
+        particular seed is asked for).  Returns the seed.  Same arguments as generate_maze_file, so it can be
+        used as the maze pool's generate function.
+        """
+        entry = None
+        with self._lock:
+            if seed is None:
+                entries = self.levels.get(level, ())
+                position = self._cursor.get(level, 0)
+                if position < len(entries):
+                    entry = entries[position]
+                    self._cursor[level] = position + 1
+                    self._save_cursor()
+            # Counted under the lock too - generate is called from the maze pool's thread and the main thread
+            if entry is None:
+                self.fallbacks += 1
+            else:
+                self.served += 1
+        if entry is None:
+            return self._fallback(level, basename, seed)
+        temp = basename + ".maze.tmp"
+        shutil.copyfile(os.path.join(self._directory, entry["file"]), temp)
+        os.replace(temp, basename + ".maze")
+        return entry["seed"]
+
+    def _save_cursor(self):
+        # Remember which mazes have been handed out across restarts
+        path = os.path.join(self._directory, CURSOR_FILE)
+        try:
+            with open(path + ".tmp", "w") as f:
+                json.dump(self._cursor, f)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass
+
+
+def parse_levels(text):
+    # "0-6" or "1,3,5" to a list of levels
+    levels = []
+    for part in text.split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            levels.extend(range(int(first), int(last) + 1))
+        else:
+            levels.append(int(part))
+    return levels
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a curated Marble Maze pack across all cores")
+    parser.add_argument("--per-level", type=int, default=100, help="mazes generated per difficulty level")
+    parser.add_argument("--keep", type=int, default=20, help="best mazes kept per level")
+    parser.add_argument("--levels", default="0-{}".format(len(tdf_maze_generator.difficulty) - 1),
+                        help="difficulty levels, e.g. 0-6 or 2,4")
+    parser.add_argument("--score", choices=SCORES, default="solution_length", help="score the best mazes are picked by")
+    parser.add_argument("--algorithm", choices=sorted(maze_algorithms.ALGORITHMS),
+                        default=tdf_maze_generator.current_algorithm, help="maze generation algorithm")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, default one per core")
+    parser.add_argument("--seed", type=int, default=None, help="first seed, for a reproducible pack")
+    parser.add_argument("--output", default="maze_pack", help="pack folder to write")
+    args = parser.parse_args(argv)
+
+    levels = parse_levels(args.levels)
+    workers = args.workers or os.cpu_count() or 1
+    results, elapsed = generate_batch(levels, args.per_level, workers, args.seed, args.algorithm)
+    curated = curate(results, args.keep, args.score)
+    write_pack(args.output, curated, args.score, args.algorithm)
+
+    for level in levels:
+        scores = [r[3] for r in results if r[0] == level]
+        kept = [r[3] for r in curated.get(level, ())]
+        print("level {}: {:4d} mazes, solution {:6.1f} avg, dead ends {:6.1f} avg, branching {:.2f} avg, kept {} {:g}+".format(
+            level, len(scores), np.mean([s["solution_length"] for s in scores]),
+            np.mean([s["dead_ends"] for s in scores]), np.mean([s["branching"] for s in scores]),
+            args.score, round(min(s[args.score] for s in kept), 2) if kept else 0))
+    rate = len(results) / elapsed if elapsed else 0.0
+    print("{} mazes in {:.2f}s on {} worker(s): {:.1f} mazes/s, {:.1f} mazes/s per worker".format(
+        len(results), elapsed, workers, rate, rate / workers))
+    print("wrote {} mazes to {}".format(sum(len(chosen) for chosen in curated.values()), args.output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
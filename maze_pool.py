@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : maze_pool.py
+# Description : Background maze pre-generation so pressing 'Generate' never blocks the game loop.
+#               A worker thread keeps a small on-disk queue of ready mazes for each difficulty level
+#               (maze_pool/level<n>_<seq>.maze).  Taking a maze just renames the next ready file onto
+#               generated_maze.maze, and the worker then refills the queue in the background.
+############################################################################
+
+import os
+import threading
+from collections import deque
+
+import tdf_maze_generator
+
+
+class MazePool(object):
+    """On-disk queue of pre-generated mazes per difficulty level, refilled by a background thread."""
+
+    def __init__(self, directory="maze_pool", depth=2, generate=tdf_maze_generator.generate_maze_file,
+                 on_ready=None):
+        """Create the pool.
+        :param directory: Folder holding the ready mazes
+        :param depth: Number of ready mazes to keep per difficulty level (bounded queue depth)
+        :param generate: Function (level, basename) writing <basename>.maze for a level
+        :param on_ready: Function (level) called from the worker thread each time a maze is ready, and when
+                         the worker stops on an error so anyone waiting for a maze can try again
+        """
+        self._directory = directory
+        self._on_ready = on_ready
+        self._depth = max(1, depth)
+        self._generate = generate
+        self._levels = range(len(tdf_maze_generator.difficulty))
+        self._queues = dict((level, deque()) for level in self._levels)
+        self._condition = threading.Condition()
+        self._priority = tdf_maze_generator.get_difficulty()
+        self._sequence = 0
+        self._running = False
+        self._thread = None
+
+        # Stats
+        self.requests = 0     # number of take() calls
+        self.waits = 0        # number of take() calls that had to wait for a fresh maze
+        self.generated = 0    # number of mazes generated by the worker
+
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        # Re-use mazes left over from a previous run.  Maze files are renamed into place once complete, so
+        # anything else (part written files, old .bmp/.dat pairs) is removed
+        for filename in sorted(os.listdir(self._directory)):
+            name, ext = os.path.splitext(filename)
+            if not name.startswith("level"):
+                continue
+            path = os.path.join(self._directory, filename)
+            try:
+                level, sequence = (int(x) for x in name[len("level"):].split("_"))
+            except ValueError:
+                level = sequence = None
+            basename = os.path.join(self._directory, name)
+            if ext == ".maze" and level in self._queues and len(self._queues[level]) < self._depth:
+                self._queues[level].append(basename)
+                self._sequence = max(self._sequence, sequence + 1)
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _remove(basename):
+        for ext in (".maze", ".maze.tmp"):
+            try:
+                os.remove(basename + ext)
+            except OSError:
+                pass
+
+    def start(self):
+        """Start the background refill thread."""
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="maze-pool", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background refill thread, waiting for any maze in progress."""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def running(self):
+        """True while the background refill thread is running."""
+        with self._condition:
+            return self._running
+
+    def ready(self, level):
+        """Number of ready mazes queued for a difficulty level."""
+        with self._condition:
+            return len(self._queues[level])
+
+    def take(self, level, basename="generated_maze", block=True, retry=False):
+        """Move the next ready maze for a level onto <basename>.maze, returning True once it is in place.
+        If the queue for the level is empty the request is counted in 'waits' and either blocks until the
+        worker has made a maze or, if not block, returns False straight away - call again with retry once
+        on_ready reports the level, so the request isn't counted twice.  With the worker not running the
+        maze is generated in line instead.
+        """
+        with self._condition:
+            if not retry:
+                self.requests += 1
+            self._priority = level
+            queue = self._queues[level]
+            if not queue:
+                if not retry:
+                    self.waits += 1
+                if not self._running:
+                    # No worker to wait for, so generate in line
+                    self._condition.release()
+                    try:
+                        self._generate(level, basename)
+                    finally:
+                        self._condition.acquire()
+                    return True
+                self._condition.notify_all()
+                if not block:
+                    return False
+                while not queue and self._running:
+                    self._condition.wait()
+            ready = queue.popleft() if queue else None
+            # Wake the worker to refill the space just made
+            self._condition.notify_all()
+
+        if ready is None:  # pool stopped while waiting
+            self._generate(level, basename)
+            return True
+        # Renames are atomic within the same filesystem, so the maze is swapped in without copying
+        os.replace(ready + ".maze", basename + ".maze")
+        return True
+
+    def stats(self):
+        """Return pool statistics as a dictionary."""
+        with self._condition:
+            return {
+                "requests": self.requests,
+                "waits": self.waits,
+                "wait_ratio": float(self.waits) / self.requests if self.requests else 0.0,
+                "generated": self.generated,
+                "ready": dict((level, len(queue)) for level, queue in self._queues.items()),
+            }
+
+    def _next_level(self):
+        # Level most in need of a refill - the level last asked for comes first, then the emptiest queue
+        if len(self._queues[self._priority]) < self._depth:
+            return self._priority
+        level = min(self._levels, key=lambda x: len(self._queues[x]))
+        if len(self._queues[level]) < self._depth:
+            return level
+        return None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                level = self._next_level()
+                while self._running and level is None:
+                    self._condition.wait()
+                    level = self._next_level()
+                if not self._running:
+                    return
+                sequence = self._sequence
+                self._sequence += 1
+
+            basename = os.path.join(self._directory, "level{}_{}".format(level, sequence))
+            try:
+                self._generate(level, basename)
+            except Exception:
+                # Stop so take() falls back to generating in line rather than waiting for a dead worker
+                self._remove(basename)
+                with self._condition:
+                    self._running = False
+                    self._condition.notify_all()
+                if self._on_ready is not None:
+                    self._on_ready(self._priority)
+                raise
+
+            with self._condition:
+                self._queues[level].append(basename)
+                self.generated += 1
+                self._condition.notify_all()
+            if self._on_ready is not None:
+                self._on_ready(level)
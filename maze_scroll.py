@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : maze_scroll.py
+# Description : Large-maze mode - mazes many screens tall, with the view following the marble.
+#               The maze is kept as its cell grid packed 8 cells to a byte (a few bytes per row) and pixel
+#               rows are only expanded from it as they are sent to the display.  Collisions are checked
+#               against the cell grid too, so apart from the packed grid nothing grows with the maze height.
+#               The ST7789 frame memory has 320 lines, 80 more than the panel shows.  Maze pixel row y is
+#               kept in memory line y % 320 and the panel is moved over it with the hardware vertical scroll
+#               (VSCRDEF / VSCSAD), so scrolling sends a 2 byte command plus only the rows coming into view -
+#               never the whole screen.  Rows are sent ahead of the view in bands, into the spare lines.
+#               Generating a maze many screens tall takes a while, so TallMazeMaker makes the next one on a
+#               background thread (like maze_pool.py does for the normal mazes).
+############################################################################
+
+import threading
+
+import numpy as np
+
+import tdf_maze_generator
+from maze_algorithms import eller_rows
+from maze_file import WALL_RGB565
+from ST7789 import FRAME_MEMORY_LINES
+
+
+class TallMaze(object):
+    """A maze of any height, kept as its packed cell grid."""
+
+    def __init__(self, packed, width, thickness, start_y=5, edge_x=10, marble_size=3):
+        """Create the maze.
+        :param packed: uint8 array of cell rows packed 8 cells to a byte (np.packbits), 1 bits for walls
+        :param width: Width of the maze in cells
+        :param thickness: Size in pixels of each cell
+        :param start_y: Pixel row the marble starts on
+        :param edge_x: Pixel column the bottom edge of the maze is measured along
+        :param marble_size: Marble is marble_size x marble_size pixels, for fits()
+        """
+        self.packed = packed
+        self.height = len(packed)
+        self.width = width
+        self.thickness = thickness
+        # Width and height of the maze in pixels
+        self.bounds = (width * thickness, self.height * thickness)
+        self._before = marble_size // 2                   # marble footprint pixels before its centre
+        self._after = marble_size - 1 - self._before      # and after it
+        self.start = self._start(start_y)
+        self.bottom_edge = self._bottom_edge(edge_x)
+
+    def wall_rows(self, row0, row1):
+        """Cell rows row0 <= row < row1 as a bool array, True for a wall."""
+        return np.unpackbits(self.packed[row0:row1], axis=1, count=self.width).astype(bool)
+
+    def is_wall(self, row, col):
+        """True if cell row, col is a wall."""
+        return bool((self.packed[row, col >> 3] >> (7 - (col & 7))) & 1)
+
+    def fits(self, x, y):
+        """True if the marble centred on pixel x, y is inside the maze and touches no wall - the same answer
+        as the free-space map, but worked out from the (at most 2 x 2) cells under the marble.
+        """
+        t = self.thickness
+        x0, y0 = x - self._before, y - self._before
+        x1, y1 = x + self._after, y + self._after
+        if x0 < 0 or y0 < 0 or x1 >= self.bounds[0] or y1 >= self.bounds[1]:
+            return False
+        for row in range(y0 // t, y1 // t + 1):
+            for col in range(x0 // t, x1 // t + 1):
+                if self.is_wall(row, col):
+                    return False
+        return True
+
+    def rgb565_rows(self, y0, y1, size):
+        """Pixel rows y0 <= y < y1 of the maze as a size wide array of RGB565 values, red walls on black
+        (rows past the bottom of the maze are black).
+        """
+        t = self.thickness
+        rows = np.zeros((y1 - y0, size), dtype=np.uint16)
+        end = min(y1, self.bounds[1])
+        if end > y0:
+            row0 = y0 // t
+            walls = self.wall_rows(row0, (end - 1) // t + 1).repeat(t, axis=0)[y0 - row0 * t:end - row0 * t]
+            w = min(self.bounds[0], size)
+            rows[:end - y0, :w] = walls.repeat(t, axis=1)[:, :w] * np.uint16(WALL_RGB565)
+        return rows
+
+    def _start(self, y):
+        # Marble start - centred across the corridor the entrance leads into, on pixel row y
+        t = self.thickness
+        entrance = np.flatnonzero(~self.wall_rows(0, 1)[0])
+        if not len(entrance):
+            raise ValueError("maze has no entrance")
+        row = self.wall_rows(y // t, y // t + 1)[0]
+        col = int(entrance[0])
+        closed = np.flatnonzero(row[col:])
+        end = col + int(closed[0]) if len(closed) else self.width
+        return (col * t + end * t) // 2, y
+
+    def _bottom_edge(self, x):
+        # Lowest wall pixel row in pixel column x - the bottom border is normally the last row
+        t = self.thickness
+        col = min(x // t, self.width - 1)
+        for row in range(self.height - 1, -1, -1):
+            if self.is_wall(row, col):
+                return (row + 1) * t - 1
+        raise ValueError("maze has no bottom edge")
+
+
+def generate_tall_maze(screens, level, seed=None, size=240, **kwargs):
+    """Generate a maze 'screens' screens tall and one screen wide at a difficulty level, with Eller's
+    algorithm packing each row as it is made.  Returns (TallMaze, seed) - extra keyword arguments are
+    passed on to TallMaze.
+    """
+    if seed is None:
+        seed = tdf_maze_generator.new_seed()
+    thickness = tdf_maze_generator.difficulty[level]
+    width = int(size / thickness) - 1
+    height = screens * int(size / thickness) - 1
+    packed = np.empty((height, (width + 7) // 8), dtype=np.uint8)
+    for row, cells in enumerate(eller_rows(height, width, seed)):
+        packed[row] = np.packbits(cells == tdf_maze_generator.WALL)
+    return TallMaze(packed, width, thickness, **kwargs), seed
+
+
+class TallMazeMaker(object):
+    """Generates the next tall maze on a background thread, so starting a game never waits for Eller's."""
+
+    def __init__(self, screens, on_ready=None, **kwargs):
+        """Create the maker.
+        :param screens: Maze height in screens
+        :param on_ready: Function (level) called from the worker thread each time a maze is ready, and when
+                         the worker stops on an error so anyone waiting for a maze can try again
+        :param kwargs: Passed on to generate_tall_maze (size, and TallMaze's start_y, edge_x, marble_size)
+        """
+        self.screens = screens
+        self._on_ready = on_ready
+        self._kwargs = kwargs
+        self._condition = threading.Condition()
+        self._level = tdf_maze_generator.get_difficulty()  # level the next maze is made for
+        self._ready = None                                 # (level, TallMaze) once made
+        self._running = False
+        self._thread = None
+
+        # Stats
+        self.requests = 0     # number of take() calls
+        self.waits = 0        # number of take() calls with no maze ready
+        self.generated = 0    # number of mazes generated
+
+    def start(self):
+        """Start the background thread - it makes a maze for the current difficulty level straight away."""
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="tall-maze", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread, waiting for any maze in progress."""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def running(self):
+        """True while the background thread is running."""
+        with self._condition:
+            return self._running
+
+    def prepare(self, level):
+        """Have the next maze made for a level, returning True if it is ready now.  Otherwise on_ready reports
+        the level once it is.  With the worker not running the maze is generated in line instead.
+        """
+        with self._condition:
+            return self._want(level)
+
+    def take(self, level):
+        """Return the ready maze for a level, or None (and have one made) if it isn't ready yet."""
+        with self._condition:
+            self.requests += 1
+            if not self._want(level):
+                self.waits += 1
+                return None
+            maze = self._ready[1]
+            self._ready = None
+            # Wake the worker to make the next one
+            self._condition.notify_all()
+            return maze
+
+    def stats(self):
+        """Return maker statistics as a dictionary."""
+        with self._condition:
+            return {
+                "requests": self.requests,
+                "waits": self.waits,
+                "generated": self.generated,
+                "ready": self._ready[0] if self._ready is not None else None,
+            }
+
+    def _want(self, level):
+        # Called holding the condition - True if a maze for the level is ready
+        self._level = level
+        if self._ready is not None and self._ready[0] == level:
+            return True
+        if not self._running:
+            # No worker, so generate in line
+            self._condition.release()
+            try:
+                maze, _ = generate_tall_maze(self.screens, level, **self._kwargs)
+            finally:
+                self._condition.acquire()
+            self._ready = (level, maze)
+            self.generated += 1
+            return True
+        self._condition.notify_all()
+        return False
+
+    def _run(self):
+        while True:
+            with self._condition:
+                # Nothing to do while the ready maze is for the level wanted
+                while self._running and self._ready is not None and self._ready[0] == self._level:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                level = self._level
+
+            try:
+                maze, _ = generate_tall_maze(self.screens, level, **self._kwargs)
+            except Exception:
+                # Stop so the mazes are generated in line rather than waited for from a dead worker
+                with self._condition:
+                    self._running = False
+                    self._condition.notify_all()
+                if self._on_ready is not None:
+                    self._on_ready(self._level)
+                raise
+
+            with self._condition:
+                self._ready = (level, maze)
+                self.generated += 1
+                self._condition.notify_all()
+            if self._on_ready is not None:
+                self._on_ready(level)
+
+
+class MazeViewport(object):
+    """The part of a TallMaze on the display, moved with the ST7789 hardware scroll to follow the marble."""
+
+    def __init__(self, display, maze, size=240, band=40, margin=80):
+        """Create the viewport.
+        :param display: ST7789 display
+        :param maze: TallMaze shown
+        :param size: Panel width and height in pixels
+        :param band: Rows sent ahead of the view at a time, into the frame memory lines the panel isn't showing
+        :param margin: The view scrolls once the marble is nearer than this to its top or bottom
+        """
+        if size + band > FRAME_MEMORY_LINES:
+            raise ValueError("the view and a band of {} rows don't fit the frame memory".format(band))
+        self.display = display
+        self.maze = maze
+        self.size = size
+        self.band = band
+        self.margin = margin
+        self.rows = max(maze.bounds[1], size)  # pixel rows shown, at least a screenful
+        self.top = 0            # maze pixel row at the top of the panel
+        self._loaded = (0, 0)   # maze pixel rows lo <= y < hi held in frame memory
+
+        # Stats
+        self.scrolls = 0
+        self.rows_sent = 0
+
+    def start(self):
+        """Show the top of the maze."""
+        self.display.set_scroll_area()
+        self._loaded = (0, 0)
+        self.top = 0
+        self._load(0)
+        self.display.scroll_to(0)
+
+    def follow(self, y):
+        """Scroll so the marble at maze pixel row y stays at least margin rows inside the view."""
+        top = self.top
+        if y < top + self.margin:
+            top = y - self.margin
+        elif y >= top + self.size - self.margin:
+            top = y - self.size + self.margin + 1
+        top = max(0, min(top, self.rows - self.size))
+        if top != self.top:
+            self._load(top)
+            self.display.scroll_to(top % FRAME_MEMORY_LINES)
+            self.top = top
+            self.scrolls += 1
+
+    def blit_sprite(self, image, x, y):
+        """Draw a cached sprite with its top left corner at maze pixel x, y - the same call as the display's
+        blit_sprite, so the game draws the marble the same way in both modes.
+        """
+        _, color, payload = self.display.cache_sprite(image)
+        self.display.write_memory(color, x, y, payload)
+
+    def close(self):
+        """Put the display's scrolling back to normal."""
+        self.display.reset_scroll()
+
+    def _load(self, top):
+        # Make sure maze rows top <= y < top + size are in frame memory, sending a band more beyond them in
+        # the direction of travel.  The rows held stay contiguous and no more than the frame memory lines.
+        lo, hi = self._loaded
+        bottom = top + self.size
+        if hi <= lo or top > hi or bottom < lo:
+            lo = hi = top   # jumped clear of the rows held - start again from the view
+        if bottom > hi:
+            new_hi = min(self.rows, bottom + self.band)
+            self._send(hi, new_hi)
+            lo, hi = max(lo, new_hi - FRAME_MEMORY_LINES), new_hi
+        if top < lo:
+            new_lo = max(0, top - self.band)
+            self._send(new_lo, lo)
+            lo, hi = new_lo, min(hi, new_lo + FRAME_MEMORY_LINES)
+        self._loaded = (lo, hi)
+
+    def _send(self, y0, y1):
+        if y1 > y0:
+            self.display.write_memory(self.maze.rgb565_rows(y0, y1, self.size), 0, y0)
+            self.rows_sent += y1 - y0
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : maze_solver.py
+# Description : Solver for the logical cell grid of a maze.
+#               A breadth first search from the exit gives the distance to the exit from every open cell
+#               (the distance field), and the shortest path is found by walking downhill in it from the
+#               entrance.  A generated maze is a tree, so the frontier stays a handful of cells wide and a
+#               plain queue over a flat padded grid beats whole-array NumPy steps (one per distance).
+#               The path is stored in the maze file as 2 bit moves (see maze_file.py).
+############################################################################
+
+import numpy as np
+
+# Moves along the path, as stored in the maze file
+UP = 0
+RIGHT = 1
+DOWN = 2
+LEFT = 3
+MOVE_STEPS = ((-1, 0), (0, 1), (1, 0), (0, -1))   # (row, col) change for each move
+
+UNREACHABLE = -1
+
+
+def distance_field(walls, target):
+    """Return an int32 array of the number of steps from each cell to target (row, col), UNREACHABLE for
+    walls and cells cut off from it.
+    """
+    walls = np.asarray(walls, dtype=bool)
+    height, width = walls.shape
+    # Pad with a wall all round so the neighbours of the entrance and exit (on the edge) need no bounds checks
+    stride = width + 2
+    passable = np.zeros((height + 2, stride), dtype=np.uint8)
+    passable[1:-1, 1:-1] = ~walls
+    passable = bytearray(passable.tobytes())
+    distance = [UNREACHABLE] * len(passable)
+
+    start = (target[0] + 1) * stride + target[1] + 1
+    if not passable[start]:
+        raise ValueError("target cell {} is a wall".format(tuple(target)))
+    passable[start] = 0
+    distance[start] = 0
+    queue = [start]
+    append = queue.append
+    # The queue is only appended to while it is iterated, so each cell is visited once in order of distance.
+    # A cell is marked impassable as soon as it is queued, and the four neighbours are unrolled - this loop
+    # is the whole cost of solving.
+    for index in queue:
+        step = distance[index] + 1
+        neighbour = index - stride
+        if passable[neighbour]:
+            passable[neighbour] = 0
+            distance[neighbour] = step
+            append(neighbour)
+        neighbour = index + 1
+        if passable[neighbour]:
+            passable[neighbour] = 0
+            distance[neighbour] = step
+            append(neighbour)
+        neighbour = index + stride
+        if passable[neighbour]:
+            passable[neighbour] = 0
+            distance[neighbour] = step
+            append(neighbour)
+        neighbour = index - 1
+        if passable[neighbour]:
+            passable[neighbour] = 0
+            distance[neighbour] = step
+            append(neighbour)
+
+    return np.array(distance, dtype=np.int32).reshape(height + 2, stride)[1:-1, 1:-1]
+
+
+def shortest_path(distance, start):
+    """Return the shortest path from start (row, col) to the distance field's target as a list of (row, col)
+    cells including both ends, or None if the target can't be reached from start.
+    """
+    height, width = distance.shape
+    row, col = start
+    if distance[row, col] < 0:
+        return None
+    path = [(row, col)]
+    while distance[row, col] > 0:
+        downhill = distance[row, col] - 1
+        for dr, dc in MOVE_STEPS:
+            r, c = row + dr, col + dc
+            if 0 <= r < height and 0 <= c < width and distance[r, c] == downhill:
+                row, col = r, c
+                break
+        path.append((row, col))
+    return path
+
+
+def path_moves(path):
+    """Return a path of cells as a uint8 array of moves (UP, RIGHT, DOWN, LEFT)."""
+    cells = np.asarray(path, dtype=np.int32).reshape(-1, 2)
+    steps = np.diff(cells, axis=0)
+    moves = np.zeros(len(steps), dtype=np.uint8)
+    for move, (dr, dc) in enumerate(MOVE_STEPS):
+        moves[(steps[:, 0] == dr) & (steps[:, 1] == dc)] = move
+    return moves
+
+
+def path_from_moves(start, moves):
+    """Return the list of (row, col) cells visited following moves from start, including start."""
+    offsets = np.array(MOVE_STEPS, dtype=np.int32)[np.asarray(moves, dtype=np.intp)]
+    cells = np.vstack(([start], offsets)).cumsum(axis=0)
+    return [tuple(int(v) for v in cell) for cell in cells]
+
+
+class Solution(object):
+    """Distance field and shortest path from the entrance to the exit of a maze."""
+
+    def __init__(self, walls, entrance, exit, path=None):
+        """Solve the maze.
+        :param walls: Cell grid, True for a wall
+        :param entrance: (row, col) cell the path starts at
+        :param exit: (row, col) cell the path ends at
+        :param path: Known shortest path (e.g. from the maze file), found from the distance field if None
+        """
+        self.entrance = tuple(entrance)
+        self.exit = tuple(exit)
+        self.distance = distance_field(walls, exit)
+        self.path = path if path is not None else shortest_path(self.distance, entrance)
+
+    @property
+    def solvable(self):
+        """True if the exit can be reached from the entrance."""
+        return self.path is not None and self.path[0] == self.entrance and self.path[-1] == self.exit
+
+    @property
+    def length(self):
+        """Number of moves from the entrance to the exit, None if it can't be reached."""
+        return len(self.path) - 1 if self.path is not None else None
+
+    def moves(self):
+        """The path as a uint8 array of moves."""
+        return path_moves(self.path)
+
+
+def solve(walls, entrance, exit):
+    """Solve a maze, returning its Solution."""
+    return Solution(walls, entrance, exit)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : mpu6050.py
+# Description : MPU6050 gyro/accelerometer access for the Marble Maze.
+#               Reads use I2C block transfers (6 bytes for the accelerometer, 14 for everything) instead
+#               of two single byte reads per axis, and the sensor's FIFO collects accelerometer samples at
+#               the configured sample rate.  SensorSampler drains the FIFO on a background thread into a
+#               ring buffer of timestamped samples, which the game loop reads without blocking.
+############################################################################
+
+import threading
+import time
+from collections import deque
+
+#some MPU6050 Registers and their Address
+SMPLRT_DIV   = 0x19
+CONFIG       = 0x1A
+GYRO_CONFIG  = 0x1B
+FIFO_EN      = 0x23
+INT_ENABLE   = 0x38
+INT_STATUS   = 0x3A
+ACCEL_XOUT_H = 0x3B
+ACCEL_YOUT_H = 0x3D
+ACCEL_ZOUT_H = 0x3F
+GYRO_XOUT_H  = 0x43
+GYRO_YOUT_H  = 0x45
+GYRO_ZOUT_H  = 0x47
+USER_CTRL    = 0x6A
+PWR_MGMT_1   = 0x6B
+FIFO_COUNTH  = 0x72
+FIFO_R_W     = 0x74
+
+# Register bits
+ACCEL_FIFO_EN   = 0x08   # FIFO_EN - put accelerometer samples in the FIFO
+USER_FIFO_EN    = 0x40   # USER_CTRL - enable the FIFO
+USER_FIFO_RESET = 0x04   # USER_CTRL - empty the FIFO
+FIFO_OFLOW_INT  = 0x10   # INT_STATUS - FIFO has overflowed
+
+ACCEL_SCALE = 16384.0    # LSB per g at the default +/- 2g full scale range
+GYRO_SCALE = 131.0       # LSB per degree/s at +/- 250 degree/s
+SAMPLE_BYTES = 6         # accelerometer x, y, z in the FIFO
+FIFO_SIZE = 1024
+I2C_BLOCK_MAX = 32       # SMBus block reads are limited to 32 bytes
+
+
+def _signed(high, low):
+    # Accelero and Gyro value are 16-bit - concatenate higher and lower value and make it signed
+    value = (high << 8) | low
+    if value >= 32768:
+        value -= 65536
+    return value
+
+
+class MPU6050(object):
+    """MPU6050 on an SMBus, using block reads and the FIFO."""
+
+    def __init__(self, bus, address=0x68, sample_rate_div=7, use_fifo=True):
+        """Set up the sensor.
+        :param bus: smbus.SMBus (or compatible) the sensor is on
+        :param address: I2C address of the sensor
+        :param sample_rate_div: SMPLRT_DIV value - sample rate is 8kHz / (1 + sample_rate_div)
+        :param use_fifo: Collect accelerometer samples in the sensor's FIFO for read_fifo()
+        """
+        self._bus = bus
+        self._address = address
+        self.sample_rate_div = sample_rate_div
+        self.use_fifo = use_fifo
+        self.fifo_overflows = 0
+        self.init()
+
+    @property
+    def sample_rate(self):
+        """Samples per second for the current SMPLRT_DIV (the digital low pass filter is off, so 8kHz base)."""
+        return 8000.0 / (1 + self.sample_rate_div)
+
+    def init(self):
+        #write to sample rate register
+        self._bus.write_byte_data(self._address, SMPLRT_DIV, self.sample_rate_div)
+
+        #Write to power management register
+        self._bus.write_byte_data(self._address, PWR_MGMT_1, 1)
+
+        #Write to Configuration register
+        self._bus.write_byte_data(self._address, CONFIG, 0)
+
+        #Write to Gyro configuration register
+        self._bus.write_byte_data(self._address, GYRO_CONFIG, 24)
+
+        #Write to interrupt enable register
+        self._bus.write_byte_data(self._address, INT_ENABLE, 1)
+
+        if self.use_fifo:
+            # Only accelerometer samples go in the FIFO, emptied before starting
+            self._bus.write_byte_data(self._address, FIFO_EN, ACCEL_FIFO_EN)
+            self.reset_fifo()
+
+    def set_sample_rate_div(self, sample_rate_div):
+        """Change SMPLRT_DIV - sample rate is 8kHz / (1 + sample_rate_div)."""
+        self.sample_rate_div = sample_rate_div
+        self._bus.write_byte_data(self._address, SMPLRT_DIV, sample_rate_div)
+
+    def read_accel(self):
+        """Read the accelerometer with one 6 byte block read, returning (ax, ay, az) in g."""
+        raw = self._bus.read_i2c_block_data(self._address, ACCEL_XOUT_H, 6)
+        return (_signed(raw[0], raw[1]) / ACCEL_SCALE,
+                _signed(raw[2], raw[3]) / ACCEL_SCALE,
+                _signed(raw[4], raw[5]) / ACCEL_SCALE)
+
+    def read_all(self):
+        """Read accelerometer, temperature and gyro with one 14 byte block read.
+        Returns ((ax, ay, az) in g, temperature in degrees C, (gx, gy, gz) in degrees/s).
+        """
+        raw = self._bus.read_i2c_block_data(self._address, ACCEL_XOUT_H, 14)
+        values = [_signed(raw[i], raw[i + 1]) for i in range(0, 14, 2)]
+        accel = tuple(v / ACCEL_SCALE for v in values[0:3])
+        temperature = values[3] / 340.0 + 36.53
+        gyro = tuple(v / GYRO_SCALE for v in values[4:7])
+        return accel, temperature, gyro
+
+    def reset_fifo(self):
+        """Empty the FIFO and (re)enable it."""
+        self._bus.write_byte_data(self._address, USER_CTRL, USER_FIFO_RESET)
+        self._bus.write_byte_data(self._address, USER_CTRL, USER_FIFO_EN)
+
+    def fifo_count(self):
+        """Number of bytes waiting in the FIFO."""
+        high, low = self._bus.read_i2c_block_data(self._address, FIFO_COUNTH, 2)
+        return (high << 8) | low
+
+    def read_fifo(self):
+        """Read all complete accelerometer samples waiting in the FIFO, oldest first, as (ax, ay, az) in g.
+        If the FIFO has overflowed its contents are no longer sample aligned, so it is emptied and counted
+        in fifo_overflows.
+        """
+        if self._bus.read_byte_data(self._address, INT_STATUS) & FIFO_OFLOW_INT:
+            self.fifo_overflows += 1
+            self.reset_fifo()
+            return []
+        count = self.fifo_count() // SAMPLE_BYTES * SAMPLE_BYTES
+        chunk = I2C_BLOCK_MAX // SAMPLE_BYTES * SAMPLE_BYTES
+        samples = []
+        while count > 0:
+            size = min(chunk, count)
+            raw = self._bus.read_i2c_block_data(self._address, FIFO_R_W, size)
+            for i in range(0, size, SAMPLE_BYTES):
+                samples.append((_signed(raw[i], raw[i + 1]) / ACCEL_SCALE,
+                                _signed(raw[i + 2], raw[i + 3]) / ACCEL_SCALE,
+                                _signed(raw[i + 4], raw[i + 5]) / ACCEL_SCALE))
+            count -= size
+        return samples
+
+
+class SensorSampler(object):
+    """Background thread filling a ring buffer with timestamped (time, ax, ay, az) accelerometer samples."""
+
+    def __init__(self, sensor, buffer_size=256, poll_interval=None, clock=time.monotonic):
+        """Create the sampler.
+        :param sensor: MPU6050 to read
+        :param buffer_size: Samples held in the ring buffer - the oldest are dropped when it is full
+        :param poll_interval: Seconds between FIFO reads, defaults to about 4 samples worth
+        :param clock: Monotonic clock for the timestamps
+        """
+        self._sensor = sensor
+        # deque appends and pops are atomic, so the thread and the game loop share it without a lock
+        self._buffer = deque(maxlen=buffer_size)
+        self._poll_interval = poll_interval
+        self._clock = clock
+        self._running = False
+        self._thread = None
+
+        # Stats
+        self.samples = 0    # samples read from the sensor
+        self.dropped = 0    # samples lost because the ring buffer was full
+        self._started = None    # clock time of the last start, None while stopped
+        self._run_time = 0.0    # seconds sampled before that - the counts above cover every run
+
+    def start(self):
+        """Start sampling on a background thread."""
+        if self._running:
+            return
+        self._running = True
+        self._started = self._clock()
+        # Anything left from before a stop is stale, and the FIFO may have overflowed in the meantime
+        self._buffer.clear()
+        if self._sensor.use_fifo:
+            self._sensor.reset_fifo()
+        self._thread = threading.Thread(target=self._run, name="mpu6050-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread."""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._started is not None:
+            self._run_time += self._clock() - self._started
+            self._started = None
+
+    def latest(self):
+        """Newest sample as (time, ax, ay, az), left in the buffer, or None if there are none yet."""
+        try:
+            return self._buffer[-1]
+        except IndexError:
+            return None
+
+    def drain(self):
+        """Remove and return all buffered samples, oldest first."""
+        samples = []
+        popleft = self._buffer.popleft
+        try:
+            while True:
+                samples.append(popleft())
+        except IndexError:
+            return samples
+
+    def stats(self):
+        """Return the achieved sample rate (over the time spent sampling) and dropped sample counts as a dictionary."""
+        elapsed = self._run_time + (self._clock() - self._started if self._started is not None else 0.0)
+        return {
+            "sample_rate": self.samples / elapsed if elapsed > 0 else 0.0,
+            "configured_rate": self._sensor.sample_rate,
+            "samples": self.samples,
+            "dropped": self.dropped,
+            "fifo_overflows": getattr(self._sensor, "fifo_overflows", 0),
+        }
+
+    def _add(self, timestamp, accel):
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append((timestamp, accel[0], accel[1], accel[2]))
+        self.samples += 1
+
+    def _run(self):
+        period = 1.0 / self._sensor.sample_rate
+        if self._poll_interval is not None:
+            interval = self._poll_interval
+        else:
+            interval = 4 * period if self._sensor.use_fifo else period
+        next_poll = self._clock()
+        while self._running:
+            if self._sensor.use_fifo:
+                batch = self._sensor.read_fifo()
+                now = self._clock()
+                # Samples came in at the sample rate, the newest just now
+                for i, accel in enumerate(batch):
+                    self._add(now - (len(batch) - 1 - i) * period, accel)
+            else:
+                accel = self._sensor.read_accel()
+                self._add(self._clock(), accel)
+            next_poll += interval
+            delay = next_poll - self._clock()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_poll = self._clock()  # running late, don't try to catch up
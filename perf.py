@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : perf.py
+# Description : Hot path instrumentation for the Marble Maze.
+#               The Profiler times chosen functions by swapping them for timing wrappers when it is enabled,
+#               and putting the originals back when it is disabled - so while it is off the game runs exactly
+#               the code it would without it.  Counters read running totals the game already keeps (SPI
+#               bytes, loop iterations) and are turned into rates between two looks.
+#               Two ways of viewing the numbers:
+#                 PerfOverlay  - a small panel in a corner of the ST7789, sent as its own window
+#                 PerfReporter - a JSON line of stats every few seconds to stdout or a file, for soak tests
+############################################################################
+
+import json
+import sys
+import threading
+import time
+
+from PIL import Image, ImageDraw
+
+
+class Profiler(object):
+    """Per-stage call timers and counters."""
+
+    def __init__(self, clock=time.perf_counter):
+        """Create the profiler, disabled.
+        :param clock: High resolution clock the stages are timed with
+        """
+        self._clock = clock
+        self._lock = threading.Lock()   # stages are timed on the sampler, pipeline and main threads
+        self._stages = {}               # stage -> [calls, total seconds, longest call]
+        self._counters = {}             # counter -> function returning its running total
+        self._instrumented = []         # (owner, attribute, stage) to wrap when enabled
+        self._originals = []            # (owner, attribute, original, was set on the owner) while enabled
+        self.enabled = False
+
+    def instrument(self, owner, name, stage):
+        """Time calls of owner.name (a function on a module, class or instance) as 'stage' while enabled."""
+        self._instrumented.append((owner, name, stage))
+        self._stages.setdefault(stage, [0, 0.0, 0.0])
+        if self.enabled:
+            self._wrap(owner, name, stage)
+
+    def counter(self, name, read):
+        """Report the running total returned by read() and its rate."""
+        self._counters[name] = read
+
+    def enable(self):
+        """Start timing the instrumented functions."""
+        if not self.enabled:
+            self.enabled = True
+            for owner, name, stage in self._instrumented:
+                self._wrap(owner, name, stage)
+
+    def disable(self):
+        """Stop timing - the original functions are put back."""
+        if self.enabled:
+            self.enabled = False
+            for owner, name, original, own in reversed(self._originals):
+                if own:
+                    setattr(owner, name, original)
+                else:
+                    delattr(owner, name)   # it came from the class, so just uncover it again
+            self._originals = []
+
+    def totals(self):
+        """Running totals - {"time": clock, "stages": {stage: (calls, seconds, longest)}, "counters": {name: total}}."""
+        with self._lock:
+            stages = dict((stage, tuple(values)) for stage, values in self._stages.items())
+        return {
+            "time": self._clock(),
+            "stages": stages,
+            "counters": dict((name, read()) for name, read in self._counters.items()),
+        }
+
+    def _wrap(self, owner, name, stage):
+        # Swap owner.name for a wrapper timing each call into the stage.  On a class the wrapper is a plain
+        # function, so it binds to instances like the method it covers.
+        original = getattr(owner, name)
+        own = name in vars(owner)
+        values = self._stages[stage]
+        clock = self._clock
+        lock = self._lock
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                with lock:
+                    values[0] += 1
+                    values[1] += elapsed
+                    if elapsed > values[2]:
+                        values[2] = elapsed
+
+        self._originals.append((owner, name, vars(owner)[name] if own else None, own))
+        setattr(owner, name, timed)
+
+
+def interval_stats(before, after):
+    """Stats between two Profiler.totals() - per stage the calls, mean and total time (and the longest call
+    so far), per counter the total and its rate per second.  A counter that went down (restarted) counts
+    from zero.
+    """
+    elapsed = after["time"] - before["time"]
+    stats = {"seconds": elapsed, "stages": {}, "counters": {}}
+    for stage, (calls, total, longest) in after["stages"].items():
+        calls0, total0, _ = before["stages"].get(stage, (0, 0.0, 0.0))
+        count, seconds = calls - calls0, total - total0
+        stats["stages"][stage] = {
+            "calls": count,
+            "ms": seconds * 1000.0,
+            "mean_us": seconds / count * 1e6 if count else 0.0,
+            "longest_us": longest * 1e6,
+        }
+    for name, total in after["counters"].items():
+        change = total - before["counters"].get(name, 0)
+        if change < 0:
+            change = total
+        stats["counters"][name] = {"total": total, "per_second": change / elapsed if elapsed > 0 else 0.0}
+    return stats
+
+
+class PerfOverlay(object):
+    """A few lines of profiler stats in a corner of the ST7789.  Only the overlay's own window is sent, and
+    no more often than every interval seconds.  Must be updated from the thread that draws on the display.
+    """
+
+    def __init__(self, profiler, display, font, lines, size=(96, 36), corner="top right", interval=0.5,
+                 colours=((255, 255, 0), (0, 0, 0)), clock=time.monotonic):
+        """Create the overlay.
+        :param profiler: Profiler the stats come from
+        :param display: ST7789 drawn on
+        :param font: PIL font for the text
+        :param lines: Function (interval_stats dictionary) returning the lines of text to show
+        :param size: Overlay (width, height) in pixels
+        :param corner: 'top left', 'top right', 'bottom left' or 'bottom right'
+        :param interval: Least seconds between updates
+        :param colours: (text, background) colours
+        """
+        self._profiler = profiler
+        self._display = display
+        self._font = font
+        self._lines = lines
+        self._interval = interval
+        self._colours = colours
+        self._clock = clock
+        width, height = size
+        vertical, horizontal = corner.split()
+        self.x = 0 if horizontal == "left" else display.width - width
+        self.y = 0 if vertical == "top" else display.height - height
+        self.size = size
+        self._before = profiler.totals()
+        self._last = clock()
+        self.updates = 0
+
+    def update(self, force=False):
+        """Redraw the overlay if interval seconds have passed since the last time (or if force).
+        Returns True if it was drawn.
+        """
+        now = self._clock()
+        if not force and now - self._last < self._interval:
+            return False
+        self._last = now
+        after = self._profiler.totals()
+        stats = interval_stats(self._before, after)
+        self._before = after
+
+        image = Image.new("RGB", self.size, self._colours[1])
+        ImageDraw.Draw(image).multiline_text((2, 1), "\n".join(self._lines(stats)), font=self._font,
+                                             fill=self._colours[0], spacing=1)
+        self._display.display(image, self.x, self.y, self.x + self.size[0] - 1, self.y + self.size[1] - 1)
+        self.updates += 1
+        return True
+
+
+class PerfReporter(object):
+    """Background thread writing the profiler's stats for each interval as a JSON line."""
+
+    def __init__(self, profiler, interval=10.0, path=None, extra=None):
+        """Create the reporter.
+        :param profiler: Profiler the stats come from
+        :param interval: Seconds between reports
+        :param path: File the lines are appended to, stdout if None
+        :param extra: Function returning a dictionary of more stats to add to each line, or None
+        """
+        self._profiler = profiler
+        self._interval = interval
+        self._path = path
+        self._extra = extra
+        self._stop = threading.Event()
+        self._thread = None
+        self._before = profiler.totals()
+        self.reports = 0
+
+    def start(self):
+        """Start reporting every interval seconds."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="perf-reporter", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the thread, writing a last report."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.report()
+
+    def report(self):
+        """Write the stats since the last report now."""
+        after = self._profiler.totals()
+        stats = interval_stats(self._before, after)
+        self._before = after
+        stats["timestamp"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        if self._extra is not None:
+            stats.update(self._extra())
+        line = json.dumps(stats, sort_keys=True) + "\n"
+        if self._path is None:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+        else:
+            with open(self._path, "a") as f:
+                f.write(line)
+        self.reports += 1
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self.report()
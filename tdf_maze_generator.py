@@ -1,14 +1,14 @@
 #!/usr/bin/env python3
 #############################################################################
 # Maze generator -- Randomized Prim Algorithm by Orestis Zekai - Fun With Python #1: Maze Generator
-#                   Modified generated maze to create a scaled BMP files for a maze image
+#                   Modified generated maze to save a compact maze file, scaled for display when loaded
 ########################################################################
 
 ## Imports
 import random
 import time
 import numpy as np
-from PIL import Image
+from maze_file import write_maze
 from colorama import init
 from colorama import Fore, Back, Style
 
@@ -16,58 +16,28 @@ from colorama import Fore, Back, Style
 def printMaze(maze):
 	for i in range(0, height):
 		for j in range(0, width):
-			if (maze[i][j] == 'u'):
-				print(Fore.WHITE + str(maze[i][j]), end=" ")
-			elif (maze[i][j] == 'c'):
-				print(Fore.GREEN + str(maze[i][j]), end=" ")
+			if (maze[i][j] == UNVISITED):
+				print(Fore.WHITE + 'u', end=" ")
+			elif (maze[i][j] == CELL):
+				print(Fore.GREEN + 'c', end=" ")
 			else:
-				print(Fore.RED + str(maze[i][j]), end=" ")
+				print(Fore.RED + 'w', end=" ")
 			
 		print('\n')
 
-def transcribemazefordisplay(maze):
-	# This routine scales the basic maze created by thickening the walls and corridors to create a larger array that fits in the 240*240 pixel screen
-    # Initialise the screen numpy array to be 'n' times the maze array created to allow for the extra thickness of the walls and corridors
-    # Note that the *3 is because there are 3 bytes for the RGB values.
-    numpy_maze = np.zeros([height*wall_corridor_thickness, width*wall_corridor_thickness, 3], dtype=np.uint8)
-    # Only 1 byte per entry for the data array
-    numpy_maze_data = np.zeros([height*wall_corridor_thickness, width*wall_corridor_thickness, 1], dtype=np.uint8)
-
-    for i in range(0, height):
-        for j in range(0, width):
-            if (maze[i][j] == 'u'):
-                pass # assume wont have any of these
-            elif (maze[i][j] == 'c'):
-                pass # defaut is black for corridors so no action needed
-            else:  # process for walls (w)
-                # set start point into the new nxn display block
-                width_start = j * wall_corridor_thickness
-                height_start = i * wall_corridor_thickness
-                # iterate new 'n'x'n' wall and corridor block size
-                for k in range(0,wall_corridor_thickness):
-                    for l in range(0,wall_corridor_thickness):
-                        numpy_maze[height_start+k,width_start+l] = [255,0,0]
-                        numpy_maze_data[height_start+k,width_start+l] = 1
-                        # print (i, j, k, l)
-    img = Image.fromarray(numpy_maze)
-    img.save('generated_maze.bmp') # Save as a bmp to avoid compression artefacts in jpegs, even at 100% quality
-    numpy_maze_data.tofile("generated_maze.dat")
+def maze_walls(maze):
+    # Boolean grid of the wall blocks - anything not a corridor is wall
+    return (maze != UNVISITED) & (maze != CELL)
 
+def save_maze_file(maze, thickness, basename="generated_maze", seed=None):
+    # Write the maze as <basename>.maze - the header (with the seed, if known) and the bit-packed cell grid.
+    # The scaled image and collision data are worked out from it when the maze is loaded (see maze_file.py)
+    write_maze(basename + ".maze", maze_walls(maze), thickness, seed)
 
-# Find number of surrounding cells
-def surroundingCells(rand_wall):
-    global maze
-    s_cells = 0
-    if (maze[rand_wall[0]-1][rand_wall[1]] == 'c'):
-        s_cells += 1
-    if (maze[rand_wall[0]+1][rand_wall[1]] == 'c'):
-        s_cells += 1
-    if (maze[rand_wall[0]][rand_wall[1]-1] == 'c'):
-        s_cells +=1
-    if (maze[rand_wall[0]][rand_wall[1]+1] == 'c'):
-        s_cells += 1
+def transcribemazefordisplay(maze):
+    # This routine saves the basic maze created, with the scale to fit the 240*240 pixel screen
+    save_maze_file(maze, wall_corridor_thickness, seed=seed)
 
-    return s_cells
 
 def get_difficulty():
     return current_difficulty
@@ -83,13 +53,120 @@ def set_difficulty(diff):
 # variable used to control difficulty of mazes generated by how many pixels thick / wide (will be 'n' x 'n' block) - based on 3x3 marble
 difficulty = (15, 12, 11, 9, 7, 5, 3) # Note that 15 is the easiest at blocks of 15x15, ie index of 0
 current_difficulty = 3  # default to nominal difficulty
+seed = None  # seed of the last maze from generate_new_maze
+current_algorithm = "prim"  # generation algorithm, one of maze_algorithms.ALGORITHMS
+
+# Cell states held in the int8 maze grid
+UNVISITED = 0
+CELL = 1
+WALL = 2
+
+def new_seed():
+    # A fresh random seed for a maze - 32 bits, so it is short enough to write down and share
+    return random.SystemRandom().getrandbits(32)
+
+def carve_maze(height, width, seed=None):
+    # Randomized Prim generation engine.  Uses its own random.Random(seed) rather than the random module's
+    # shared state, so the same seed and size always carve the same maze (a new seed is picked if None).  Works on a flat bytearray (index = row * width + col) which is
+    # shared with the NumPy int8 grid returned, so there is no copy at the end.
+    # The frontier is an array of wall indexes with swap-remove, plus a 'slot' table giving the position of
+    # each wall in the array, so picking, membership tests and deletes are all O(1) rather than list scans.
+    # Only interior blocks are ever carved, which keeps the outside walls of the maze contiguous.
+    size = height * width
+    grid = bytearray(size)  # all UNVISITED
+    interior = bytearray(size)
+    for i in range(1, height - 1):
+        interior[i * width + 1:(i + 1) * width - 1] = b'\x01' * (width - 2)
+
+    frontier = []
+    slot = [-1] * size
+    rand = random.Random(new_seed() if seed is None else seed).random
+
+    def add_wall(idx):
+        if grid[idx] != CELL:
+            grid[idx] = WALL
+            if interior[idx] and slot[idx] < 0:
+                slot[idx] = len(frontier)
+                frontier.append(idx)
 
-wall = 'w'
-cell = 'c'
-unvisited = 'u'
+    # Randomize starting point and set it a cell
+    starting_height = min(max(int(rand() * height), 1), height - 2)
+    starting_width = min(max(int(rand() * width), 1), width - 2)
+    start = starting_height * width + starting_width
+
+    # Mark it as cell and add surrounding walls to the frontier
+    grid[start] = CELL
+    for neighbour in (start - width, start - 1, start + 1, start + width):
+        add_wall(neighbour)
+
+    while frontier:
+        # Pick a random wall and delete it from the frontier (swap the last entry into its slot)
+        i = int(rand() * len(frontier))
+        idx = frontier[i]
+        last = frontier.pop()
+        if last != idx:
+            frontier[i] = last
+            slot[last] = i
+        slot[idx] = -1
+
+        up = grid[idx - width]
+        down = grid[idx + width]
+        left = grid[idx - 1]
+        right = grid[idx + 1]
+
+        # The wall becomes a path if it separates an unvisited block from a cell, either horizontally or
+        # vertically, and would not join onto more than one existing cell
+        if ((left == UNVISITED and right == CELL) or (up == UNVISITED and down == CELL) or
+                (down == UNVISITED and up == CELL) or (right == UNVISITED and left == CELL)):
+            if (up == CELL) + (down == CELL) + (left == CELL) + (right == CELL) < 2:
+                # Denote the new path and mark the new walls around it
+                grid[idx] = CELL
+                add_wall(idx - width)
+                add_wall(idx + width)
+                add_wall(idx - 1)
+                add_wall(idx + 1)
+
+    maze = np.frombuffer(grid, dtype=np.int8).reshape(height, width)
 
-def generate_new_maze():
-    global maze, height, width, wall_corridor_thickness
+    # Mark the remaining unvisited cells as walls
+    maze[maze == UNVISITED] = WALL
+
+    # Set entrance and exit - first cell along the top row and last cell along the bottom row
+    return open_doors(maze)
+
+def open_doors(maze):
+    # Open the entrance from the top edge down to the first cell of the first row holding cells, and the exit
+    # from the last cell of the last row holding cells down to the bottom edge.  The rows next to the border
+    # normally hold cells, but can be all wall (e.g. a lattice maze with an even number of rows).
+    height = maze.shape[0]
+    rows = np.flatnonzero((maze[1:height - 1, 1:] == CELL).any(axis=1)) + 1
+    if len(rows):
+        top, bottom = rows[0], rows[-1]
+        col = np.flatnonzero(maze[top] == CELL)[0]
+        maze[:top, col] = CELL
+        col = np.flatnonzero(maze[bottom, 1:] == CELL)[-1] + 1
+        maze[bottom + 1:, col] = CELL
+    return maze
+
+def generate_maze(level, seed=None, algorithm=None):
+    # Generate the maze for a difficulty level and seed (a new seed if None) with one of the algorithms in
+    # maze_algorithms.py (current_algorithm if None) - returns (maze, seed)
+    import maze_algorithms  # imported here as it builds on this module
+    if seed is None:
+        seed = new_seed()
+    maze_size = (int(240 / difficulty[level])) - 1
+    return maze_algorithms.carve(algorithm or current_algorithm, maze_size, maze_size, seed), seed
+
+def generate_maze_file(level, basename, seed=None):
+    # Generate a maze for a difficulty level straight to <basename>.maze without touching the module
+    # globals, so it is safe to call from a background thread (see maze_pool.py).  Returns the seed used.
+    maze, seed = generate_maze(level, seed)
+    save_maze_file(maze, difficulty[level], basename, seed)
+    return seed
+
+def generate_new_maze(maze_seed=None):
+    # Generate a maze at the current difficulty, from maze_seed if given - returns the seed used
+    global maze, height, width, wall_corridor_thickness, seed
     # Initialize colorama
     init()
 
@@ -100,222 +177,16 @@ def generate_new_maze():
     height = maze_size
     width = maze_size
 
-    maze = []  # Reset maze for next run
-
-    # Denote all cells as unvisited
-    for i in range(0, height):
-        line = []
-        for j in range(0, width):
-            line.append(unvisited)
-        maze.append(line)
-
-    # Randomize starting point and set it a cell
-    starting_height = int(random.random()*height)
-    starting_width = int(random.random()*width)
-    if (starting_height == 0):
-        starting_height += 1
-    if (starting_height == height-1):
-        starting_height -= 1
-    if (starting_width == 0):
-        starting_width += 1
-    if (starting_width == width-1):
-        starting_width -= 1
-
-    # Mark it as cell and add surrounding walls to the list
-    maze[starting_height][starting_width] = cell
-    walls = []
-    walls.append([starting_height - 1, starting_width])
-    walls.append([starting_height, starting_width - 1])
-    walls.append([starting_height, starting_width + 1])
-    walls.append([starting_height + 1, starting_width])
-
-    # Denote walls in maze
-    maze[starting_height-1][starting_width] = 'w'
-    maze[starting_height][starting_width - 1] = 'w'
-    maze[starting_height][starting_width + 1] = 'w'
-    maze[starting_height + 1][starting_width] = 'w'
-
-    while (walls):
-        # Pick a random wall
-        rand_wall = walls[int(random.random()*len(walls))-1]
-
-        # Check if it is a left wall
-        if (rand_wall[1] != 0):
-            if (maze[rand_wall[0]][rand_wall[1]-1] == 'u' and maze[rand_wall[0]][rand_wall[1]+1] == 'c'):
-                # Find the number of surrounding cells
-                s_cells = surroundingCells(rand_wall)
-
-                if (s_cells < 2):
-                    # Denote the new path
-                    maze[rand_wall[0]][rand_wall[1]] = 'c'
-
-                    # Mark the new walls
-                    # Upper cell
-                    if (rand_wall[0] != 0):
-                        if (maze[rand_wall[0]-1][rand_wall[1]] != 'c'):
-                            maze[rand_wall[0]-1][rand_wall[1]] = 'w'
-                        if ([rand_wall[0]-1, rand_wall[1]] not in walls):
-                            walls.append([rand_wall[0]-1, rand_wall[1]])
-
-
-                    # Bottom cell
-                    if (rand_wall[0] != height-1):
-                        if (maze[rand_wall[0]+1][rand_wall[1]] != 'c'):
-                            maze[rand_wall[0]+1][rand_wall[1]] = 'w'
-                        if ([rand_wall[0]+1, rand_wall[1]] not in walls):
-                            walls.append([rand_wall[0]+1, rand_wall[1]])
-
-                    # Leftmost cell
-                    if (rand_wall[1] != 0):	
-                        if (maze[rand_wall[0]][rand_wall[1]-1] != 'c'):
-                            maze[rand_wall[0]][rand_wall[1]-1] = 'w'
-                        if ([rand_wall[0], rand_wall[1]-1] not in walls):
-                            walls.append([rand_wall[0], rand_wall[1]-1])
-                
-
-                # Delete wall
-                for wall in walls:
-                    if (wall[0] == rand_wall[0] and wall[1] == rand_wall[1]):
-                        walls.remove(wall)
-
-                continue
-
-        # Check if it is an upper wall
-        if (rand_wall[0] != 0):
-            if (maze[rand_wall[0]-1][rand_wall[1]] == 'u' and maze[rand_wall[0]+1][rand_wall[1]] == 'c'):
-
-                s_cells = surroundingCells(rand_wall)
-                if (s_cells < 2):
-                    # Denote the new path
-                    maze[rand_wall[0]][rand_wall[1]] = 'c'
-
-                    # Mark the new walls
-                    # Upper cell
-                    if (rand_wall[0] != 0):
-                        if (maze[rand_wall[0]-1][rand_wall[1]] != 'c'):
-                            maze[rand_wall[0]-1][rand_wall[1]] = 'w'
-                        if ([rand_wall[0]-1, rand_wall[1]] not in walls):
-                            walls.append([rand_wall[0]-1, rand_wall[1]])
-
-                    # Leftmost cell
-                    if (rand_wall[1] != 0):
-                        if (maze[rand_wall[0]][rand_wall[1]-1] != 'c'):
-                            maze[rand_wall[0]][rand_wall[1]-1] = 'w'
-                        if ([rand_wall[0], rand_wall[1]-1] not in walls):
-                            walls.append([rand_wall[0], rand_wall[1]-1])
-
-                    # Rightmost cell
-                    if (rand_wall[1] != width-1):
-                        if (maze[rand_wall[0]][rand_wall[1]+1] != 'c'):
-                            maze[rand_wall[0]][rand_wall[1]+1] = 'w'
-                        if ([rand_wall[0], rand_wall[1]+1] not in walls):
-                            walls.append([rand_wall[0], rand_wall[1]+1])
-
-                # Delete wall
-                for wall in walls:
-                    if (wall[0] == rand_wall[0] and wall[1] == rand_wall[1]):
-                        walls.remove(wall)
-
-                continue
-
-        # Check the bottom wall
-        if (rand_wall[0] != height-1):
-            if (maze[rand_wall[0]+1][rand_wall[1]] == 'u' and maze[rand_wall[0]-1][rand_wall[1]] == 'c'):
-
-                s_cells = surroundingCells(rand_wall)
-                if (s_cells < 2):
-                    # Denote the new path
-                    maze[rand_wall[0]][rand_wall[1]] = 'c'
-
-                    # Mark the new walls
-                    if (rand_wall[0] != height-1):
-                        if (maze[rand_wall[0]+1][rand_wall[1]] != 'c'):
-                            maze[rand_wall[0]+1][rand_wall[1]] = 'w'
-                        if ([rand_wall[0]+1, rand_wall[1]] not in walls):
-                            walls.append([rand_wall[0]+1, rand_wall[1]])
-                    if (rand_wall[1] != 0):
-                        if (maze[rand_wall[0]][rand_wall[1]-1] != 'c'):
-                            maze[rand_wall[0]][rand_wall[1]-1] = 'w'
-                        if ([rand_wall[0], rand_wall[1]-1] not in walls):
-                            walls.append([rand_wall[0], rand_wall[1]-1])
-                    if (rand_wall[1] != width-1):
-                        if (maze[rand_wall[0]][rand_wall[1]+1] != 'c'):
-                            maze[rand_wall[0]][rand_wall[1]+1] = 'w'
-                        if ([rand_wall[0], rand_wall[1]+1] not in walls):
-                            walls.append([rand_wall[0], rand_wall[1]+1])
-
-                # Delete wall
-                for wall in walls:
-                    if (wall[0] == rand_wall[0] and wall[1] == rand_wall[1]):
-                        walls.remove(wall)
-
-
-                continue
-
-        # Check the right wall
-        if (rand_wall[1] != width-1):
-            if (maze[rand_wall[0]][rand_wall[1]+1] == 'u' and maze[rand_wall[0]][rand_wall[1]-1] == 'c'):
-
-                s_cells = surroundingCells(rand_wall)
-                if (s_cells < 2):
-                    # Denote the new path
-                    maze[rand_wall[0]][rand_wall[1]] = 'c'
-
-                    # Mark the new walls
-                    if (rand_wall[1] != width-1):
-                        if (maze[rand_wall[0]][rand_wall[1]+1] != 'c'):
-                            maze[rand_wall[0]][rand_wall[1]+1] = 'w'
-                        if ([rand_wall[0], rand_wall[1]+1] not in walls):
-                            walls.append([rand_wall[0], rand_wall[1]+1])
-                    if (rand_wall[0] != height-1):
-                        if (maze[rand_wall[0]+1][rand_wall[1]] != 'c'):
-                            maze[rand_wall[0]+1][rand_wall[1]] = 'w'
-                        if ([rand_wall[0]+1, rand_wall[1]] not in walls):
-                            walls.append([rand_wall[0]+1, rand_wall[1]])
-                    if (rand_wall[0] != 0):	
-                        if (maze[rand_wall[0]-1][rand_wall[1]] != 'c'):
-                            maze[rand_wall[0]-1][rand_wall[1]] = 'w'
-                        if ([rand_wall[0]-1, rand_wall[1]] not in walls):
-                            walls.append([rand_wall[0]-1, rand_wall[1]])
-
-                # Delete wall
-                for wall in walls:
-                    if (wall[0] == rand_wall[0] and wall[1] == rand_wall[1]):
-                        walls.remove(wall)
-
-                continue
-
-        # Delete the wall from the list anyway
-        for wall in walls:
-            if (wall[0] == rand_wall[0] and wall[1] == rand_wall[1]):
-                walls.remove(wall)
-        
-
-
-    # Mark the remaining unvisited cells as walls
-    for i in range(0, height):
-        for j in range(0, width):
-            if (maze[i][j] == 'u'):
-                maze[i][j] = 'w'
-
-    # Set entrance and exit
-    for i in range(0, width):
-        if (maze[1][i] == 'c'):
-            maze[0][i] = 'c'
-            break
-
-    for i in range(width-1, 0, -1):
-        if (maze[height-2][i] == 'c'):
-            maze[height-1][i] = 'c'
-            break
+    maze, seed = generate_maze(current_difficulty, maze_seed)
 
     # Print final maze
     #printMaze(maze)
     #print("Maze Generated")
     #print(height, width)
 
-    # Transcribe the maze into a scaled bmp image
+    # Save the maze for display
     transcribemazefordisplay(maze)
+    return seed
 
 #used during testing
 #generate_new_maze()
@@ -0,0 +1,5 @@
+# The game's modules live at the top of the repository rather than in a package - make them importable
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : test_frame_pacer.py
+# Description : FramePacer on a fake clock - late ticks don't drift off the original grid of deadlines,
+#               overruns skip the missed ticks, and the achieved rate is kept when the pacer stops.
+############################################################################
+
+import pytest
+
+from frame_pacer import FramePacer
+
+RATE = 64
+PERIOD = 1.0 / RATE   # exact in binary, so the deadlines add up without rounding
+
+
+class FakeClock(object):
+    def __init__(self, now=10.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def pacer(clock):
+    pacer = FramePacer(RATE, clock=clock)
+    pacer.start()
+    return pacer
+
+
+def test_first_tick_due_one_period_after_start(clock, pacer):
+    assert pacer.remaining() == pytest.approx(PERIOD)
+    assert not pacer.due()
+    clock.now += PERIOD
+    assert pacer.remaining() == 0.0
+    assert pacer.due()
+
+
+def test_late_ticks_stay_on_the_grid(clock, pacer):
+    # Every tick runs 0.3 of a period late - the deadlines stay on start + n periods, they don't drift by
+    # the lateness of each tick
+    start = clock.now
+    for n in range(1, 101):
+        clock.now = start + (n + 0.3) * PERIOD
+        assert pacer.tick() == pytest.approx(0.3 * PERIOD)
+        assert pacer._next == pytest.approx(start + (n + 1) * PERIOD)
+    assert pacer.ticks == 100
+    assert pacer.overruns == 0 and pacer.skipped == 0
+    assert pacer.stats()["jitter_max"] == pytest.approx(0.3 * PERIOD * 1000.0)
+
+
+def test_overrun_skips_the_missed_ticks(clock, pacer):
+    start = clock.now
+    # The first tick runs 2.5 periods late - the ticks due at 2 and 3 periods are missed
+    clock.now = start + 3.5 * PERIOD
+    assert pacer.tick() == pytest.approx(2.5 * PERIOD)
+    assert pacer.ticks == 1
+    assert pacer.overruns == 1
+    assert pacer.skipped == 2
+    # The next deadline is back on the grid, not a period after the late tick
+    assert pacer._next == pytest.approx(start + 4 * PERIOD)
+    clock.now = start + 4 * PERIOD
+    pacer.tick()
+    assert pacer.overruns == 1 and pacer.skipped == 2
+    assert pacer._next == pytest.approx(start + 5 * PERIOD)
+
+
+def test_exactly_one_period_late_is_an_overrun(clock, pacer):
+    start = clock.now
+    clock.now = start + 2 * PERIOD
+    pacer.tick()
+    assert pacer.overruns == 1 and pacer.skipped == 1
+    assert pacer._next == pytest.approx(start + 3 * PERIOD)
+
+
+def test_rate_kept_after_stop(clock, pacer):
+    start = clock.now
+    for n in range(1, 33):
+        clock.now = start + n * PERIOD
+        pacer.tick()
+    pacer.stop()
+    # The time after stop() doesn't count - half a second of ticking at the target rate
+    clock.now = start + 60.0
+    stats = pacer.stats()
+    assert stats["ticks"] == 32
+    assert stats["rate"] == pytest.approx(RATE)
+    # Stopping again keeps the first stop time
+    pacer.stop()
+    assert pacer.stats()["rate"] == pytest.approx(RATE)
+
+
+def test_rate_while_running_uses_the_clock(clock, pacer):
+    start = clock.now
+    for n in range(1, 17):
+        clock.now = start + n * PERIOD
+        pacer.tick()
+    clock.now = start + 0.5
+    assert pacer.stats()["rate"] == pytest.approx(32.0)
+
+
+def test_start_clears_the_stats(clock, pacer):
+    clock.now += 5 * PERIOD
+    pacer.tick()
+    pacer.stop()
+    pacer.start()
+    stats = pacer.stats()
+    assert (stats["ticks"], stats["overruns"], stats["skipped"], stats["rate"]) == (0, 0, 0, 0.0)
+    assert pacer.remaining() == pytest.approx(PERIOD)
+
+
+def test_rate_must_be_positive():
+    with pytest.raises(ValueError):
+        FramePacer(0)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : test_headless_game.py
+# Description : The real game loop on the headless backend - button presses through VirtualButton,
+#               game_step() driving the state machine, and the panel decoded by VirtualSpi from the SPI
+#               traffic checked against the driver's shadow framebuffer and byte / transaction counters.
+############################################################################
+
+import os
+import shutil
+import threading
+
+import numpy as np
+import pytest
+
+import maze_scroll
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FILES = ("marble_pic.png", "success.png", "generated_maze.maze")
+
+
+def run_game(tmp_path, monkeypatch, screens=None):
+    # The game keeps its maze, pool and caches in the current folder - run it in an empty one
+    for name in FILES:
+        shutil.copy(os.path.join(REPO, name), str(tmp_path))
+    monkeypatch.chdir(str(tmp_path))
+    for name in ("MARBLE_MAZE_SCREENS", "MARBLE_MAZE_SEED", "MARBLE_MAZE_PERF"):
+        monkeypatch.delenv(name, raising=False)
+    if screens:
+        monkeypatch.setenv("MARBLE_MAZE_SCREENS", str(screens))
+    monkeypatch.setenv("MARBLE_MAZE_PIPELINE", "0")   # marble moved by game_step, on this thread
+    import marble_maze
+    marble_maze.set_difficulty(1)
+    marble_maze.setup("headless")
+    yield marble_maze
+    marble_maze.stop_pipeline()
+    marble_maze.maze_pool.stop()
+    if screens:
+        marble_maze.tall_mazes.stop()
+
+
+@pytest.fixture
+def game(tmp_path, monkeypatch):
+    for marble_maze in run_game(tmp_path, monkeypatch):
+        yield marble_maze
+
+
+@pytest.fixture
+def tall_game(tmp_path, monkeypatch):
+    for marble_maze in run_game(tmp_path, monkeypatch, screens=4):
+        yield marble_maze
+
+
+def rgb(color):
+    # RGB565 values to the RGB the panel shows, as VirtualSpi.image() decodes them
+    color = color.astype(np.uint32)
+    return np.dstack(((color >> 8) & 0xF8, (color >> 3) & 0xFC, (color << 3) & 0xF8)).astype(np.uint8)
+
+
+def check_panel(game, expected=None):
+    # What the SPI traffic put on the panel is what the driver thinks it sent (or the expected RGB565 view)
+    display, spi = game.st7789, game.backend.spi
+    if expected is None:
+        expected = display._framebuffer
+    assert np.array_equal(np.asarray(spi.image()), rgb(expected))
+    assert display.spi_bytes == spi.bytes
+    assert display.spi_transactions == spi.transactions
+
+
+def tall_view(game):
+    # A large maze is sent in bands of rows straight from the maze, not through the shadow framebuffer -
+    # the panel shows the maze rows from the top of the view, with the marble on them
+    top = game.viewport.top
+    view = game.maze.rgb565_rows(top, top + 240, 240)
+    x, y = game.marble_x, game.marble_y - top
+    view[y - 1:y + 2, x - 1:x + 2] = 0x07E0   # green
+    return view
+
+
+def press(game, index):
+    # Handle anything already queued (the pool reporting mazes ready), then the button press itself
+    while not game.events.empty():
+        game.game_step(0)
+    game.backend.press(index)
+    game.game_step(0.1)
+
+
+def step_until(game, done, seconds=3.0):
+    for _ in range(int(seconds * game.tick_rate)):
+        if done():
+            return
+        game.game_step(0.01)
+    raise AssertionError("timed out")
+
+
+def test_menu_play_and_back(game):
+    game.show_menu()
+    assert game.mode == game.MENU
+    check_panel(game)
+
+    # Button A plays the maze
+    press(game, 0)
+    assert game.mode == game.PLAYING
+    start = (game.marble_x, game.marble_y)
+    check_panel(game)
+    marble = np.asarray(game.backend.spi.image())[start[1], start[0]]
+    assert tuple(marble) == (0, 252, 0)   # the green marble, through RGB565
+
+    # Tilt the board towards the bottom of the maze until the marble has moved a few pixels
+    game.backend.bus.set_script(((1.0, -0.8, 0.3),))
+    sent = game.backend.spi.bytes
+    step_until(game, lambda: abs(game.marble_y - start[1]) + abs(game.marble_x - start[0]) >= 3)
+    assert game.tick_count > 0
+    check_panel(game)
+    # Marble moves only send the sprites, never the screen again
+    assert game.backend.spi.bytes - sent < 240 * 240 * 2
+
+    # Any button goes back to the menu
+    press(game, 1)
+    assert game.mode == game.MENU
+    check_panel(game)
+
+
+def test_difficulty_buttons_redraw_only_the_changes(game):
+    game.show_menu()
+    level = game.get_difficulty()
+    sent = game.backend.spi.bytes
+    press(game, 2)   # X - one level harder
+    assert game.get_difficulty() == level + 1
+    check_panel(game)
+    # Only the changed level digit is sent, not the whole menu
+    assert 0 < game.backend.spi.bytes - sent < 240 * 240 * 2 // 10
+
+
+def test_large_maze_is_generated_in_the_background(tall_game, monkeypatch):
+    game = tall_game
+    maker = game.tall_mazes
+    game.show_menu()
+    step_until(game, lambda: maker.stats()["ready"] == 1)
+
+    # From now on each maze takes until 'finish' is set
+    finish = threading.Event()
+    generate = maze_scroll.generate_tall_maze
+
+    def slow_generate(*args, **kwargs):
+        finish.wait()
+        return generate(*args, **kwargs)
+
+    monkeypatch.setattr(maze_scroll, "generate_tall_maze", slow_generate)
+    try:
+        # Playing takes the ready maze, and the worker starts on the next one
+        press(game, 0)
+        assert game.mode == game.PLAYING
+        assert maker.stats()["waits"] == 0
+        check_panel(game, tall_view(game))
+
+        # Play again before the next maze is ready - the game loop waits in the GENERATE state, still
+        # answering the buttons, rather than generating the maze itself
+        press(game, 1)
+        press(game, 0)
+        assert game.mode == game.GENERATE
+        assert maker.stats()["waits"] == 1
+        press(game, 1)
+        assert game.mode == game.MENU
+        check_panel(game)
+        press(game, 0)
+        assert game.mode == game.GENERATE
+    finally:
+        finish.set()
+
+    # Once it is ready the menu comes back, and A plays it
+    step_until(game, lambda: game.mode == game.MENU)
+    press(game, 0)
+    assert game.mode == game.PLAYING
+    assert maker.stats()["waits"] == 2
+    check_panel(game, tall_view(game))
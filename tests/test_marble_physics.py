@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : test_marble_physics.py
+# Description : Marble physics driven by recorded (time, ax, ay) tilt sequences - exact positions, wall
+#               stops and slides, and the same result however often the tilt is sampled.
+############################################################################
+
+from marble_physics import MarblePhysics, run_tilt_sequence
+
+# Tilting the board down to the right and back again, as read from the sensor (uneven sample times)
+RECORDED = [(0.000, 0.02, -0.01), (0.012, 0.35, 0.10), (0.021, 0.61, 0.22), (0.035, 0.74, 0.31),
+            (0.049, 0.80, 0.35), (0.058, 0.78, 0.36), (0.071, 0.69, 0.30), (0.086, 0.52, 0.18),
+            (0.098, 0.30, 0.02), (0.110, 0.05, -0.20), (0.127, -0.21, -0.44), (0.139, -0.45, -0.61),
+            (0.150, -0.62, -0.70), (0.166, -0.70, -0.72), (0.178, -0.66, -0.60), (0.190, -0.48, -0.35),
+            (0.203, -0.21, -0.08), (0.219, 0.01, 0.00), (0.231, 0.00, 0.01), (0.250, -0.01, 0.00)]
+
+
+def open_board(x, y):
+    return True
+
+
+def steady(tilt, seconds, interval):
+    # A constant (ax, ay) tilt sampled every interval seconds
+    return [(i * interval, tilt[0], tilt[1]) for i in range(int(round(seconds / interval)) + 1)]
+
+
+def test_recorded_sequence_positions():
+    physics = MarblePhysics(50, 50, open_board)
+    positions = run_tilt_sequence(physics, RECORDED)
+    assert positions == [(50, 50)] * 7 + [(51, 50)] * 5 + [(52, 50)] * 8
+    assert physics.steps == 50
+
+
+def test_replay_is_deterministic():
+    first = MarblePhysics(50, 50, open_board)
+    second = MarblePhysics(50, 50, open_board)
+    sequence = RECORDED + steady((0.9, -0.4), 1.0, 0.005)[1:]
+    assert run_tilt_sequence(first, sequence) == run_tilt_sequence(second, sequence)
+    assert (first.x, first.y, first.vx, first.vy) == (second.x, second.y, second.vx, second.vy)
+
+
+def test_same_path_at_any_sample_rate():
+    # The fixed timestep runs the same steps whether the tilt comes 256 or 64 times a second
+    # (1/256 s steps, so the sample times are exact)
+    fast = MarblePhysics(20, 20, open_board, timestep=1 / 256.0)
+    slow = MarblePhysics(20, 20, open_board, timestep=1 / 256.0)
+    fast_positions = run_tilt_sequence(fast, steady((1.0, 0.6), 2.0, 1 / 256.0))
+    slow_positions = run_tilt_sequence(slow, steady((1.0, 0.6), 2.0, 1 / 64.0))
+    assert fast_positions[::4] == slow_positions
+    assert (fast.x, fast.y) == (slow.x, slow.y)
+    assert slow_positions[-1][0] > 100
+
+
+def test_wall_stops_marble():
+    physics = MarblePhysics(50, 50, lambda x, y: x < 60)
+    positions = run_tilt_sequence(physics, steady((1.0, 0.0), 2.0, 0.005))
+    assert max(x for x, _ in positions) == 59
+    assert positions[-1] == (59, 50)
+    assert physics.x < 60
+
+
+def test_wall_bounce():
+    physics = MarblePhysics(58, 50, lambda x, y: x < 60, bounce=0.5)
+    physics.vx = 100.0
+    for _ in range(4):
+        physics.step(0.0, 0.0)
+    # Stopped at the edge of the last free pixel, heading back at half the speed it hit the wall
+    assert physics.pixel == (59, 50)
+    assert physics.x == 59.999
+    assert -50.0 < physics.vx < -48.0
+
+
+def test_slides_along_wall():
+    # Pushed into a wall on its right and down - x stops at the wall while y keeps going
+    physics = MarblePhysics(50, 50, lambda x, y: x < 52)
+    positions = run_tilt_sequence(physics, steady((1.0, 0.5), 0.3, 0.005))
+    assert positions[::6] == [(50, 50), (50, 50), (50, 50), (51, 51), (51, 51),
+                              (51, 52), (51, 52), (51, 53), (51, 54), (51, 55), (51, 56)]
+
+
+def test_level_board_dead_zone():
+    physics = MarblePhysics(50, 50, open_board)
+    positions = run_tilt_sequence(physics, steady((0.015, -0.015), 1.0, 0.005))
+    assert set(positions) == {(50, 50)}
+    assert (physics.vx, physics.vy) == (0.0, 0.0)
+
+
+def test_stall_runs_at_most_max_steps():
+    physics = MarblePhysics(50, 50, open_board, max_steps=20)
+    physics.update(1.0, 0.0, 0.0)
+    physics.update(1.0, 0.0, 1.0)
+    assert physics.steps == 20
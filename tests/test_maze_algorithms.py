@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : test_maze_algorithms.py
+# Description : Every maze generation algorithm makes perfect mazes - one path between any two corridor
+#               blocks - at odd and even sizes, and is_perfect() turns down mazes with loops or islands.
+############################################################################
+
+import numpy as np
+import pytest
+
+import maze_algorithms
+import tdf_maze_generator
+from tdf_maze_generator import CELL, WALL
+
+SEEDS = (0, 1, 2021, 80485)
+SIZES = ((15, 15), (16, 16), (15, 22), (30, 9)) + tuple(
+    (int(240 / thickness) - 1,) * 2 for thickness in tdf_maze_generator.difficulty)
+
+
+@pytest.mark.parametrize("algorithm", sorted(maze_algorithms.ALGORITHMS))
+@pytest.mark.parametrize("height, width", SIZES)
+def test_generated_mazes_are_perfect(algorithm, height, width):
+    for seed in SEEDS:
+        maze = maze_algorithms.carve(algorithm, height, width, seed)
+        assert maze.shape == (height, width)
+        assert maze_algorithms.is_perfect(maze), "{} {}x{} seed {}".format(algorithm, height, width, seed)
+
+
+def inner_wall(maze, corridors):
+    # An inner wall block with exactly 'corridors' corridor blocks beside it
+    for y in range(1, maze.shape[0] - 1):
+        for x in range(1, maze.shape[1] - 1):
+            beside = (maze[y - 1, x], maze[y + 1, x], maze[y, x - 1], maze[y, x + 1])
+            if maze[y, x] == WALL and beside.count(CELL) == corridors:
+                return y, x
+    raise AssertionError("no wall block with {} corridors beside it".format(corridors))
+
+
+@pytest.mark.parametrize("algorithm", sorted(maze_algorithms.ALGORITHMS))
+def test_loop_is_not_perfect(algorithm):
+    # Knocking out a wall between two corridors that are already joined makes a second path between them
+    maze = maze_algorithms.carve(algorithm, 21, 21, 7)
+    maze[inner_wall(maze, 2)] = CELL
+    assert not maze_algorithms.is_perfect(maze)
+
+
+def test_loop_and_island_is_not_perfect():
+    # One extra link from a loop and one extra block cut off from the rest - the counts match a tree, so
+    # only the connectivity check catches it
+    maze = maze_algorithms.carve("kruskal", 21, 21, 7)
+    maze[inner_wall(maze, 2)] = CELL
+    maze[inner_wall(maze, 0)] = CELL
+    corridor = maze == CELL
+    links = np.count_nonzero(corridor[1:] & corridor[:-1]) + np.count_nonzero(corridor[:, 1:] & corridor[:, :-1])
+    assert links == np.count_nonzero(corridor) - 1
+    assert not maze_algorithms.is_perfect(maze)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : test_maze_collision.py
+# Description : The free-space mask against a brute force footprint scan, and its cache beside the maze file.
+############################################################################
+
+import os
+
+import numpy as np
+import pytest
+
+import tdf_maze_generator
+from maze_collision import free_space_mask, load_free_space
+from maze_file import encode_maze, expand, load_maze
+
+
+def brute_force(pixels, marble_size):
+    before = marble_size // 2
+    after = marble_size - 1 - before
+    height, width = pixels.shape
+    free = np.zeros((height, width), dtype=bool)
+    for y in range(before, height - after):
+        for x in range(before, width - after):
+            free[y, x] = not pixels[y - before:y + after + 1, x - before:x + after + 1].any()
+    return free
+
+
+@pytest.mark.parametrize("marble_size", range(1, 6))
+def test_mask_matches_footprint_scan(marble_size):
+    maze, _ = tdf_maze_generator.generate_maze(4, 7)
+    pixels = expand(tdf_maze_generator.maze_walls(maze), tdf_maze_generator.difficulty[4])
+    assert np.array_equal(free_space_mask(pixels, marble_size), brute_force(pixels, marble_size))
+
+
+def test_cache_follows_the_file_contents(tmp_path):
+    # Two mazes of the same size written over the same file with the same timestamp - the cached mask of
+    # the first must not be used for the second
+    level, thickness = 3, tdf_maze_generator.difficulty[3]
+    path = str(tmp_path / "generated_maze.maze")
+    stamp = os.stat(str(tmp_path)).st_mtime_ns
+    masks = []
+    for seed in (1, 2):
+        maze, _ = tdf_maze_generator.generate_maze(level, seed)
+        data = encode_maze(tdf_maze_generator.maze_walls(maze), thickness, seed, solve=False)
+        assert len(data) == 107   # the same size for both
+        with open(path, "wb") as f:   # rewritten in place, so the inode stays the same too
+            f.write(data)
+        os.utime(path, ns=(stamp, stamp))
+        pixels = load_maze(path).pixels
+        free = load_free_space(path, pixels, 3)
+        assert np.array_equal(free, free_space_mask(pixels, 3))
+        masks.append(free)
+    assert not np.array_equal(masks[0], masks[1])
+    # And the second mask now comes from the cache
+    assert np.array_equal(load_free_space(path, load_maze(path).pixels, 3), masks[1])
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : test_maze_pack.py
+# Description : The maze pack scores - dead ends, junctions and branching of small hand-built mazes whose
+#               scores are known, with the entrance and exit doors not counted as dead ends.
+############################################################################
+
+import numpy as np
+
+from maze_file import Maze, decode_maze, encode_maze
+from maze_pack import maze_metrics
+
+
+def metrics(rows):
+    walls = np.array([[c == "#" for c in row] for row in rows])
+    header, walls = decode_maze(encode_maze(walls, 1, 7))
+    return maze_metrics(walls, Maze(header, walls).solution)
+
+
+def test_straight_corridor_has_no_dead_ends():
+    # The entrance and exit doors have one way out each, but they are the ends of the solution
+    scores = metrics(["#.#",
+                      "#.#",
+                      "#.#",
+                      "#.#"])
+    assert scores == {"solution_length": 3, "dead_ends": 0, "junctions": 0, "branching": 0.0}
+
+
+def test_one_branch_is_one_dead_end():
+    scores = metrics(["#.###",
+                      "#...#",
+                      "#.#.#",
+                      "#.###",
+                      "#.###"])
+    assert scores == {"solution_length": 4, "dead_ends": 1, "junctions": 1, "branching": 2.0}
+
+
+def test_dead_ends_next_to_the_doors():
+    # Dead ends in the second and second to last rows still count - only the doors' own rows are left out
+    scores = metrics(["##.##",
+                      "#...#",
+                      "##.##",
+                      "#...#",
+                      "##.##"])
+    assert scores["dead_ends"] == 4
+    assert scores["junctions"] == 2
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : test_maze_scaling.py
+# Description : The maze image and collision data scaled up from the cell grid (maze_file.expand and
+#               wall_image, as used by load_maze) against the original per-pixel loop of
+#               transcribemazefordisplay, for every difficulty level.
+############################################################################
+
+import numpy as np
+import pytest
+
+import tdf_maze_generator
+from maze_file import expand, load_maze, wall_image
+
+SEED = 20210804
+
+
+def loop_scale(maze, thickness):
+    # The original transcribemazefordisplay loops - (RGB image array, 1 byte per pixel collision data)
+    height, width = maze.shape
+    numpy_maze = np.zeros([height*thickness, width*thickness, 3], dtype=np.uint8)
+    numpy_maze_data = np.zeros([height*thickness, width*thickness, 1], dtype=np.uint8)
+    for i in range(0, height):
+        for j in range(0, width):
+            if maze[i][j] in (tdf_maze_generator.UNVISITED, tdf_maze_generator.CELL):
+                pass
+            else:
+                for k in range(0, thickness):
+                    for l in range(0, thickness):
+                        numpy_maze[i*thickness+k, j*thickness+l] = [255, 0, 0]
+                        numpy_maze_data[i*thickness+k, j*thickness+l] = 1
+    return numpy_maze, numpy_maze_data
+
+
+@pytest.mark.parametrize("level", range(len(tdf_maze_generator.difficulty)))
+def test_scaling_matches_loop(level):
+    thickness = tdf_maze_generator.difficulty[level]
+    maze, _ = tdf_maze_generator.generate_maze(level, SEED)
+    expected_image, expected_data = loop_scale(maze, thickness)
+
+    pixels = expand(tdf_maze_generator.maze_walls(maze), thickness)
+    assert np.array_equal(pixels, expected_data[:, :, 0])
+    assert np.array_equal(np.asarray(wall_image(pixels)), expected_image)
+
+
+@pytest.mark.parametrize("level", range(len(tdf_maze_generator.difficulty)))
+def test_loaded_maze_matches_loop(level, tmp_path):
+    # Through the maze file, the way the game gets them
+    thickness = tdf_maze_generator.difficulty[level]
+    maze, _ = tdf_maze_generator.generate_maze(level, SEED)
+    expected_image, expected_data = loop_scale(maze, thickness)
+
+    basename = str(tmp_path / "generated_maze")
+    tdf_maze_generator.save_maze_file(maze, thickness, basename, SEED)
+    loaded = load_maze(basename + ".maze")
+    assert np.array_equal(loaded.pixels, expected_data[:, :, 0])
+    assert np.array_equal(np.asarray(loaded.image()), expected_image)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : test_maze_solver.py
+# Description : Every generated maze can be solved from its entrance to its exit, the shortest path is a
+#               real path through the maze, and the path stored in the maze file reads back the same.
+############################################################################
+
+import numpy as np
+import pytest
+
+import maze_algorithms
+import maze_solver
+import tdf_maze_generator
+from maze_file import decode_maze, encode_maze, load_maze, write_maze
+
+SEEDS = range(20)
+
+
+def generated(level, seed, algorithm="prim"):
+    maze, _ = tdf_maze_generator.generate_maze(level, seed, algorithm)
+    return tdf_maze_generator.maze_walls(maze)
+
+
+def check_path(walls, solution):
+    path = np.array(solution.path)
+    assert tuple(path[0]) == solution.entrance and tuple(path[-1]) == solution.exit
+    assert not walls[path[:, 0], path[:, 1]].any()
+    assert (np.abs(np.diff(path, axis=0)).sum(axis=1) == 1).all()   # one cell up, down, left or right per move
+    assert solution.length == solution.distance[solution.entrance]
+
+
+@pytest.mark.parametrize("algorithm", sorted(maze_algorithms.ALGORITHMS))
+@pytest.mark.parametrize("level", range(len(tdf_maze_generator.difficulty)))
+def test_generated_mazes_are_solvable(level, algorithm):
+    thickness = tdf_maze_generator.difficulty[level]
+    for seed in SEEDS:
+        walls = generated(level, seed, algorithm)
+        header, _ = decode_maze(encode_maze(walls, thickness, solve=False))
+        solution = maze_solver.solve(walls, header.entrance, header.exit)
+        assert solution.solvable, "{} level {} seed {}".format(algorithm, level, seed)
+        check_path(walls, solution)
+
+
+@pytest.mark.parametrize("level", range(len(tdf_maze_generator.difficulty)))
+def test_stored_path_round_trip(level, tmp_path):
+    thickness = tdf_maze_generator.difficulty[level]
+    for seed in SEEDS:
+        walls = generated(level, seed)
+        path = str(tmp_path / "maze.maze")
+        write_maze(path, walls, thickness, seed)
+        maze = load_maze(path)
+        solution = maze_solver.solve(walls, maze.header.entrance, maze.header.exit)
+        assert maze.header.moves is not None
+        assert np.array_equal(maze.header.moves, solution.moves())
+        assert maze_solver.path_from_moves(maze.header.entrance, maze.header.moves) == solution.path
+        assert maze.solution.path == solution.path
+        assert maze.solution.solvable
+
+
+def test_distance_field():
+    walls = np.array([[1, 0, 1, 1],
+                      [1, 0, 0, 1],
+                      [1, 1, 0, 1],
+                      [1, 1, 0, 1]], dtype=bool)
+    distance = maze_solver.distance_field(walls, (3, 2))
+    U = maze_solver.UNREACHABLE
+    assert distance.tolist() == [[U, 4, U, U],
+                                 [U, 3, 2, U],
+                                 [U, U, 1, U],
+                                 [U, U, 0, U]]
+    solution = maze_solver.solve(walls, (0, 1), (3, 2))
+    assert solution.path == [(0, 1), (1, 1), (1, 2), (2, 2), (3, 2)]
+    assert solution.moves().tolist() == [maze_solver.DOWN, maze_solver.RIGHT, maze_solver.DOWN, maze_solver.DOWN]
+
+
+def test_unsolvable_maze_stores_no_path():
+    walls = np.array([[1, 0, 1],
+                      [1, 1, 1],
+                      [1, 0, 1]], dtype=bool)
+    solution = maze_solver.solve(walls, (0, 1), (2, 1))
+    assert not solution.solvable
+    assert solution.length is None
+    header, _ = decode_maze(encode_maze(walls, 15))
+    assert header.moves is None
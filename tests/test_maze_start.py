@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+#############################################################################
+# Filename    : test_maze_start.py
+# Description : The marble start position and exit row the maze loader works out (Maze.start and
+#               Maze.bottom_edge, as draw_maze uses them) against the original per-pixel scans of the maze
+#               image, for fixed mazes.
+############################################################################
+
+import os
+
+import pytest
+
+import maze_algorithms
+import tdf_maze_generator
+from maze_file import load_maze, wall_image
+
+SCREEN_SIZE = 240
+MAX_SCREEN_INDEX = 239
+START_Y = 5
+EDGE_X = 10
+SEEDS = (1, 2021, 80485)
+SHIPPED_MAZE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "generated_maze.maze")
+
+
+def pixel_scan(image):
+    # The original draw_maze scans - (initial_x, initial_y), exit_index_y
+    pixels = image.load()
+    entrance_found = False
+    for i in range(1, MAX_SCREEN_INDEX):
+        if pixels[i, 5] == (0, 0, 0):
+            entrance_start_index_x = i
+            entrance_found = True
+            break
+    assert entrance_found
+    for i in range(entrance_start_index_x, MAX_SCREEN_INDEX):
+        if pixels[i, 5] != (0, 0, 0):
+            entrance_end_index_x = i
+            break
+    initial_x = int((entrance_start_index_x + entrance_end_index_x)/2)
+
+    for i in range(MAX_SCREEN_INDEX, 1, -1):
+        if pixels[10, i] != (0, 0, 0):
+            return (initial_x, 5), i - 3
+    raise AssertionError("no bottom edge")
+
+
+def check(path):
+    maze = load_maze(path, start_y=START_Y, edge_x=EDGE_X)
+    start, exit_index_y = pixel_scan(wall_image(maze.pixels, SCREEN_SIZE))
+    assert maze.start == start
+    assert maze.bottom_edge - 3 == exit_index_y
+
+
+def test_shipped_maze():
+    check(SHIPPED_MAZE)
+
+
+@pytest.mark.parametrize("algorithm", sorted(maze_algorithms.ALGORITHMS))
+@pytest.mark.parametrize("level", range(len(tdf_maze_generator.difficulty)))
+def test_generated_mazes(level, algorithm, tmp_path):
+    for seed in SEEDS:
+        maze, _ = tdf_maze_generator.generate_maze(level, seed, algorithm)
+        basename = str(tmp_path / "maze{}".format(seed))
+        tdf_maze_generator.save_maze_file(maze, tdf_maze_generator.difficulty[level], basename, seed)
+        check(basename + ".maze")